@@ -17,7 +17,9 @@
  * External dependencies defined in parent HTML file generated by Python
  *
  *  BASKET: List of foreign currencies currently in basket
+ *  BASE_CURRENCY: Currency rates are shown against, USD by default
  *  CL_TS: Currency Layer timestamp return by API call
+ *  CURRENCY_INDEX: URL of currency_index.json generated by suggest.py
  */
 
 // Define global constants used in functions below. Using constants
@@ -26,6 +28,7 @@
 const URL = window.location;
 const URL_BASE = URL.origin + URL.pathname;
 const URL_BASKET = URL_BASE + '?currencies=' + BASKET;
+const URL_CURRENCY = BASE_CURRENCY === 'USD' ? '' : '&base=' + BASE_CURRENCY;
 
 const SPREAD = document.getElementById('spread_input');
 
@@ -45,7 +48,16 @@ function resetDefaults() {
 
 function changeSpread(action) {
   let newSpread = SPREAD.value;
-  let newUrl = URL_BASKET + '&spread=' + newSpread;
+  let newUrl = URL_BASKET + '&spread=' + newSpread + URL_CURRENCY;
+  location.replace(newUrl);
+  }
+
+// Show rates against the selected base currency. Rebasing is done by the
+// Lambda function from the quotes it already has
+
+function changeBase() {
+  let newBase = document.getElementById('base_input').value;
+  let newUrl = URL_BASKET + '&spread=' + SPREAD.value + '&base=' + newBase;
   location.replace(newUrl);
   }
 
@@ -54,15 +66,86 @@ function changeSpread(action) {
 
 function addCurrency(action) {
   var spread = SPREAD.value;
-  var newAbbr = document.getElementById('currency_abbr').value;
+  var newAbbr = pickCurrency(document.getElementById('currency_abbr').value);
   if (newAbbr) {
-    let newUrl = URL_BASKET + ',' + newAbbr + '&spread=' + spread;
+    let newUrl = URL_BASKET + ',' + newAbbr + '&spread=' + spread + URL_CURRENCY;
     location.replace(newUrl);
     } else {
       alert('Please select a currency before submitting');
     }
   }
 
+// Currency picker type-ahead. The static index of [code, name, words] is
+// loaded once (and cached by the browser); until it arrives, or if it cannot
+// be loaded, each keystroke asks the Lambda function via ?suggest= instead.
+
+const SUGGEST_LIMIT = 10;
+var currencyIndex = null;
+
+function foldText(text) {
+  return text.normalize('NFKD').replace(/[\u0300-\u036f]/g, '').toLowerCase();
+  }
+
+function searchIndex(query) {
+  let words = foldText(query).split(/[\s(),.-]+/).filter(Boolean);
+  let basket = BASKET.toUpperCase().split(',');
+  let ranked = [];
+  if (!words.length) {
+    return ranked;
+    }
+  for (let [code, name, tokens] of currencyIndex) {
+    if (basket.includes(code)) {
+      continue;
+      }
+    let haystack = [code.toLowerCase()].concat(tokens.split(' '));
+    if (words.every(w => haystack.some(h => h.startsWith(w)))) {
+      let lower = code.toLowerCase();
+      let rank = lower == words[0] ? 0 : lower.startsWith(words[0]) ? 1 : 2;
+      ranked.push([rank, code, name]);
+      }
+    }
+  ranked.sort((a, b) => a[0] - b[0] || a[1].localeCompare(b[1]));
+  return ranked.slice(0, SUGGEST_LIMIT).map(r => ({code: r[1], name: r[2]}));
+  }
+
+function showSuggestions(matches) {
+  let list = document.getElementById('currency_list');
+  list.innerHTML = '';
+  for (let match of matches) {
+    let option = document.createElement('option');
+    option.value = match.code;
+    option.label = match.name;
+    list.appendChild(option);
+    }
+  }
+
+function suggestCurrency() {
+  let query = document.getElementById('currency_abbr').value;
+  if (currencyIndex) {
+    showSuggestions(searchIndex(query));
+    } else if (query) {
+      fetch(URL_BASKET + '&suggest=' + encodeURIComponent(query))
+        .then(resp => resp.json())
+        .then(showSuggestions)
+        .catch(err => console.log('Suggest failed: ' + err));
+    }
+  }
+
+// Accept a currency code, or a name which matches exactly one currency
+
+function pickCurrency(text) {
+  text = text.trim();
+  if (currencyIndex) {
+    let code = text.toUpperCase();
+    if (currencyIndex.some(c => c[0] == code)) {
+      return code;
+      }
+    let matches = searchIndex(text);
+    return matches.length == 1 ? matches[0].code : '';
+    }
+  return text.toUpperCase();
+  }
+
 // If window.onload has not already been assigned a function, the function
 // passed to addLoadEvent is simply assigned to window.onload. If window.onload
 // has already been set, a brand new function is created which first calls the
@@ -90,6 +173,9 @@ function addLoadEvent(func) {
 // seconds since the epoch times 1000
 
 addLoadEvent(function() {
+  if (!document.getElementById('t_stamp')) {
+    return;             // No quotes were available
+    }
   const OPTIONS = {year: 'numeric', month: 'short', day: 'numeric'}
   OPTIONS.hour = 'numeric';
   OPTIONS.minute = 'numeric';
@@ -101,3 +187,14 @@ addLoadEvent(function() {
   document.getElementById('t_stamp').innerHTML = 'Rates as of ' + newTS;
   console.log('New Header: ' + document.getElementById('t_stamp').outerHTML);
   })
+
+// Load the currency index and attach the type-ahead handler
+
+addLoadEvent(function() {
+  document.getElementById('currency_abbr')
+    .addEventListener('input', suggestCurrency);
+  fetch(CURRENCY_INDEX)
+    .then(resp => resp.json())
+    .then(data => { currencyIndex = data.currencies; })
+    .catch(err => console.log('Currency index unavailable: ' + err));
+  })
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Bulk load historical exchange rates into the rate history store (see
+    history.py) and optionally seed missing DynamoDB baselines.
+
+    Sources may be the Currency Layer API or local dumps:
+
+        python3 backfill.py --api 2015-01-01 2018-12-31
+        python3 backfill.py --api 2018-01-01 2018-01-31 --endpoint historical
+        python3 backfill.py dumps/timeframe_2017.json dumps/rates.csv
+
+    Supported files:
+
+        *.json   Currency Layer 'timeframe' or 'historical' response
+        *.jsonl  One 'historical' style object per line, or objects with
+                 timestamp (or date), currency and rate fields
+        *.csv    Long format with columns date (or timestamp), currency, rate
+                 or wide format with a date column and one column per code
+
+    All sources are stream parsed and written in batches, so memory use
+    does not grow with the number of rows. --rate limits writes per second
+    to stay within provisioned DynamoDB capacity.
+
+    Author: Michael O'Connor
+"""
+
+import sys
+import csv
+import argparse
+from time import sleep, monotonic, strptime
+from calendar import timegm
+from datetime import date, timedelta
+from json import loads
+
+import history
+from jsonstream import iter_members
+
+TIMEFRAME_DAYS = 365            # Max days per Currency Layer timeframe call
+PROGRESS = 100000               # Print progress every this many rows
+
+
+class RateLimiter:
+    """Token bucket allowing rate operations per second on average"""
+
+    def __init__(self, rate):
+
+        self.rate = rate
+        self.tokens = rate
+        self.last = monotonic()
+
+    def wait(self, count=1):
+
+        if not self.rate:
+            return
+
+        while True:
+            now = monotonic()
+            self.tokens = min(self.rate,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= count or count > self.rate:
+                self.tokens -= count
+                return
+            sleep((count - self.tokens) / self.rate)
+
+
+def day_end(day):
+    """UNIX time of the last second of a YYYY-MM-DD date (UTC), which is
+       the timestamp Currency Layer uses for historical quotes
+    """
+
+    return timegm(strptime(day[:10], '%Y-%m-%d')) + 86399
+
+
+def to_tstamp(value):
+    """Accept UNIX time or YYYY-MM-DD date and return UNIX time"""
+
+    value = str(value).strip()
+
+    if value.isdigit():
+        return int(value)
+
+    return day_end(value)
+
+
+def abbr_of(code):
+    """'USDEUR' -> 'EUR', 'EUR' -> 'EUR'"""
+
+    code = code.strip().upper()
+
+    return code[3:] if len(code) == 6 else code
+
+
+def rows_from_json(fp):
+    """Yield (tstamp, abbr, rate) from a Currency Layer JSON response"""
+
+    fields = {}
+    pending = []                # historical quotes seen before timestamp
+
+    for name, value in iter_members(fp, expand=('quotes',)):
+        if not isinstance(name, tuple):
+            fields[name] = value
+            if name == 'success' and value is False:
+                raise ValueError('Currency Layer error response')
+            continue
+
+        key = name[1]
+
+        if isinstance(value, dict):                     # timeframe
+            tstamp = day_end(key)
+            for exch, rate in value.items():
+                yield tstamp, abbr_of(exch), rate
+        elif 'timestamp' in fields or 'date' in fields:  # historical
+            yield to_tstamp(fields.get('timestamp') or fields['date']), \
+                  abbr_of(key), value
+        else:
+            pending.append((key, value))
+
+    if pending:
+        tstamp = to_tstamp(fields.get('timestamp') or fields['date'])
+        for key, value in pending:
+            yield tstamp, abbr_of(key), value
+
+
+def rows_from_jsonl(fp):
+    """Yield (tstamp, abbr, rate) from JSON lines"""
+
+    for line in fp:
+        if not line.strip():
+            continue
+        record = loads(line)
+        tstamp = to_tstamp(record.get('timestamp') or record['date'])
+        if 'quotes' in record:
+            for exch, rate in record['quotes'].items():
+                yield tstamp, abbr_of(exch), rate
+        else:
+            yield tstamp, abbr_of(record['currency']), record['rate']
+
+
+def rows_from_csv(fp):
+    """Yield (tstamp, abbr, rate) from long or wide format CSV"""
+
+    reader = csv.reader(fp)
+    header = [h.strip().lower() for h in next(reader)]
+
+    if 'currency' in header and 'rate' in header:
+        when = header.index('timestamp' if 'timestamp' in header else 'date')
+        cur = header.index('currency')
+        rate = header.index('rate')
+        for row in reader:
+            if row:
+                yield to_tstamp(row[when]), abbr_of(row[cur]), float(row[rate])
+    else:
+        codes = [abbr_of(h) for h in header[1:]]
+        for row in reader:
+            if not row:
+                continue
+            tstamp = to_tstamp(row[0])
+            for abbr, value in zip(codes, row[1:]):
+                if value.strip():
+                    yield tstamp, abbr, float(value)
+
+
+def rows_from_file(path):
+    """Dispatch on file extension"""
+
+    if path.endswith('.csv'):
+        opener, parser = (lambda p: open(p, newline='')), rows_from_csv
+    elif path.endswith('.jsonl'):
+        opener, parser = open, rows_from_jsonl
+    else:
+        opener, parser = (lambda p: open(p, 'rb')), rows_from_json
+
+    with opener(path) as fp:
+        yield from parser(fp)
+
+
+def rows_from_api(start, end, endpoint='timeframe', currencies=None):
+    """Yield (tstamp, abbr, rate) from the Currency Layer API between start
+       and end dates (YYYY-MM-DD), using one 'timeframe' call per year or
+       one 'historical' call per day
+    """
+
+    from urllib.request import urlopen
+    from currency_config import BASE, CL_KEY
+
+    first = date(*strptime(start, '%Y-%m-%d')[:3])
+    last = date(*strptime(end, '%Y-%m-%d')[:3])
+    step = TIMEFRAME_DAYS if endpoint == 'timeframe' else 1
+    extra = '&currencies=' + currencies if currencies else ''
+
+    while first <= last:
+        stop = min(last, first + timedelta(days=step - 1))
+
+        if endpoint == 'timeframe':
+            url = '{}timeframe?access_key={}&start_date={}&end_date={}{}'.\
+                  format(BASE, CL_KEY, first, stop, extra)
+        else:
+            url = '{}historical?access_key={}&date={}{}'.\
+                  format(BASE, CL_KEY, first, extra)
+
+        print('Fetching {} {} - {}'.format(endpoint, first, stop))
+
+        with urlopen(url) as response:
+            yield from rows_from_json(response)
+
+        first = stop + timedelta(days=1)
+
+
+def progress(rows, latest):
+    """Pass rows through, recording the newest rate per currency in latest
+       and printing a running count
+    """
+
+    count = 0
+
+    for row in rows:
+        tstamp, abbr, rate = row
+        if abbr not in latest or latest[abbr][0] < tstamp:
+            latest[abbr] = (tstamp, rate)
+        count += 1
+        if count % PROGRESS == 0:
+            print('{:,} rows...'.format(count))
+        yield row
+
+
+def seed_baselines(latest):
+    """Create DynamoDB baseline rows for currencies which have none, using
+       the newest backfilled rate. Existing baselines are left alone.
+    """
+
+    import boto3
+    from decimal import Decimal
+    from botocore.exceptions import ClientError
+    from currency_config import DYNAMO_DB_TABLE
+
+    table = boto3.resource('dynamodb').Table(DYNAMO_DB_TABLE)
+    created = 0
+
+    for abbr, (tstamp, rate) in sorted(latest.items()):
+        try:
+            table.put_item(Item={'Abbr': abbr,
+                                 'Rate': Decimal(str(rate)),
+                                 'Tstamp': Decimal(tstamp)},
+                           ConditionExpression='attribute_not_exists(Abbr)')
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        else:
+            created += 1
+
+    print('Seeded {} missing baselines'.format(created))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description='Bulk load historical exchange rates')
+    parser.add_argument('files', nargs='*',
+                        help='JSON, JSON lines or CSV dumps to load')
+    parser.add_argument('--api', nargs=2, metavar=('START', 'END'),
+                        help='Fetch dates START to END (YYYY-MM-DD)')
+    parser.add_argument('--endpoint', default='timeframe',
+                        choices=('timeframe', 'historical'))
+    parser.add_argument('--currencies', default=None, metavar='EUR,GBP',
+                        help='Limit API requests to these currencies')
+    parser.add_argument('--store', default=None,
+                        help="'dynamodb' or SQLite path (default: config)")
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Max rows written per second (0 = unlimited)')
+    parser.add_argument('--baselines', action='store_true',
+                        help='Seed missing DynamoDB baselines afterwards')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Parse and count rows without writing')
+    args = parser.parse_args(argv)
+
+    if not args.files and not args.api:
+        parser.error('Specify --api START END and/or one or more files')
+
+    def sources():
+        if args.api:
+            yield from rows_from_api(args.api[0], args.api[1],
+                                     args.endpoint, args.currencies)
+        for path in args.files:
+            print('Reading {}'.format(path))
+            yield from rows_from_file(path)
+
+    latest = {}
+    rows = progress(sources(), latest)
+
+    if args.dry_run:
+        count = sum(1 for _ in rows)
+    else:
+        store = history.open_store(args.store)
+        try:
+            count = store.put_many(rows, RateLimiter(args.rate))
+        finally:
+            store.close()
+
+    print('{:,} rows for {} currencies {}'.format(
+          count, len(latest), 'parsed' if args.dry_run else 'written'))
+
+    if args.baselines and not args.dry_run:
+        seed_baselines(latest)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
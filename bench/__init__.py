@@ -0,0 +1,6 @@
+'''Benchmark and load-test tooling for the Currency Exchange Rate project.
+
+   Scripts in this package are run from the repository root, e.g.:
+
+       python3 -m bench.replay --events bench/events.jsonl --concurrency 4
+'''
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Microbenchmarks for the rendering and rate-math hot paths.
+
+       python3 -m bench.micro                          # run and print
+       python3 -m bench.micro --save bench/micro.json  # record a baseline
+       python3 -m bench.micro --compare bench/micro.json --threshold 0.25
+
+   Times functions from currency_lambda.py, lambda.py, exchange.py and
+   chart.py with fixture quote sets of 6, 30 and all currencies and a year
+   of hourly rates. Currency Layer responses
+   and S3 fragments are read through urlopen() from local file:// URLs and
+   DynamoDB is replaced by bench.stubs.FakeTable, so results measure this
+   code rather than the network.
+
+   Each case reports the best of --repeat runs in microseconds per call.
+   With --compare, the exit status is 1 if any case is slower than the
+   baseline by more than --threshold (0.25 = 25%) and by more than
+   --min-delta microseconds, as sub-microsecond cases are mostly timer
+   noise. Baselines are machine specific; record one on the machine which
+   runs the comparison.
+'''
+
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+import importlib
+import platform
+from timeit import Timer
+from decimal import Decimal
+
+import currency_config
+from bench.stubs import fixture_quotes, configure_s3, FakeTable, S3_DIR
+
+SIZES = (6, 30, len(currency_config.CURR_ABBRS))
+TSTAMP = 1549022400
+
+
+def file_url(path):
+    return 'file://' + os.path.abspath(path)
+
+
+def write_fixtures(directory, sizes):
+    '''Write a Currency Layer 'live' response for each basket size.
+       Return {size: (basket string, file URL, response dictionary)}
+    '''
+
+    universe = fixture_quotes()
+    codes = list(currency_config.CURR_ABBRS)
+    fixtures = {}
+
+    for size in sizes:
+        basket = codes[:size]
+        response = {'success': True, 'timestamp': TSTAMP, 'source': 'USD',
+                    'quotes': {'USD' + c: universe['USD' + c]
+                               for c in basket}}
+        path = os.path.join(directory, 'live_{}.json'.format(size))
+        with open(path, 'w') as f:
+            json.dump(response, f)
+        fixtures[size] = (','.join(basket), file_url(path), response)
+
+    return fixtures
+
+
+def cases(fixtures):
+    '''Yield (name, callable) for every benchmark case'''
+
+    configure_s3(currency_config, file_url(S3_DIR) + '/')
+
+    import chart
+    import metrics
+    import providers
+    import currency_lambda
+    from quotes import QuoteSet
+
+    lam = importlib.import_module('lambda')     # 'lambda' is a keyword
+    import exchange
+
+    metrics.start('bench')
+    currency_config.SNAPSHOT_PATH = None
+
+    table = FakeTable(currency_config.DYNAMO_DB_TABLE)
+    table.seed(fixture_quotes(), TSTAMP - 3600)
+    currency_lambda.db_connect = lambda name: table
+
+    head_url = file_url(os.path.join(S3_DIR, 'currency_head.html'))
+
+    yield 'currency_lambda.t_stamp', \
+        lambda: currency_lambda.t_stamp(Decimal(TSTAMP))
+    yield 'currency_lambda.read_html', \
+        lambda: currency_lambda.read_html(head_url)
+    yield 'currency_lambda.fetch_html', \
+        lambda: currency_lambda.fetch_html(head_url)
+    yield 'currency_lambda.page_parts', currency_lambda.page_parts
+    yield 'lambda.t_stamp', lambda: lam.t_stamp(TSTAMP)
+    yield 'exchange.t_stamp', lambda: exchange.t_stamp(TSTAMP)
+
+    # Chart downsampling: a year of hourly rates to a chart, and a cached
+    # range tier to a sparkline
+
+    hourly = [(TSTAMP + i * 3600, 1 + (i * 7919 % 1000) / 1e5)
+              for i in range(365 * 24)]
+    tier = chart.lttb(hourly, chart.TIER_POINTS)
+
+    yield 'chart.lttb[8760->500]', lambda: chart.lttb(hourly, 500)
+    yield 'chart.minmax[8760->500]', lambda: chart.minmax(hourly, 500)
+    yield 'chart.sparkline[2000->40]', \
+        lambda: chart.sparkline(chart.lttb(tier, 40))
+
+    for size, (basket, url, response) in fixtures.items():
+        quotes = QuoteSet.from_json(response)
+        previous = QuoteSet.from_json(
+            {'quotes': {k: v * 1.001 for k, v in response['quotes'].items()}})
+
+        # currency_lambda: quotes from the 'file' provider, baselines cached
+
+        feed = currency_lambda.CurrencyLayer(
+            '', 'live', '', basket,
+            provider=providers.FileProvider(url[len('file://'):]))
+        feed.quotes = quotes
+        feed.cl_ts = TSTAMP
+
+        def cold_rates(feed=feed):
+            currency_lambda._cache['baselines'].clear()
+            return feed.get_rates(1.0)
+
+        feed.get_rates(1.0)
+
+        # Full page: quotes from the fixture file via the configured
+        # providers, rather than Currency Layer
+
+        def render(basket=basket, url=url):
+            currency_config.PROVIDERS = ['file:' + url[len('file://'):]]
+            currency_lambda._cache['pages'].clear()
+            return currency_lambda.render_page(basket, 1.0)
+
+        page = render()
+        assert "<div class='quotes'><pre>" in page, \
+            'render_page[{}] rendered no rates'.format(size)
+
+        # Rebasing to another currency in the basket, e.g. ?base=AFN
+
+        other = basket.split(',')[1]
+        rebased = currency_lambda.CurrencyLayer(
+            '', 'live', '', basket, provider=feed.provider, currency=other)
+        rebased.quotes = quotes
+        rebased.cl_ts = TSTAMP
+
+        yield 'quotes.rebase[{}]'.format(size), \
+            lambda q=quotes, other=other: q.rebase(other)
+        yield 'currency_lambda.get_rates_rebased[{}]'.format(size), \
+            lambda feed=rebased: feed.get_rates(1.0)
+        yield 'currency_lambda.read_quotes[{}]'.format(size), \
+            lambda url=url: providers.read_quotes(url)
+        yield 'currency_lambda.get_rates[{}]'.format(size), \
+            lambda feed=feed: feed.get_rates(1.0)
+        yield 'currency_lambda.get_rates_db[{}]'.format(size), cold_rates
+        yield 'currency_lambda.get_list[{}]'.format(size), \
+            lambda feed=feed: feed.get_list(currency_config.CURR_ABBRS)
+        yield 'currency_lambda.build_select[{}]'.format(size), \
+            lambda feed=feed: feed.build_select(currency_config.CURR_ABBRS)
+        yield 'currency_lambda.render_page[{}]'.format(size), render
+
+        # lambda.py: fetches its own quotes on every get_rates() call
+
+        lam_feed = lam.CurrencyLayer('', 'live', '', basket)
+        lam_feed.cl_url = url
+
+        yield 'lambda.get_rates[{}]'.format(size), \
+            lambda f=lam_feed: f.get_rates(1.0)
+        yield 'lambda.get_list[{}]'.format(size), \
+            lambda basket=basket: lam.get_list(basket)
+        yield 'lambda.build_select[{}]'.format(size), \
+            lambda basket=basket: lam.build_select(basket)
+
+        # exchange.py: one monitor() pass is a fetch, decode and compare
+
+        ex_feed = exchange.CurrencyLayer('', ())
+
+        yield 'exchange.get_rates[{}]'.format(size), \
+            lambda f=ex_feed, url=url: f.get_rates(url)
+        yield 'exchange.compare[{}]'.format(size), \
+            lambda q=quotes, p=previous: (q.same_rates(p), q.diff(p))
+
+
+def time_case(func, repeat):
+    '''Best of repeat runs in microseconds per call'''
+
+    timer = Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1e6
+
+
+def compare(results, baseline, threshold, min_delta):
+    '''Print comparison table; return list of case names slower than
+       baseline by more than threshold (fraction) and min_delta (us)
+    '''
+
+    regressed = []
+
+    print('{:40} {:>12} {:>12} {:>8}'.format('case', 'baseline us', 'now us',
+                                             'change'))
+
+    for name, now in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print('{:40} {:>12} {:>12.2f}'.format(name, '-', now))
+            continue
+        change = now / base - 1
+        flag = ''
+        if change > threshold and now - base > min_delta:
+            regressed.append(name)
+            flag = '  REGRESSION'
+        print('{:40} {:>12.2f} {:>12.2f} {:>+7.1%}{}'.format(
+              name, base, now, change, flag))
+
+    return regressed
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--filter', default='',
+                        help='Only run cases whose name contains this text')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', metavar='PATH',
+                        help='Write results as a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='Compare with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown before failing (0.25 = 25%%)')
+    parser.add_argument('--min-delta', type=float, default=2.0,
+                        help='Ignore slowdowns below this many us (noise)')
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.CRITICAL)
+
+    tmp = tempfile.mkdtemp(prefix='micro')
+    results = {}
+
+    try:
+        for name, func in cases(write_fixtures(tmp, SIZES)):
+            if args.filter in name:
+                results[name] = round(time_case(func, args.repeat), 3)
+                if not args.compare:
+                    print('{:40} {:>12.2f} us'.format(name, results[name]))
+    finally:
+        shutil.rmtree(tmp)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': results}, f, indent=2, sort_keys=True)
+        print('Saved {}'.format(args.save))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressed = compare(results, baseline, args.threshold,
+                            args.min_delta)
+        if regressed:
+            print('{} case(s) regressed by more than {:.0%}'.format(
+                  len(regressed), args.threshold))
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Per-row cost of the rate and spread arithmetic in currency_lambda.
+
+       python3 -m bench.rates
+
+   Times the float arithmetic now used by CurrencyLayer.get_rates() against
+   the precision 6 Decimal arithmetic it replaced, for baskets of 6, 30 and
+   all currencies, and counts rows where the displayed digits differ, which
+   should be none: floats are rounded to 6 significant digits wherever
+   Decimal rounded.
+   Also times get_rates() itself with baselines already cached so no
+   DynamoDB access is involved.
+'''
+
+import sys
+import argparse
+from timeit import Timer
+from decimal import Decimal, localcontext
+
+import currency_config
+from quotes import QuoteSet
+from bench.stubs import fixture_quotes
+
+FMT = "{:>9.4f} ({:>9.4f})  {:>7.4f} ({:>6.4f}) {:>3.2f}%"
+FLOAT_FMT = "%9.4f (%9.4f)  %7.4f (%6.4f) %3.2f%%"
+
+
+def decimal_rows(quotes, olds, spread):
+    '''Row arithmetic as previously implemented with Decimal'''
+
+    out = []
+
+    with localcontext() as ctx:
+        ctx.prec = 6
+        spread = Decimal(spread) / 100
+        for exch, cur_rate in quotes.items():
+            cur_rate = Decimal(str(cur_rate))
+            usd_spread = (1/cur_rate)*(1+spread)
+            for_spread = cur_rate*(1/(1+spread))
+            old_rate = Decimal(olds[exch])
+            change_pct = (1 - (cur_rate / old_rate)) * 100
+            out.append(FMT.format(1/cur_rate, usd_spread, cur_rate,
+                                  for_spread, abs(change_pct)))
+
+    return out
+
+
+def float_rows(quotes, olds, spread):
+    '''Row arithmetic as implemented in CurrencyLayer.get_rates(): floats
+       over the QuoteSet rate array, rounded as precision 6 Decimal was
+    '''
+
+    from currency_lambda import sig6, half_even
+
+    out = []
+    markup = sig6(1 + sig6(float(spread) / 100))
+    markdown = sig6(1 / markup)
+    rates = quotes.rates
+
+    for i, old in zip(quotes.order, olds):
+        cur_rate = rates[i]
+        inv_rate = sig6(1 / cur_rate)
+        old_rate = float(old) or cur_rate
+        change_pct = sig6((1 - sig6(cur_rate / old_rate)) * 100)
+        out.append(FLOAT_FMT % (half_even(inv_rate),
+                                sig6(inv_rate * markup, 4),
+                                half_even(cur_rate),
+                                sig6(cur_rate * markdown, 4),
+                                half_even(abs(change_pct), 2)))
+
+    return out
+
+
+def per_row_us(func, count, number):
+    '''Best of 5 repeats, in microseconds per row'''
+
+    best = min(Timer(func).repeat(5, number))
+    return best / number / count * 1e6
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=200)
+    parser.add_argument('--spread', default='1.0')
+    args = parser.parse_args(argv)
+
+    import metrics
+    import currency_lambda
+
+    universe = fixture_quotes()
+    olds = {e: Decimal(str(round(r * 1.003, 6))) for e, r in universe.items()}
+    codes = list(currency_config.CURR_ABBRS)
+
+    print('{:>8} {:>12} {:>12} {:>14} {:>10}'.format(
+          'basket', 'decimal us', 'float us', 'get_rates us', 'differ'))
+
+    for size in (6, 30, len(codes)):
+        quotes = {'USD' + c: universe['USD' + c] for c in codes[:size]}
+
+        # Pre-load baselines so get_rates() never reaches for DynamoDB
+
+        for exch in quotes:
+            currency_lambda.cache_put('baselines', exch[3:],
+                                      {'Abbr': exch[3:], 'Rate': olds[exch],
+                                       'Tstamp': Decimal(1999999999)})
+
+        feed = currency_lambda.CurrencyLayer('', 'live', '',
+                                             ','.join(codes[:size]))
+        feed.quotes = QuoteSet.from_json(quotes)
+        baselines = [olds[exch] for exch in quotes]
+        feed.cl_ts = 1999999999
+        metrics.start('bench')
+
+        dec_us = per_row_us(lambda: decimal_rows(quotes, olds, args.spread),
+                            size, args.number)
+        flt_us = per_row_us(lambda: float_rows(feed.quotes, baselines,
+                                               args.spread),
+                            size, args.number)
+        get_us = per_row_us(lambda: feed.get_rates(args.spread),
+                            size, args.number)
+
+        differ = sum(a != b for a, b in zip(
+                     decimal_rows(quotes, olds, args.spread),
+                     float_rows(feed.quotes, baselines, args.spread)))
+
+        print('{:>8} {:>12.2f} {:>12.2f} {:>14.2f} {:>10}'.format(
+              size, dec_us, flt_us, get_us, differ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
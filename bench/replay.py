@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Replay recorded API Gateway events against currency_lambda.lambda_handler
+   and report latency percentiles, throughput and a per-phase breakdown.
+
+   External services are replaced by the stand-ins in bench/stubs.py so
+   results reflect the code under test rather than the network:
+
+       python3 -m bench.replay --events bench/events.jsonl \\
+                               --concurrency 8 --iterations 50
+
+   Events file is JSON lines; each line is either an API Gateway event, e.g.
+   {"params": {"querystring": {"currencies": "EUR,GBP"}}}, or an object
+   with the event under an "event" key.
+
+   The phase breakdown comes from the spans recorded by metrics.py inside
+   the handler, i.e. the same numbers production emits to CloudWatch.
+'''
+
+import sys
+import logging
+import argparse
+from json import loads, dumps
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import currency_config
+from bench.stubs import StubServer, FakeTable, fixture_quotes
+
+
+def load_events(path):
+    '''Read JSON lines file and return list of API Gateway events'''
+
+    events = []
+
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            record = loads(line)
+            events.append(record.get('event', record))
+
+    return events
+
+
+def percentile(samples, pct):
+    '''Return the pct percentile of a sorted list using nearest rank'''
+
+    if not samples:
+        return 0.0
+
+    rank = max(0, min(len(samples) - 1,
+                      int(round(pct / 100 * len(samples) + 0.5)) - 1))
+    return samples[rank]
+
+
+def invoke(handler, event):
+    '''Run one invocation and return (elapsed seconds, phase dict). The
+       handler leaves its span timings in metrics.current() for this thread
+    '''
+
+    start = perf_counter()
+    handler(event, None)
+    elapsed = perf_counter() - start
+
+    phases = dict(metrics.current().spans)
+    phases['other'] = max(0.0, elapsed - sum(phases.values()))
+
+    return elapsed, phases
+
+
+def run(handler, events, concurrency, iterations):
+    '''Replay events iterations times with a pool of concurrency threads'''
+
+    schedule = events * iterations
+    results = []
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for result in pool.map(lambda e: invoke(handler, e), schedule):
+            results.append(result)
+    wall = perf_counter() - start
+
+    return results, wall
+
+
+def summarize(results, wall, concurrency):
+    '''Reduce raw timings to a report dictionary (times in milliseconds)'''
+
+    latencies = sorted(r[0] * 1000 for r in results)
+    count = len(latencies)
+
+    totals = {}
+    for _, phases in results:
+        for phase, secs in phases.items():
+            totals[phase] = totals.get(phase, 0.0) + secs * 1000
+
+    return {
+        'invocations': count,
+        'concurrency': concurrency,
+        'wall_s': round(wall, 3),
+        'per_second': round(count / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+        'phases_ms': {p: round(t / count, 3)
+                      for p, t in sorted(totals.items())} if count else {},
+    }
+
+
+def print_report(report):
+    '''Output report in human readable form'''
+
+    print('Invocations: {invocations}  Concurrency: {concurrency}  '
+          'Wall: {wall_s}s  Throughput: {per_second}/s'.format(**report))
+    print('Latency ms:  p50={p50_ms}  p95={p95_ms}  p99={p99_ms}  '
+          'max={max_ms}'.format(**report))
+    if 'upstream_requests' in report:
+        print('Upstream requests: ' + '  '.join(
+              '{}={}'.format(k, v)
+              for k, v in sorted(report['upstream_requests'].items())))
+    print('Mean ms per phase:')
+    for phase, ms in report['phases_ms'].items():
+        print('  {:<15} {:>9.3f}'.format(phase, ms))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--events', default='bench/events.jsonl',
+                        help='JSON lines file of API Gateway events')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--iterations', type=int, default=20,
+                        help='Number of times to replay the events file')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='Untimed passes over the events file')
+    parser.add_argument('--http-latency', type=float, default=0.0,
+                        help='Seconds added to each stub HTTP response')
+    parser.add_argument('--db-latency', type=float, default=0.0,
+                        help='Seconds added to each DynamoDB call')
+    parser.add_argument('--no-logging', action='store_true',
+                        help='Do not attach a log handler (Lambda has one)')
+    parser.add_argument('--snapshot', default=None, metavar='PATH',
+                        help='Cache snapshot file (default: disabled)')
+    parser.add_argument('--inline', action='store_true',
+                        help="Use RENDER_MODE 'inline' (no S3 fragment fetches)")
+    parser.add_argument('--json', action='store_true',
+                        help='Output report as JSON')
+    args = parser.parse_args(argv)
+
+    # Lambda attaches a handler to the root logger so log records are fully
+    # formatted; do the same, writing to a null stream
+
+    null = open('/dev/null', 'w')
+    metrics.set_output(null)
+
+    if not args.no_logging:
+        logging.getLogger().addHandler(logging.StreamHandler(null))
+
+    quotes = fixture_quotes()
+
+    server = StubServer(quotes, latency=args.http_latency)
+    server.start()
+    server.configure(currency_config)
+    currency_config.SNAPSHOT_PATH = args.snapshot
+
+    if args.inline:
+        currency_config.RENDER_MODE = 'inline'
+
+    table = FakeTable(currency_config.DYNAMO_DB_TABLE, latency=args.db_latency)
+    table.seed(quotes, server.timestamp - 3600)
+
+    import currency_lambda
+    currency_lambda.db_connect = lambda name: table
+
+    events = load_events(args.events)
+
+    try:
+        run(currency_lambda.lambda_handler, events, args.concurrency,
+            args.warmup)
+        results, wall = run(currency_lambda.lambda_handler, events,
+                            args.concurrency, args.iterations)
+    finally:
+        server.stop()
+
+    report = summarize(results, wall, args.concurrency)
+    report['upstream_requests'] = dict(server.hits)
+
+    if args.json:
+        print(dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
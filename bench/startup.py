@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Measure cold start import cost of the Lambda modules with
+   'python -X importtime' and track it over time.
+
+       python3 -m bench.startup                    # report only
+       python3 -m bench.startup --record           # append to history
+       python3 -m bench.startup --max-regression 20
+
+   Each run imports the target module in a fresh interpreter several times
+   and takes the median cumulative import time. With --record the result
+   is appended to bench/startup_history.jsonl along with the git revision
+   so regressions can be traced back to a commit. --max-regression exits
+   non-zero if the median is more than the given percentage above the last
+   recorded entry.
+'''
+
+import os
+import sys
+import argparse
+import subprocess
+from statistics import median
+from json import loads, dumps
+from time import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY = os.path.join(ROOT, 'bench', 'startup_history.jsonl')
+
+
+def import_times(module, python=sys.executable):
+    '''Import module in a fresh interpreter and return dictionary of
+       {module name: (self us, cumulative us)} parsed from -X importtime
+    '''
+
+    proc = subprocess.run([python, '-X', 'importtime', '-c',
+                           'import ' + module],
+                          cwd=ROOT, stderr=subprocess.PIPE,
+                          stdout=subprocess.DEVNULL, universal_newlines=True)
+
+    if proc.returncode:
+        raise RuntimeError('Import of {} failed:\n{}'.format(module,
+                                                             proc.stderr))
+
+    times = {}
+
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cum_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cum_us))
+
+    return times
+
+
+def measure(module, runs):
+    '''Return (median cumulative us, top modules by median self time)'''
+
+    totals = []
+    self_times = {}
+
+    for _ in range(runs):
+        times = import_times(module)
+        totals.append(times[module][1])
+        for name, (self_us, _) in times.items():
+            self_times.setdefault(name, []).append(self_us)
+
+    top = sorted(((median(v), k) for k, v in self_times.items()),
+                 reverse=True)
+
+    return median(totals), top
+
+
+def git_revision():
+    '''Short hash of HEAD or None if not in a git checkout'''
+
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_entry(module, path=HISTORY):
+    '''Most recent history entry for module, or None'''
+
+    entry = None
+
+    try:
+        with open(path) as f:
+            for line in f:
+                record = loads(line)
+                if record['module'] == module:
+                    entry = record
+    except FileNotFoundError:
+        pass
+
+    return entry
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--module', default='currency_lambda')
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of most expensive modules to list')
+    parser.add_argument('--record', action='store_true',
+                        help='Append result to ' + HISTORY)
+    parser.add_argument('--max-regression', type=float, default=None,
+                        metavar='PCT',
+                        help='Fail if slower than last entry by PCT percent')
+    args = parser.parse_args(argv)
+
+    total_us, top = measure(args.module, args.runs)
+    previous = last_entry(args.module)
+
+    print('Import {}: median {:.1f} ms over {} runs'.format(
+          args.module, total_us / 1000, args.runs))
+    print('Most expensive modules (self time):')
+    for self_us, name in top[:args.top]:
+        print('  {:<30} {:>8.2f} ms'.format(name, self_us / 1000))
+
+    status = 0
+
+    if previous:
+        change = (total_us / previous['median_us'] - 1) * 100
+        print('Previous ({}): {:.1f} ms, change {:+.1f}%'.format(
+              previous['revision'], previous['median_us'] / 1000, change))
+        if args.max_regression is not None and change > args.max_regression:
+            print('FAIL: import time regressed by more than {}%'.format(
+                  args.max_regression))
+            status = 1
+
+    if args.record:
+        record = {'time': int(time()), 'revision': git_revision(),
+                  'python': sys.version.split()[0], 'module': args.module,
+                  'median_us': total_us, 'runs': args.runs}
+        with open(HISTORY, 'a') as f:
+            f.write(dumps(record) + '\n')
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
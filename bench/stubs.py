@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Local stand-ins for the external services used by currency_lambda.py so
+   the handler can be exercised without touching Currency Layer, S3 or
+   DynamoDB.
+
+   StubServer - HTTP server answering the Currency Layer 'live' and 'list'
+                endpoints under /api/ and serving the S3 fragments under /s3/
+   FakeTable  - In-memory object implementing the subset of the boto3
+                DynamoDB Table API used by this project
+'''
+
+import os
+import random
+import threading
+from decimal import Decimal
+from json import dumps
+from time import sleep, time
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from currency_config import CURR_ABBRS
+
+S3_DIR = os.path.join(os.path.dirname(os.path.dirname(
+                      os.path.abspath(__file__))), 'S3')
+
+
+def fixture_quotes(codes=None, seed=61):
+    '''Return a deterministic Currency Layer style quotes dictionary, e.g.
+       {'USDEUR': 0.873, ...}, for the given currency codes (default: all)
+    '''
+
+    rng = random.Random(seed)
+    quotes = {}
+
+    for abbr in (codes or CURR_ABBRS):
+        if abbr == 'USD':
+            quotes['USDUSD'] = 1.0
+        else:
+            quotes['USD' + abbr] = round(rng.uniform(0.0005, 25000.0)
+                                         if rng.random() < 0.2
+                                         else rng.uniform(0.3, 150.0), 6)
+
+    return quotes
+
+
+def configure_s3(config, s3_base):
+    '''Point S3_BASE and the S3 resource URLs of the passed currency_config
+       module at s3_base, e.g. a StubServer or a file:// URL of S3_DIR
+    '''
+
+    config.S3_BASE = s3_base
+    config.CURRENCY_CSS = s3_base + 'currency_main.css'
+    config.CURRENCY_ICO = s3_base + 'favicon.ico'
+    config.CURRENCY_HEAD_HTML = s3_base + 'currency_head.html'
+    config.CURRENCY_NAV_BAR = s3_base + 'currency_navbar.html'
+    config.CURRENCY_FOOTER = s3_base + 'currency_footer.html'
+    config.CURRENCY_JS = s3_base + 'currency.js'
+    config.CURRENCY_INDEX = s3_base + 'currency_index.json'
+
+
+class StubServer:
+    '''Threaded HTTP server emulating the Currency Layer API and S3 bucket.
+
+    Args:
+      quotes - quotes dictionary as returned by fixture_quotes()
+      latency - seconds to sleep before answering each request
+      s3_dir - directory holding the HTML/CSS/JS fragments
+    '''
+
+    def __init__(self, quotes=None, latency=0.0, s3_dir=S3_DIR):
+
+        self.quotes = quotes if quotes is not None else fixture_quotes()
+        self.latency = latency
+        self.s3_dir = s3_dir
+        self.timestamp = int(time()) - 600
+        self.hits = {'live': 0, 'list': 0, 's3': 0}
+        self._httpd = None
+        self._thread = None
+
+    def start(self, host='127.0.0.1', port=0):
+        '''Start serving in a daemon thread and return the base URL'''
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub._handle(self)
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+        return 'http://{}:{}/'.format(*self._httpd.server_address[:2])
+
+    def stop(self):
+        '''Shut down the server thread'''
+
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}/'.format(*self._httpd.server_address[:2])
+
+    def configure(self, config):
+        '''Point BASE, CL_KEY and the S3 resource URLs of the passed
+           currency_config module at this server
+        '''
+
+        base = self.base_url
+
+        config.CL_KEY = 'local-stub-key'
+        config.BASE = base + 'api/'
+        configure_s3(config, base + 's3/')
+
+    def _handle(self, req):
+
+        if self.latency:
+            sleep(self.latency)
+
+        url = urlparse(req.path)
+        query = parse_qs(url.query)
+
+        if url.path == '/api/live':
+            self.hits['live'] += 1
+            self._send_json(req, self._live(query))
+        elif url.path == '/api/list':
+            self.hits['list'] += 1
+            self._send_json(req, {'success': True, 'currencies': CURR_ABBRS})
+        elif url.path.startswith('/s3/'):
+            self.hits['s3'] += 1
+            self._send_file(req, os.path.basename(url.path))
+        else:
+            req.send_error(404)
+
+    def _live(self, query):
+
+        if 'access_key' not in query:
+            return {'success': False,
+                    'error': {'code': 101, 'type': 'missing_access_key',
+                              'info': 'You have not supplied an API Access Key.'}}
+
+        wanted = query.get('currencies', [''])[0]
+
+        if wanted:
+            quotes = {}
+            for abbr in wanted.split(','):
+                exch = 'USD' + abbr.strip().upper()
+                if exch in self.quotes:
+                    quotes[exch] = self.quotes[exch]
+        else:
+            quotes = self.quotes
+
+        return {'success': True,
+                'terms': 'https://currencylayer.com/terms',
+                'privacy': 'https://currencylayer.com/privacy',
+                'timestamp': self.timestamp,
+                'source': 'USD',
+                'quotes': quotes}
+
+    def _send_json(self, req, data):
+
+        body = dumps(data).encode('utf-8')
+        req.send_response(200)
+        req.send_header('Content-Type', 'application/json')
+        req.send_header('Content-Length', str(len(body)))
+        req.end_headers()
+        req.wfile.write(body)
+
+    def _send_file(self, req, name):
+
+        try:
+            with open(os.path.join(self.s3_dir, name), 'rb') as f:
+                body = f.read()
+        except OSError:
+            req.send_error(404)
+            return
+
+        req.send_response(200)
+        req.send_header('Content-Length', str(len(body)))
+        req.end_headers()
+        req.wfile.write(body)
+
+
+class ConditionalCheckFailed(Exception):
+    '''Stand-in for the botocore ClientError raised by a failed condition'''
+
+    response = {'Error': {'Code': 'ConditionalCheckFailedException'}}
+
+
+def _condition(expression, item, values):
+    '''Evaluate 'attribute_not_exists(a) OR a < :x' style conditions'''
+
+    for term in expression.split(' OR '):
+        term = term.strip()
+        if term.startswith('attribute_not_exists('):
+            if term[len('attribute_not_exists('):-1] not in item:
+                return True
+        else:
+            attr, placeholder = [s.strip() for s in term.split('<')]
+            if attr in item and item[attr] < values[placeholder]:
+                return True
+
+    return False
+
+
+class FakeTable:
+    '''In-memory DynamoDB table keyed on a single HASH attribute.
+
+    Supports get_item(), put_item(), update_item() with simple 'SET a = :x'
+    expressions and 'attribute_not_exists(a) OR a < :x' conditions, scan()
+    and batch_writer(). An optional per-call latency
+    approximates the round trip to the real service.
+    '''
+
+    def __init__(self, name='ExchangeRates', key='Abbr', latency=0.0):
+
+        self.name = name
+        self.key = key
+        self.latency = latency
+        self.creation_date_time = 'local stand-in'
+        self.items = {}
+        self.calls = {'get_item': 0, 'put_item': 0, 'update_item': 0,
+                      'scan': 0}
+        self._lock = threading.Lock()
+
+    def seed(self, quotes, tstamp):
+        '''Populate table from a Currency Layer style quotes dictionary'''
+
+        for exch, rate in quotes.items():
+            self.items[exch[-3:]] = {self.key: exch[-3:],
+                                     'Rate': Decimal(str(rate)),
+                                     'Tstamp': Decimal(tstamp)}
+
+    def _wait(self, call):
+
+        self.calls[call] += 1
+        if self.latency:
+            sleep(self.latency)
+
+    def get_item(self, Key):
+
+        self._wait('get_item')
+        with self._lock:
+            item = self.items.get(Key[self.key])
+
+        if item is None:
+            return {}
+        return {'Item': dict(item)}
+
+    def put_item(self, Item, **kwargs):
+
+        self._wait('put_item')
+        with self._lock:
+            self.items[Item[self.key]] = dict(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression,
+                    ExpressionAttributeValues=None, ConditionExpression=None,
+                    **kwargs):
+
+        self._wait('update_item')
+        values = ExpressionAttributeValues or {}
+
+        assignments = UpdateExpression.strip()[len('SET'):].split(',')
+
+        with self._lock:
+            item = self.items.get(Key[self.key], {})
+            if ConditionExpression and not _condition(ConditionExpression,
+                                                      item, values):
+                raise ConditionalCheckFailed()
+            item = self.items.setdefault(Key[self.key], dict(Key))
+            for assignment in assignments:
+                attr, placeholder = [s.strip() for s in assignment.split('=')]
+                item[attr] = values[placeholder]
+        return {}
+
+    def scan(self, **kwargs):
+
+        self._wait('scan')
+        with self._lock:
+            items = [dict(item) for item in self.items.values()]
+        return {'Items': items, 'Count': len(items)}
+
+    def batch_writer(self):
+
+        table = self
+
+        class Batch:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def put_item(self, Item):
+                table.put_item(Item=Item)
+
+        return Batch()
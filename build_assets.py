@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Build step for the static resources in the S3 directory.
+
+    Browser assets (CSS, Javascript, currency index and favicon) are
+    minified, concatenated into one bundle per type and given fingerprinted
+    names such as currency.3f9a1c0b2e.js, so they can be cached for a year
+    and still change on every deploy. S3 static hosting cannot choose an
+    encoding per request, so bundles which compress well are uploaded
+    gzipped under their own name with Content-Encoding: gzip, which every
+    browser accepts. The files in the output directory stay uncompressed.
+
+    HTML fragments read server-side by currency_lambda.py are minified but
+    keep their names and are not compressed, since the Lambda function
+    rather than the browser fetches them.
+
+    A manifest mapping each source name to its built name is written to
+    asset_manifest.json next to currency_config.py, which uses it to build
+    the CURRENCY_* URLs. Deploy the manifest with the Lambda package after
+    uploading the files:
+
+        python3 build_assets.py
+        python3 build_assets.py --upload my-bucket/currency/
+
+    Author: Michael O'Connor
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import hashlib
+import argparse
+import mimetypes
+from io import BytesIO
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(HERE, 'S3')
+MANIFEST = os.path.join(HERE, 'asset_manifest.json')
+
+# Bundles served to the browser: output name -> source files in order
+
+BUNDLES = {'currency_main.css': ['currency_main.css'],
+           'currency.js': ['currency.js'],
+           'currency_index.json': ['currency_index.json'],
+           'favicon.ico': ['../favicon.ico']}
+
+FRAGMENTS = ['currency_head.html', 'currency_navbar.html',
+             'currency_footer.html']
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+FRAGMENT_CACHE = 'public, max-age=300'
+
+MIN_COMPRESS = 256              # Smaller files are not worth compressing
+
+
+def minify_css(text):
+    """Remove comments and redundant whitespace"""
+
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    text = re.sub(r':\s+', ':', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+    """Conservative minifier: remove block comments, whole line comments,
+       indentation and blank lines. Line breaks are kept so automatic
+       semicolon insertion behaves exactly as before.
+    """
+
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines
+                     if line and not line.startswith('//'))
+
+
+def minify_html(text):
+    """Remove comments and whitespace between tags. Text, including the
+       contents of pre, textarea, script and style elements, is unchanged
+    """
+
+    # Elements whose text is kept are matched whole and put back unchanged
+
+    keep = r'(<(pre|textarea|script|style)\b.*?</\2\s*>)'
+    text = re.sub(keep + r'|<!--.*?-->|(?<=>)\s+(?=<)',
+                  lambda m: m.group(1) or '', text, flags=re.S | re.I)
+
+    return text.strip()
+
+
+def minify_json(text):
+    return json.dumps(json.loads(text), separators=(',', ':'),
+                      ensure_ascii=False)
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js, '.html': minify_html,
+             '.json': minify_json}
+
+
+def read_bundle(sources, source_dir):
+    """Concatenate and minify sources, returning bytes"""
+
+    ext = os.path.splitext(sources[0])[1]
+    minify = MINIFIERS.get(ext)
+
+    if minify is None:                          # binary, e.g. favicon
+        parts = []
+        for name in sources:
+            with open(os.path.join(source_dir, name), 'rb') as f:
+                parts.append(f.read())
+        return b''.join(parts)
+
+    parts = []
+    for name in sources:
+        with open(os.path.join(source_dir, name), encoding='utf-8') as f:
+            parts.append(minify(f.read()))
+
+    return ('\n' if ext == '.js' else '').join(parts).encode('utf-8')
+
+
+def fingerprint(name, data):
+    """'currency.js' -> 'currency.<10 hex digits of sha256>.js'"""
+
+    stem, ext = os.path.splitext(name)
+    return '{}.{}{}'.format(stem, hashlib.sha256(data).hexdigest()[:10], ext)
+
+
+def gzipped(data):
+    """Deterministic gzip of data"""
+
+    return gzip.compress(data, 9, mtime=0)
+
+
+def worth_compressing(data):
+    """True if data is large enough and gzip makes it smaller"""
+
+    return len(data) >= MIN_COMPRESS and len(gzipped(data)) < len(data)
+
+
+def write(path, data):
+
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def build(source_dir=SOURCE, out_dir='dist'):
+    """Build bundles and fragments into out_dir. Return manifest dictionary
+       with 'assets' (source name -> built name) and 'files' (built file ->
+       headers to upload it with)
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+    assets = {}
+    files = {}
+
+    def emit(name, data, cache_control, compress):
+        content_type = mimetypes.guess_type(name)[0] or \
+                       'application/octet-stream'
+        write(os.path.join(out_dir, name), data)
+        files[name] = {'ContentType': content_type,
+                       'CacheControl': cache_control}
+        if compress and worth_compressing(data):
+            files[name]['ContentEncoding'] = 'gzip'
+
+    for name, sources in BUNDLES.items():
+        data = read_bundle(sources, source_dir)
+        assets[name] = fingerprint(name, data)
+        emit(assets[name], data, IMMUTABLE, True)
+
+    for name in FRAGMENTS:
+        emit(name, read_bundle([name], source_dir), FRAGMENT_CACHE, False)
+
+    return {'assets': assets, 'files': files}
+
+
+def upload(manifest, out_dir, target):
+    """Upload built files to 'bucket/prefix/' with their cache headers.
+       Files marked with ContentEncoding 'gzip' are gzipped as uploaded
+    """
+
+    import boto3
+
+    bucket, _, prefix = target.partition('/')
+    s3 = boto3.client('s3')
+
+    for name, headers in sorted(manifest['files'].items()):
+        with open(os.path.join(out_dir, name), 'rb') as f:
+            body = f.read()
+        if headers.get('ContentEncoding') == 'gzip':
+            body = gzipped(body)
+        s3.put_object(Bucket=bucket, Key=prefix + name, Body=BytesIO(body),
+                      **headers)
+        print('Uploaded s3://{}/{}{}'.format(bucket, prefix, name))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description='Minify, bundle and fingerprint the S3 resources')
+    parser.add_argument('--source', default=SOURCE,
+                        help='Directory of source files (default: S3/)')
+    parser.add_argument('--out', default=os.path.join(HERE, 'dist'),
+                        help='Output directory (default: dist/)')
+    parser.add_argument('--manifest', default=MANIFEST,
+                        help='Manifest path read by currency_config.py')
+    parser.add_argument('--upload', metavar='BUCKET/PREFIX/',
+                        help='Upload built files to S3 afterwards')
+    args = parser.parse_args(argv)
+
+    manifest = build(args.source, args.out)
+
+    for name, built in sorted(manifest['assets'].items()):
+        size = os.path.getsize(os.path.join(args.out, built))
+        print('{:22} -> {:34} {:>7,} bytes'.format(name, built, size))
+
+    if args.upload:
+        upload(manifest, args.out, args.upload)
+
+    with open(args.manifest, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    print('Wrote {}'.format(args.manifest))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Downsampled rate history series for charts and sparklines.
+
+   Years of hourly history are far more points than a chart can show, so
+   series are reduced with a shape-preserving algorithm before they are
+   sent:
+
+     lttb   - Largest-Triangle-Three-Buckets: keeps the point of each bucket
+              forming the largest triangle with its neighbours, preserving
+              the visual shape of the line
+     minmax - keeps the lowest and highest point of each bucket, preserving
+              every spike at the cost of a noisier line
+
+   Each range tier (RANGES) is read from the history store once and reduced
+   to TIER_POINTS with lttb. currency_lambda.py caches the tier series and
+   answers ?chart=EUR,GBP&range=1y&points=500 by downsampling them again,
+   which takes milliseconds rather than a history read.
+
+       python3 chart.py EUR,GBP --range 1y --points 50 --store history.db
+'''
+
+import sys
+import argparse
+from json import dumps
+
+TIER_POINTS = 2000
+
+# Range tier name -> seconds of history (None for everything stored)
+
+RANGES = {'1d': 86400,
+          '1w': 7 * 86400,
+          '1m': 30 * 86400,
+          '3m': 91 * 86400,
+          '1y': 365 * 86400,
+          '5y': 5 * 365 * 86400,
+          'max': None}
+
+
+def lttb(points, threshold):
+    '''Downsample list of (t, v) to threshold points with LTTB'''
+
+    n = len(points)
+
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    ts = [p[0] for p in points]
+    vs = [p[1] for p in points]
+    every = (n - 2) / (threshold - 2)
+
+    out = [points[0]]
+    a = 0
+
+    for i in range(threshold - 2):
+
+        # Average of the next bucket is the triangle's third corner
+
+        start = int((i + 1) * every) + 1
+        end = min(int((i + 2) * every) + 1, n)
+        avg_t = sum(ts[start:end]) / (end - start)
+        avg_v = sum(vs[start:end]) / (end - start)
+
+        # Pick the point of this bucket making the largest triangle with
+        # the previously selected point and that average
+
+        ax, ay = ts[a], vs[a]
+        dx, dy = ax - avg_t, avg_v - ay
+        best = -1.0
+
+        for j in range(int(i * every) + 1, start):
+            area = abs(dx * (vs[j] - ay) - (ax - ts[j]) * dy)
+            if area > best:
+                best = area
+                a = j
+
+        out.append(points[a])
+
+    out.append(points[-1])
+
+    return out
+
+
+def minmax(points, threshold):
+    '''Downsample list of (t, v) to at most threshold points by keeping the
+       minimum and maximum of each bucket, in time order
+    '''
+
+    n = len(points)
+
+    if threshold >= n or threshold < 4:
+        return list(points)
+
+    buckets = (threshold - 2) // 2
+    every = (n - 2) / buckets
+    out = [points[0]]
+
+    for i in range(buckets):
+        bucket = points[int(i * every) + 1:int((i + 1) * every) + 1]
+        if not bucket:
+            continue
+        low = min(bucket, key=lambda p: p[1])
+        high = max(bucket, key=lambda p: p[1])
+        if low is high:
+            out.append(low)
+        else:
+            out.extend(sorted((low, high)))
+
+    out.append(points[-1])
+
+    return out
+
+
+DOWNSAMPLERS = {'lttb': lttb, 'minmax': minmax}
+
+
+def read_series(store, code, start, end, base='USD'):
+    '''Return [(t, rate)] of code in base between start and end from a
+       history store of USD rates. Other bases are joined on timestamp.
+       The base itself has no series
+    '''
+
+    if code == base:
+        return []
+
+    if base == 'USD':
+        return [(int(t), rate) for t, rate in store.series(code, start, end)]
+
+    base_rates = {int(t): rate for t, rate in store.series(base, start, end)}
+
+    if code == 'USD':
+        return [(t, 1 / rate) for t, rate in sorted(base_rates.items())
+                if rate]
+
+    return [(int(t), rate / base_rates[int(t)])
+            for t, rate in store.series(code, start, end)
+            if base_rates.get(int(t))]
+
+
+def tier_series(store, code, name, now, base='USD'):
+    '''Series for range tier name ending at now, reduced to TIER_POINTS'''
+
+    seconds = RANGES[name]
+    start = 0 if seconds is None else now - seconds
+
+    return lttb(read_series(store, code, start, now, base), TIER_POINTS)
+
+
+def compact(points):
+    '''[[t, v]] with values to 6 significant digits, for JSON'''
+
+    return [[t, float('{:.6g}'.format(v))] for t, v in points]
+
+
+def sparkline(points, width=80, height=16):
+    '''Inline SVG polyline of points [(t, v)], or '' if fewer than two'''
+
+    if len(points) < 2:
+        return ''
+
+    t0, t1 = points[0][0], points[-1][0]
+    low = min(v for _, v in points)
+    high = max(v for _, v in points)
+    sx = (width - 2) / ((t1 - t0) or 1)
+    sy = (height - 2) / ((high - low) or 1)
+
+    line = ' '.join('{:.0f},{:.1f}'.format(1 + (t - t0) * sx,
+                                           height - 1 - (v - low) * sy)
+                    for t, v in points)
+
+    return "<svg class='spark' width='{0}' height='{1}' " \
+           "viewBox='0 0 {0} {1}'><polyline points='{2}'/></svg>".format(
+               width, height, line)
+
+
+def main(argv=None):
+
+    import history
+    from time import time
+
+    parser = argparse.ArgumentParser(
+        description='Print downsampled rate history as JSON')
+    parser.add_argument('codes', help='Comma separated currency codes')
+    parser.add_argument('--range', default='1y', choices=sorted(RANGES))
+    parser.add_argument('--points', type=int, default=500)
+    parser.add_argument('--method', default='lttb', choices=DOWNSAMPLERS)
+    parser.add_argument('--base', default='USD')
+    parser.add_argument('--store', default=None,
+                        help="'dynamodb' or SQLite path (default: config)")
+    args = parser.parse_args(argv)
+
+    store = history.open_store(args.store)
+    now = int(time())
+
+    try:
+        series = {code: compact(DOWNSAMPLERS[args.method](
+                      tier_series(store, code, args.range, now, args.base),
+                      args.points))
+                  for code in args.codes.upper().split(',')}
+    finally:
+        store.close()
+
+    print(dumps({'range': args.range, 'base': args.base,
+                 'method': args.method, 'series': series},
+                separators=(',', ':')))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import json as _json
+from os import path as _path, environ as _environ
+
 # Define key variables defaults associated with CurrencyLayer web service
 
 CL_KEY = '< your currency layer access key >'
@@ -8,22 +11,155 @@ BASE = 'http://www.apilayer.net/api/'       # URI base for CL
 MODE = 'live'                               # Use live mode (vs. list)
 basket = 'EUR,GBP,JPY,CHF,AUD,CAD'          # Default Currency basket
 api_spread = 1.0                            # Default spread = 1.0%
+base_currency = 'USD'                       # Default base, ?base=EUR etc.
+
+# Rate providers tried in order (see providers.py): 'currencylayer' uses BASE
+# and CL_KEY, 'currencylayer:<base>' a compatible mirror with CL_KEY and
+# 'file:<path>' a saved 'live' response for offline use. A later provider is
+# started if the earlier ones fail or have not answered after HEDGE_AFTER
+# seconds. If every provider fails, cached quotes up to QUOTE_MAX_STALE
+# seconds old are shown with a notice that they may be out of date
+
+PROVIDERS = ['currencylayer']
+HEDGE_AFTER = 0.5
+PROVIDER_TIMEOUT = 5
+QUOTE_MAX_STALE = 86400
 
 # Location of project resources - suggest using AWS S3 bucket
 
 S3_BASE = '<URL representing S3 folder object>'
 
-CURRENCY_CSS = S3_BASE + 'currency_main.css'
-CURRENCY_ICO = S3_BASE + 'favicon.ico'
+# Browser assets use the fingerprinted names written by build_assets.py to
+# asset_manifest.json, when present, so they can be cached indefinitely
+
+try:
+    with open(_path.join(_path.dirname(__file__), 'asset_manifest.json')) as _f:
+        ASSETS = _json.load(_f)['assets']
+except (OSError, ValueError, KeyError):
+    ASSETS = {}
+
+CURRENCY_CSS = S3_BASE + ASSETS.get('currency_main.css', 'currency_main.css')
+CURRENCY_ICO = S3_BASE + ASSETS.get('favicon.ico', 'favicon.ico')
 CURRENCY_HEAD_HTML = S3_BASE + 'currency_head.html'
 CURRENCY_NAV_BAR = S3_BASE + 'currency_navbar.html'
 CURRENCY_FOOTER = S3_BASE + 'currency_footer.html'
-CURRENCY_JS = S3_BASE + 'currency.js'
+CURRENCY_JS = S3_BASE + ASSETS.get('currency.js', 'currency.js')
+CURRENCY_INDEX = S3_BASE + ASSETS.get('currency_index.json',
+                                      'currency_index.json')  # suggest.py
 
 # AWS DynamoDB key variables
 
 DYNAMO_DB_TABLE = 'ExchangeRates'
 
+# Baselines are moved to the current rate once older than BASELINE_WINDOW
+# seconds. Writes are conditional, so containers racing on the same quote
+# write each baseline once, and unchanged rates are not rewritten. With
+# BASELINE_UNIVERSE the scheduled precompute refreshes every currency, not
+# just those in requested baskets, from one full-universe fetch per quote
+
+BASELINE_WINDOW = 24 * 60 * 60
+BASELINE_UNIVERSE = True
+
+# Rate history store used by backfill.py and history features: 'dynamodb'
+# for DYNAMO_HISTORY_TABLE (Abbr HASH key, Tstamp RANGE key) or a path to a
+# local SQLite file
+
+DYNAMO_HISTORY_TABLE = 'ExchangeHistory'
+HISTORY_STORE = 'dynamodb'
+
+# Portfolio valuation (portfolio.py, ?portfolio=) reports change since the
+# DynamoDB baselines and since each of these horizons in the history store
+
+PORTFOLIO_HORIZONS = [('1d', 86400), ('7d', 7 * 86400), ('30d', 30 * 86400),
+                      ('1y', 365 * 86400)]
+
+# Charts (chart.py, ?chart=EUR,GBP&range=1y&points=500). Each range tier of
+# a currency is read from the history store once per CHART_TTL and cached,
+# at most CHART_CACHE_SIZE tiers. SPARKLINE_RANGE adds a sparkline of that
+# tier (e.g. '1m') to every row of the page; None disables them
+
+CHART_TTL = 3600
+CHART_CACHE_SIZE = 64
+CHART_POINTS = 500                          # Default ?points=
+CHART_MAX_SERIES = 10                       # Currencies per chart request
+SPARKLINE_RANGE = None
+SPARKLINE_POINTS = 40
+
+# How HTML fragments (head, navbar, footer) reach the page:
+#   'remote' - fetched from the S3_BASE URLs and cached for FRAGMENT_TTL
+#   'inline' - read once from the copies in FRAGMENT_DIR, deployed with the
+#              Lambda package, so rendering makes no S3 requests
+# INLINE_CSS also embeds currency_main.css in a <style> tag (inline mode).
+# FRAGMENT_RELOAD re-reads changed files on each request (development).
+
+RENDER_MODE = 'remote'
+FRAGMENT_DIR = _path.join(_path.dirname(_path.abspath(__file__)), 'S3')
+INLINE_CSS = False
+FRAGMENT_RELOAD = False
+
+# In-process cache lifetimes in seconds. Currency Layer's free tier publishes
+# new quotes hourly, so a quote is reused until QUOTE_TTL seconds after its
+# timestamp, checking at most every QUOTE_RECHECK seconds if the next is late
+
+QUOTE_TTL = 3600
+QUOTE_RECHECK = 300
+QUOTE_CACHE_SIZE = 64                       # Max baskets held in cache
+BASELINE_TTL = 300
+FRAGMENT_TTL = 900
+
+# Expired quotes and baselines are still served for up to this many seconds
+# past expiry while a single background refresh runs (stale-while-revalidate)
+# so no request waits on the upstream at the top of the hour. Older entries
+# are refreshed before the request is answered
+
+QUOTE_SWR = 600
+BASELINE_SWR = 3600
+
+# Rendered pages are cached until a new quote is published. A scheduled
+# (EventBridge) invocation pre-renders the default page plus the
+# PRECOMPUTE_TOP most requested pages and writes them to PAGE_BUCKET as
+# static objects. A Lambda container's page cache only serves that
+# container, so without PAGE_BUCKET scheduled invocations render no pages.
+# A container with neither the page nor current quotes cached reads the
+# published page back from PAGE_BUCKET rather than rendering it.
+# server.py precomputes into its own cache from its own request counts, of
+# which POPULAR_LIMIT are kept
+
+PAGE_CACHE_SIZE = 32
+PRECOMPUTE_TOP = 10
+POPULAR_LIMIT = 1000
+PAGE_BUCKET = None
+PAGE_PREFIX = 'pages/'
+
+# Lambda finds the most requested pages across all containers from the
+# Basket, Spread and Base of the last POPULAR_WINDOW seconds of request
+# metrics lines, with a CloudWatch Logs Insights query run at most once per
+# POPULAR_TTL. POPULAR_LOG_GROUP defaults to the function's own log group
+
+POPULAR_WINDOW = 24 * 60 * 60
+POPULAR_TTL = 3600
+POPULAR_LOG_GROUP = None
+POPULAR_QUERY_TIMEOUT = 20
+
+# Caches are saved to Lambda's /tmp so a recycled container can start warm.
+# Set to None to disable
+
+SNAPSHOT_PATH = '/tmp/currency_snapshot.bin'
+
+# Fraction of invocations (0.0 - 1.0) which log full API responses, events
+# and per-currency detail. All invocations emit one metrics line (EMF)
+
+DEBUG_SAMPLE_RATE = 0.01
+
+# Profiling (see profiling.py). A request with ?profile=<PROFILE_TOKEN>
+# returns a cProfile and tracemalloc report instead of the page. Set the
+# token in the Lambda environment, never in this file; no token disables
+# it. CURRENCY_PROFILE=<fraction> logs a report for that share of requests
+
+PROFILE_TOKEN = _environ.get('CURRENCY_PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(_environ.get('CURRENCY_PROFILE', 0))
+PROFILE_TOP = 25
+
 # List of currencies to be displayed with <CUR>/USD in left most column
 # Others will be listed with USD/<CUR> on the left and <CUR>/USD on the right
 
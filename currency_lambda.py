@@ -1,10 +1,17 @@
-from decimal import Decimal, getcontext
-from urllib.request import urlopen
-from urllib.error import URLError, HTTPError
-from time import strftime, localtime
-from json import loads
+import os
+from random import random
+from collections import Counter
+from decimal import Decimal
+from time import time, sleep, strftime, localtime
+from math import floor, log10
+import threading
 import logging
-import boto3
+import metrics
+import snapshot
+import providers
+from quotes import QuoteSet, CODES, INDEX, TO_USD, FROM_USD, indices, labels
+from metrics import span
+import currency_config as config
 
 '''Currency Exchange Rate program deployed as AWS Lambda function. Returns
    a web page based on URL options and an external Currency Exchange service.
@@ -34,70 +41,243 @@ import boto3
 #
 ################################################################################
 
+# Note: boto3 and urllib.request are imported inside the functions that use
+# them rather than here. Together they account for most of the module's
+# import time, which is paid on every Lambda cold start, and some request
+# paths never need them. Run 'python3 -m bench.startup' to measure.
+
 # Set logging level to INFO for more detail, ERROR for less
 # See CloudWatch service for logging detail
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Exact powers of ten for rounding display values, see sig6(), and the
+# layout of each get_rates() row
+
+POW10 = [10.0 ** n for n in range(23)]
+ROW_FMT = '%s: %9.4f (%9.4f)  %s: %7.4f (%6.4f)'
+ROW_HTML = "<pre>%s<span title='Change since: %s' style='color:%s'> " \
+           "%3.2f%%</span>%s</pre>"
+
+# In-process caches shared by all invocations handled by this container.
+# Each entry is a (time fetched, value) tuple. Caches are written to
+# config.SNAPSHOT_PATH when changed and reloaded when a container starts
+
+_cache = {
+    'quotes': {},               # Basket ('*' for all) -> QuoteSet
+    'baselines': {},            # Currency abbr -> DynamoDB item
+    'fragments': {},            # S3 URL -> HTML text
+    'pages': {},                # (basket, spread, base) -> (quote time, HTML)
+    'horizons': {},             # (horizon, abbr) -> (tstamp, history rate)
+    'charts': {},               # (abbr, base, range) -> [(tstamp, rate)]
+    'popular': {},              # Top count -> page keys from request logs
+    }
+_cache_dirty = False
+
+# Rate providers by configuration, and time of the last failed fetch for
+# baskets currently being served from stale cached quotes
+
+_providers = {}
+_failures = {}
+
+# Cache entries with a background refresh in progress, as (kind, key).
+# _refresh_lock also guards every write to _cache, since background
+# refreshes, server.py request threads and snapshots share the caches
+
+_refreshing = set()
+_refresh_lock = threading.Lock()
+
+# Quote timestamp of the last full-universe baseline refresh
+
+_universe_ts = None
+
+# Requests per (basket, spread, base) page handled by this container.
+# Counted by server.py request threads and read by its precompute thread
+
+_popular = Counter()
+_popular_lock = threading.Lock()
+
+# Page template for RENDER_MODE 'inline': local fragment file name ->
+# (modification time, text) and the assembled (head, navbar, footer)
+
+_local = {}
+_template = None
+
+
+def cache_get(kind, key, ttl):
+    '''Return cached value if younger than ttl seconds, else None'''
+
+    entry = _cache[kind].get(key)
+
+    if entry and time() - entry[0] < ttl:
+        metrics.current().count(kind + '_cache_hits')
+        return entry[1]
+
+    return None
+
+
+def cache_swr(kind, key, ttl, max_stale):
+    '''Return (value, expired). value is the cached value if younger than
+       ttl seconds, or no more than max_stale seconds past ttl, in which case
+       expired is True and the caller should refresh_later(). Else value is
+       None
+    '''
+
+    entry = _cache[kind].get(key)
+
+    if entry:
+        age = time() - entry[0]
+        if age < ttl:
+            metrics.current().count(kind + '_cache_hits')
+            return entry[1], False
+        if age < ttl + max_stale:
+            metrics.current().count(kind + '_stale_hits')
+            return entry[1], True
+
+    return None, False
+
+
+def refresh_later(kind, keys, fetch, limit=None):
+    '''Refresh cache entries in a background thread. fetch(keys) returns
+       a dictionary of key -> new value. Keys already being refreshed are
+       skipped so each entry has at most one refresh in flight.
+
+       Lambda freezes the container between invocations, so a refresh
+       started near the end of one invocation may finish in the next.
+    '''
+
+    with _refresh_lock:
+        keys = [key for key in keys if (kind, key) not in _refreshing]
+        _refreshing.update((kind, key) for key in keys)
+
+    if not keys:
+        return
+
+    metrics.current().count(kind + '_refreshes')
+
+    def run():
+        try:
+            for key, value in fetch(keys).items():
+                cache_put(kind, key, value, limit)
+        except Exception as e:
+            logger.error('Background refresh of %s %s failed: %s',
+                         kind, keys, e)
+        finally:
+            with _refresh_lock:
+                _refreshing.difference_update((kind, key) for key in keys)
+
+    threading.Thread(target=metrics.propagate(run), daemon=True).start()
+
+
+def cache_put(kind, key, value, limit=None):
+    '''Store value in cache, dropping the oldest entry beyond limit'''
+
+    global _cache_dirty
+
+    with _refresh_lock:
+        entries = _cache[kind]
+        entries.pop(key, None)
+        entries[key] = (time(), value)
+
+        if limit and len(entries) > limit:
+            entries.pop(next(iter(entries)), None)
+
+        _cache_dirty = True
+
+
 class CurrencyLayer:
 
-    def __init__(self, base, mode, key, basket):
+    def __init__(self, base, mode, key, basket, provider=None,
+                 currency='USD'):
 
-        """Build URL we will use to query latest exchange rates from
-           Currency Layer Web Service
+        """Prepare to query latest exchange rates from Currency Layer Web
+           Service, or other providers configured in PROVIDERS
 
         Args:
           base - base portion of URL
-          mode - 'live' or 'list'
+          mode - 'live' or 'list' (all currencies)
           key - Access Key provided when siging up for CurrencyLayer Account
           basket - Comma separated currency abbreviations
+          provider - Provider to use instead of those in PROVIDERS
+          currency - Base currency rates are shown against. Quotes are
+                     always USD based and rebased locally in get_rates()
         """
 
-        if mode == 'list':
-            self.cl_url = base + 'list?' + 'access_key=' + key
-        elif mode == 'live':
-            self.cl_url = base + 'live?' + 'access_key=' \
-                          + key + '&currencies=' + basket
+        self.codes = None if mode == 'list' else quote_codes(basket, currency)
+        self.cache_key = self.codes or '*'
+        self.provider = provider or default_provider(base, key)
 
         self.basket = basket
-        self.rate_dict = {}
+        self.currency = currency
+        self.quotes = QuoteSet()
         self.cl_ts = 12345678
+        self.stale = False
 
-        # Working with Decimal numbers so set precision to prevent strange
-        # floating point approximations
 
-        getcontext().prec = 6
+    def cl_validate(self, max_stale=None):
+        """Use cached quotes if still current, otherwise request quotes from
+           the provider. If successful, quotes will contain a QuoteSet holding
+           rate quotes and quote timestamp. If every provider fails, serve
+           cached quotes up to QUOTE_MAX_STALE old with stale set, otherwise
+           log errors to CloudWatch and raise exception. max_stale overrides
+           QUOTE_SWR; 0 always waits for an expired quote to be refreshed.
+        """
 
+        if max_stale is None:
+            max_stale = config.QUOTE_SWR
 
-    def cl_validate(self):
-        """Open supplied URL. If initial open is successful, read contents
-           to determine if API call was successful. If successful, rate_dict
-           will contain dictionary data structure containing rate quotes and
-           quote timestamp. If unsuccessful, log errors to CloudWatch and
-           raise exception.
-        """
+        # Reuse cached response until the next quote is due to be published,
+        # then for up to max_stale seconds while it is fetched in background
+
+        entry = _cache['quotes'].get(self.cache_key)
+
+        if entry:
+            overdue = time() - quote_expiry(*entry)
+            if overdue < 0:
+                metrics.current().count('quotes_cache_hits')
+            elif overdue < max_stale:
+                metrics.current().count('quotes_stale_hits')
+                refresh_later('quotes', [self.cache_key], self.fetch_quotes,
+                              limit=config.QUOTE_CACHE_SIZE)
+            if overdue < max_stale:
+                self.quotes = entry[1]
+                self.cl_ts = self.quotes.timestamp
+                self.stale = self.cache_key in _failures
+                return
 
         try:
-            webUrl = urlopen (self.cl_url)
-        except HTTPError as e:
-            logger.error('In cl_validate()')
-            logger.error('Unable to open: %s', self.cl_url)
-            logger.error('Error code: %s', e.code)
-            raise Exception
-        except URLError as e:
-            logger.error('Reason: %s', e.reason)
-            raise Exception
-        else:
-            rate_data = webUrl.read()
-            self.rate_dict = loads(rate_data.decode('utf-8'))
-            if self.rate_dict['success'] is False:
-                logger.error('In cl_validate()')
-                logger.error('Error= %s', self.rate_dict['error']['info'])
+            self.quotes = self.provider.fetch(self.codes)
+        except Exception as e:
+            if not entry or time() - entry[1].timestamp > config.QUOTE_MAX_STALE:
+                logger.error('In cl_validate(): %s', e)
                 raise Exception
-            else:
-                self.cl_ts = self.rate_dict['timestamp']
-                logger.info('SUCCESS: API response= %s', self.rate_dict)
+
+            # Serve last known quotes and retry after QUOTE_RECHECK
+
+            logger.error('Rate providers failed, using quotes from %s: %s',
+                         t_stamp(entry[1].timestamp), e)
+            metrics.current().count('stale_quotes')
+            _failures[self.cache_key] = time()
+            self.quotes = entry[1]
+            self.stale = True
+        else:
+            _failures.pop(self.cache_key, None)
+            logger.info('SUCCESS: API timestamp= %s', self.quotes.timestamp)
+
+        self.cl_ts = self.quotes.timestamp
+
+        cache_put('quotes', self.cache_key, self.quotes,
+                  limit=config.QUOTE_CACHE_SIZE)
+
+
+    def fetch_quotes(self, keys):
+        '''Background refresh of this basket for refresh_later()'''
+
+        quotes = self.provider.fetch(self.codes)
+        _failures.pop(self.cache_key, None)
+
+        return {self.cache_key: quotes}
 
 
     def get_rates(self, spread):
@@ -106,9 +286,7 @@ class CurrencyLayer:
            costs associated with buying & selling foreign currencies
         '''
 
-        from currency_config import USD_FIRST, DYNAMO_DB_TABLE
-
-        spread = Decimal(spread)
+        spread = float(spread)
 
         # Create Form to enable manipulation of Spread within a range
         # This approach also provides input validation
@@ -121,11 +299,29 @@ class CurrencyLayer:
         rate_html +=  "max='2.0' step='.05' size='4' maxlength='4' "
         rate_html +=  "value='{:3.2f}'>".format(spread)
         rate_html += "<input type='submit' class='mybutton'>"
-        rate_html += "</form></div>"
+        rate_html += "</form>"
+
+        # Base currency picker: USD or any currency in the basket
 
-        spread = spread / 100               # convert to percentage
+        rate_html += "<label for='base_input'>Base:  </label>"
+        rate_html += "<select id='base_input' onchange=\"changeBase()\">"
 
-        # Establish a connection to Persistent AWS Database. We will assume
+        for abbr in dict.fromkeys(['USD'] + self.basket.upper().split(',')):
+            rate_html += "<option{}>{}</option>".format(
+                ' selected' if abbr == self.currency else '', abbr)
+
+        rate_html += "</select></div>"
+
+        # Display values are computed with floats rounded to 6 significant
+        # digits wherever the precision 6 Decimal arithmetic they replace
+        # rounded, with display ties settled as half_even() does, so the
+        # digits shown are the same. Spread factors are the same for every
+        # row: compute them once
+
+        markup = sig6(1 + sig6(spread / 100))
+        markdown = sig6(1 / markup)
+
+        # Baselines are read from a persistent AWS Database. We will assume
         # that DynamoDB database has been created and table initialized with
         # Abbr as the HASH Key.
         #
@@ -142,7 +338,7 @@ class CurrencyLayer:
         #   |   ANG   |  1.77575 | 1545828846 |
         #   ...
 
-        table = db_connect(DYNAMO_DB_TABLE)
+        expired = {}                        # Abbr -> baseline to refresh
 
         # Itterate over each exchange rate and display results in HTML
         # along with percentage spread and change percentage. We use a
@@ -150,84 +346,161 @@ class CurrencyLayer:
 
         rate_html += "<div class='quotes'>"
 
-        for exch, cur_rate in self.rate_dict['quotes'].items():
+        since = {}                          # Formatted hover text by tstamp
+        sampled = metrics.sampled()
+        usd_first = set(indices(config.USD_FIRST))
+        rates = self.quotes.rates
 
-            abbr = exch[-3:]
+        rebasing = self.currency != self.quotes.source \
+                   and self.currency in self.quotes
 
-            # Query Database to determine saved quote value and timestamp
+        # Query Database to determine saved quote value and timestamp unless
+        # recently read by this container
 
-            response = dynamo_query(table, abbr)
-            old = (response['Rate'])
-            tstamp = (response['Tstamp'])
+        codes = self.quotes.codes()
 
-            # Since we are doing Decimal arithmetic, convert cur_rate to
-            # Decimal if necessary
+        if rebasing and self.currency not in codes:
+            codes.append(self.currency)
 
-            if not isinstance(cur_rate, Decimal):
-                cur_rate = Decimal(str(cur_rate))
+        baselines = baseline_items(codes)
 
-            logger.info('For %s: Old= %s New= %s', abbr, old, cur_rate)
+        # Quotes and baselines are USD based. For another base currency the
+        # whole quote vector is rebased in one pass and each baseline is
+        # divided by the base currency's baseline, so no extra requests are
+        # needed. The base currency's own row shows USD instead.
 
-            # Format Exchange label and value so we can display with both
-            # USD in the numerator and denominator
+        base = None
+        shown = rates
+        to_base, from_base = TO_USD, FROM_USD
 
-            in_usd = exch[-3:] + '/USD'
-            in_for = 'USD/' + exch[3:]
-            usd_spread = (1/cur_rate)*(1+spread)
-            for_spread = cur_rate*(1/(1+spread))
+        if rebasing:
+            base = INDEX[self.currency]
+            usd = INDEX[self.quotes.source]
+            usd_listed = usd in self.quotes.order
+            shown = self.quotes.rebase(self.currency).rates
+            base_old = float(baselines[self.currency]['Rate']) or rates[base]
+            to_base, from_base = labels(self.currency)
 
-            # Display certain currencies in per USD first as determined
-            # by currency abbreviation inclusion in usd_first data set
+        # Sparklines are drawn from the cached SPARKLINE_RANGE chart tiers,
+        # so history is read at most once per CHART_TTL per currency
 
-            if exch[3:] in USD_FIRST:
-                msg = "{}: {:>9.4f} ({:>9.4f})  {}: {:>7.4f} ({:>6.4f})".\
-                        format(in_usd, 1/cur_rate, usd_spread,
-                               in_for, cur_rate, for_spread)
-            else:
-                msg = "{}: {:>9.4f} ({:>9.4f})  {}: {:>7.4f} ({:>6.4f})".\
-                        format(in_for, cur_rate, for_spread,
-                               in_usd, 1/cur_rate, usd_spread)
+        sparks = {}
+
+        if config.SPARKLINE_RANGE:
+            from chart import lttb, sparkline
+            shown_codes = [CODES[i] for i in self.quotes.order]
+            if rebasing:
+                shown_codes.append(self.quotes.source)
+            tiers = chart_tiers(shown_codes, config.SPARKLINE_RANGE,
+                                self.currency)
+            for abbr, points in tiers.items():
+                sparks[abbr] = sparkline(lttb(points,
+                                              config.SPARKLINE_POINTS))
+
+        for i in self.quotes.order:
+
+            abbr = CODES[i]
+            cur_rate = rates[i]
+
+            response = baselines[abbr]
+
+            old = (response['Rate'])
+            tstamp = (response['Tstamp'])
+
+            if sampled:
+                logger.info('For %s: Old= %s New= %s', abbr, old, cur_rate)
 
-            # Calculate percentage change and use to determine display color.
             # If currency was recently added to basket then old rate may
             # still be '0.0' in the database. If so, set old rate equal to
-            # current rate to prevent divide by zero exception and
-            # convert to Decimal type to maintain precision.
+            # current rate to prevent divide by zero exception.
+
+            old_rate = float(old) or cur_rate
+
+            # Rebase for display. The base currency's own row shows USD,
+            # unless USD is in the basket too, when the row is skipped
+
+            row = i
+
+            if base is not None:
+                if i == base:
+                    row = None if usd_listed else usd
+                    old_rate = sig6(1 / base_old)
+                else:
+                    old_rate = sig6(old_rate / base_old)
+
+            if row is not None:
+
+                show_rate = shown[row]
+                inv_rate = sig6(1 / show_rate)
+
+                # Format Exchange label and value so we can display with both
+                # the base currency in the numerator and denominator
+
+                in_usd = to_base[row]
+                in_for = from_base[row]
+                usd_spread = sig6(inv_rate * markup, 4)
+                for_spread = sig6(show_rate * markdown, 4)
 
-            old_rate = cur_rate if (old == '0.0') else Decimal(old)
+                # Display certain currencies in per base first as determined
+                # by currency abbreviation inclusion in usd_first data set
 
-            change_pct = (1 - (cur_rate / old_rate)) * 100
+                # printf style formatting of floats is several times
+                # cheaper than str.format() here, see bench/rates.py
 
-            # Rates are quoted relative to USD. If change color is red
-            # then USD has weakened relative to foreign currency. If green then
-            # USD has strengthened. If change is less than 0.1%, don't color.
-            # Also, add hover to text showing time basis for percentage change.
+                if row in usd_first:
+                    msg = ROW_FMT % (in_usd, half_even(inv_rate), usd_spread,
+                                     in_for, half_even(show_rate), for_spread)
+                else:
+                    msg = ROW_FMT % (in_for, half_even(show_rate), for_spread,
+                                     in_usd, half_even(inv_rate), usd_spread)
 
-            if change_pct >= 0.1:
-                color = '#f44141'           # Bright Red
-            elif change_pct <= -0.1:
-                color = '#62f442'           # Bright Green
-            else:
-                color = 'white'
+                # 1 - ratio needs no rounding of its own: multiplying by 100
+                # keeps the same significant digits, so one rounding gives
+                # the same result as rounding both steps
 
-            rate_html += "<pre>{}<span ".format(msg)
-            rate_html += "title='Change since: {}' ".format(t_stamp(tstamp))
-            rate_html += "style='color:{}'> {:>3.2f}%".format(color, abs(change_pct))
-            rate_html += "</span></pre>"
+                change_pct = sig6((1 - sig6(show_rate / old_rate)) * 100)
 
-            # If more than 24 hours have passed between the most recent
-            # quote timestamp and time quote was last saved to the database,
-            # update both the quote and timestamp in the database.
+                # Rates are quoted relative to the base currency (USD by
+                # default). If change color is red then the base has weakened
+                # relative to foreign currency. If green then it has
+                # strengthened. If change is 0.1% or less, don't color (as
+                # a Decimal, exactly 0.1 compared below the float 0.1).
+                # Also, add hover to text showing time basis for percentage
+                # change.
 
-            time_delta = (Decimal(self.cl_ts - Decimal(tstamp)))
-            logger.info("%s hours since last DB update", time_delta/(60*60))
+                if change_pct > 0.1:
+                    color = '#f44141'           # Bright Red
+                elif change_pct < -0.1:
+                    color = '#62f442'           # Bright Green
+                else:
+                    color = 'white'
 
-            if time_delta > (24*60*60):
-                logger.info("Updating table: %s for %s", table, abbr)
-                dynamo_update(table, abbr, cur_rate, self.cl_ts)
+                if tstamp not in since:
+                    since[tstamp] = t_stamp(tstamp)
+
+                rate_html += ROW_HTML % (msg, since[tstamp], color,
+                                         half_even(abs(change_pct), 2),
+                                         sparks.get(CODES[row], ''))
+
+            # If more than BASELINE_WINDOW (24 hours) has passed between the
+            # most recent quote timestamp and time quote was last saved to
+            # the database, refresh both the quote and timestamp in the
+            # database once the rows are built
+
+            time_delta = self.cl_ts - int(tstamp)
+            if sampled:
+                logger.info("%s hours since last DB update", time_delta/(60*60))
+
+            if time_delta > config.BASELINE_WINDOW:
+                expired[abbr] = response
 
         rate_html += "</div>"       # class='quotes'
 
+        metrics.current().count('currencies', len(self.quotes.order))
+
+        if expired:
+            refresh_baselines(self.quotes, expired)
+
         return rate_html
 
 
@@ -262,25 +535,20 @@ class CurrencyLayer:
 
 
     def build_select(self, cl_abbrs):
-        '''Loop through basket of currency abbreviations and return with an HTML
-           form containing a list of currencies which can be added to basket.
+        '''Return an HTML form with a type-ahead input for adding a currency
+           to the basket. Suggestions are filled in by currency.js from
+           CURRENCY_INDEX (or ?suggest= if the index cannot be loaded) rather
+           than rendering an <option> for each of cl_abbrs on every page.
         '''
 
-        basket_list = self.basket.split(',')
-
         select_html = "<div id='cur_select' class='myForm'>"
         select_html += "<form id='currency_form' action='#' "
         select_html += "onsubmit=\"addCurrency('text');return false\">"
-        select_html += "<label for='select_label'></label>"
-        select_html += "<select id='currency_abbr' type='text' name='abbrSelect'>"
-        select_html += "<option disabled selected value>  Add Currency </option>"
-
-        for abbr in cl_abbrs:
-            if abbr not in basket_list:
-                select_html += "<option value='{}'>{}</option>".\
-                                format(abbr, cl_abbrs[abbr])
-
-        select_html += "</select>"
+        select_html += "<label for='currency_abbr'></label>"
+        select_html += "<input id='currency_abbr' type='text' name='abbrSelect' "
+        select_html += "list='currency_list' autocomplete='off' size='24' "
+        select_html += "placeholder='Add Currency ({})'>".format(len(cl_abbrs))
+        select_html += "<datalist id='currency_list'></datalist>"
         select_html += "<input type='submit' class='mybutton'>"
         select_html += "</form></div>"
 
@@ -290,6 +558,8 @@ class CurrencyLayer:
 def db_connect(db_table):
     '''Confirm access to specified DynamoDB table and return table object'''
 
+    import boto3
+
     try:
         dynamo_db = boto3.resource('dynamodb')
         table = dynamo_db.Table(db_table)
@@ -300,22 +570,33 @@ def db_connect(db_table):
         return table
 
 
-def dynamo_update(table, abbr, rate, tstamp):
-    '''Update DynamoDB table with specified rate and timestamp using abbr key'''
+def dynamo_update(table, abbr, rate, tstamp, cutoff):
+    '''Update DynamoDB table with specified rate and timestamp using abbr
+       key, only if the stored timestamp is older than cutoff (or missing).
+       Return False if the condition failed because another invocation
+       already refreshed it; other errors are raised
+    '''
 
     try:
-        response = table.update_item(
+        table.update_item(
             Key={'Abbr': abbr},
             UpdateExpression='SET Rate = :r, Tstamp = :t',
+            ConditionExpression='attribute_not_exists(Tstamp) OR Tstamp < :c',
             ExpressionAttributeValues={
                 ':r': Decimal(str(rate)),
-                ':t': Decimal(str(tstamp))
+                ':t': Decimal(str(tstamp)),
+                ':c': Decimal(str(cutoff))
                 }
             )
-    except:
-        logger.error("Update_item: %s response = %s", abbr, response)
-    else:
-        logger.info("Updated Key: %s", abbr)
+    except Exception as e:
+        error = getattr(e, 'response', {}).get('Error', {})
+        if error.get('Code') == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+    logger.info("Updated Key: %s", abbr)
+
+    return True
 
 
 def dynamo_query(table, abbr):
@@ -334,15 +615,265 @@ def dynamo_query(table, abbr):
     return response['Item']
 
 
+def sig6(x, places=None):
+    '''x rounded to 6 significant digits, half to even on its decimal
+       digits as with precision 6 Decimal arithmetic. With places, ties at
+       that many decimals are also settled as half_even() would, so the
+       result can be formatted directly
+    '''
+
+    if x > 0:
+        exp = 5 - floor(log10(x))
+    elif x:
+        exp = 5 - floor(log10(-x))
+    else:
+        return 0.0
+
+    if exp < 0:
+        return sig6(x / POW10[-exp]) * POW10[-exp]
+
+    # Scale to a 6 digit integer part by an exact power of ten. Near a
+    # tie the float may sit either side of the exact decimal value, so
+    # ties go to the nearest even integer explicitly
+
+    scale = POW10[exp]
+    scaled = x * scale
+    whole = floor(scaled + 0.5)
+
+    if (scaled - whole) ** 2 > 0.2499999:
+        whole = 2 * floor(scaled * 0.5 + 0.5)
+
+    if places is not None and exp > places:
+        unit = POW10[exp - places]
+        if whole % unit * 2 == unit:
+            whole += unit / 2 if whole // unit % 2 else -unit / 2
+
+    return whole / scale
+
+
+def half_even(x, places=4):
+    '''x, or the nearest float to its rounded value when its decimal digits
+       are a tie at places decimals, so that formatting rounds half to even
+       on the decimal digits as Decimal does rather than on the binary value
+    '''
+
+    scaled = x * POW10[places]
+
+    if (scaled - floor(scaled + 0.5)) ** 2 > 0.2499999 - abs(scaled) * 4e-15:
+        return 2 * floor(scaled * 0.5 + 0.5) / POW10[places]
+
+    return x
+
+
 def t_stamp(t):
-    '''Utility function to format date and time from passed UNIX time'''
+    '''Utility function to format date and time from passed UNIX time.
+       DynamoDB returns numbers as Decimal so convert to int for localtime()
+    '''
+
+    return(strftime('%b %d, %Y, %H:%M %Z', localtime(int(t))))
+
+
+def quote_codes(basket, currency='USD'):
+    '''Codes to request for basket. A base currency other than USD is added
+       to the same request so rates can be rebased without another one
+    '''
+
+    if currency == 'USD' or currency in basket.upper().split(','):
+        return basket
+
+    return basket + ',' + currency
+
+
+def default_provider(base, key):
+    '''Provider built from PROVIDERS, HEDGE_AFTER and PROVIDER_TIMEOUT for
+       Currency Layer base URL and access key, shared by all invocations
+    '''
+
+    spec = (base, key, tuple(config.PROVIDERS), config.HEDGE_AFTER,
+            config.PROVIDER_TIMEOUT)
+    provider = _providers.get(spec)
+
+    if provider is None:
+        provider = _providers[spec] = providers.build(
+            config.PROVIDERS, base, key, config.HEDGE_AFTER,
+            config.PROVIDER_TIMEOUT)
+
+    return provider
+
+
+def baseline_items(abbrs):
+    '''Return {abbr: DynamoDB baseline item}. Items are read from the
+       baselines cache; misses are read from DynamoDB, and items up to
+       BASELINE_SWR past expiry are used while one background refresh runs
+    '''
+
+    items = {}
+    refresh = []
+    table = None
+
+    for abbr in abbrs:
+        item, expired = cache_swr('baselines', abbr, config.BASELINE_TTL,
+                                  config.BASELINE_SWR)
+
+        if expired:
+            refresh.append(abbr)
+
+        if item is None:
+            if table is None:
+                with span('db_connect'):
+                    table = db_connect(config.DYNAMO_DB_TABLE)
+            with span('baseline_read'):
+                item = dynamo_query(table, abbr)
+            cache_put('baselines', abbr, item)
+
+        items[abbr] = item
+
+    if refresh:
+        refresh_later('baselines', refresh, read_baselines)
+
+    return items
+
+
+def read_baselines(abbrs):
+    '''Background refresh of baselines for refresh_later(). Each thread
+       needs its own boto3 resource, so connect here
+    '''
+
+    table = db_connect(config.DYNAMO_DB_TABLE)
+
+    return {abbr: dynamo_query(table, abbr) for abbr in abbrs}
+
+
+def refresh_baselines(quotes, items, table=None):
+    '''Move baselines older than BASELINE_WINDOW to the USD rates in
+       quotes. items is {abbr: baseline item, or None if not in the table}.
+
+       Currencies whose rate has not changed keep their baseline and are
+       not written, so writes follow rate movement rather than traffic.
+       Writes are conditional on the stored baseline still being older than
+       the window, so when containers race on the same quote one wins and
+       the others re-read its item. Return list of abbrs written
+    '''
 
-    return(strftime('%b %d, %Y, %H:%M %Z', localtime(t)))
+    cutoff = quotes.timestamp - config.BASELINE_WINDOW
+    written = []
+
+    for abbr, item in items.items():
+        rate = quotes.get(abbr)
+
+        if not rate or abbr == quotes.source:
+            continue
+
+        if item is not None:
+            if int(item['Tstamp']) >= cutoff:
+                continue
+            if float(item['Rate']) == rate:
+                metrics.current().count('baseline_unchanged')
+                continue
+
+        if table is None:
+            with span('db_connect'):
+                table = db_connect(config.DYNAMO_DB_TABLE)
+
+        try:
+            with span('baseline_write'):
+                updated = dynamo_update(table, abbr, rate, quotes.timestamp,
+                                        cutoff)
+            if not updated:
+                metrics.current().count('baseline_conflicts')
+                with span('baseline_read'):
+                    cache_put('baselines', abbr, dynamo_query(table, abbr))
+                continue
+        except Exception as e:
+            logger.error('Unable to refresh baseline for %s: %s', abbr, e)
+            continue
+
+        cache_put('baselines', abbr, {'Abbr': abbr,
+                                      'Rate': Decimal(str(rate)),
+                                      'Tstamp': Decimal(quotes.timestamp)})
+        metrics.current().count('baseline_writes')
+        written.append(abbr)
+
+    return written
+
+
+def refresh_universe():
+    '''Refresh the baselines of every quoted currency, including those in
+       no basket, from one full-universe ('*') quote fetch and one scan of
+       the baseline table. Runs once per new quote. Return list of abbrs
+       written
+    '''
+
+    global _universe_ts
+
+    cl_feed = CurrencyLayer(config.BASE, 'list', config.CL_KEY, '')
+    cl_feed.cl_validate(max_stale=0)
+
+    if cl_feed.stale or cl_feed.cl_ts == _universe_ts:
+        return []
+
+    with span('db_connect'):
+        table = db_connect(config.DYNAMO_DB_TABLE)
+
+    items = dict.fromkeys(cl_feed.quotes.codes())
+
+    with span('baseline_read'):
+        for item in scan_baselines(table):
+            if item['Abbr'] in items:
+                items[item['Abbr']] = item
+                cache_put('baselines', item['Abbr'], item)
+
+    written = refresh_baselines(cl_feed.quotes, items, table)
+    _universe_ts = cl_feed.cl_ts
+
+    return written
+
+
+def scan_baselines(table):
+    '''Yield every item of the baseline table'''
+
+    kwargs = {}
+
+    while True:
+        response = table.scan(**kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def quote_expiry(fetched, quotes):
+    '''UNIX time a cached QuoteSet expires. Quotes are published every
+       QUOTE_TTL seconds; if the next one is overdue recheck periodically
+    '''
+
+    return max(quotes.timestamp + config.QUOTE_TTL,
+               fetched + config.QUOTE_RECHECK)
+
+
+def quote_fresh(fetched, quotes):
+    '''True if a cached QuoteSet is current'''
+
+    return time() < quote_expiry(fetched, quotes)
 
 
 def fetch_html(url):
+    '''Return HTML fragment from cache or, if expired, from the Web'''
+
+    html = cache_get('fragments', url, config.FRAGMENT_TTL)
+
+    if html is None:
+        html = read_html(url)
+        cache_put('fragments', url, html)
+
+    return html
+
+
+def read_html(url):
     '''Given a Web URL, read and remove leading whitespace, return as string'''
 
+    from urllib.request import urlopen
+
     response = []
     with urlopen(url) as html:
         for line in html:
@@ -352,15 +883,79 @@ def fetch_html(url):
     return ''.join(response)
 
 
+def local_fragment(name):
+    '''Return text of a file in FRAGMENT_DIR with leading whitespace removed,
+       as read_html() does. Files are read once, or re-read when changed if
+       FRAGMENT_RELOAD is set
+    '''
+
+    entry = _local.get(name)
+
+    if entry is None or config.FRAGMENT_RELOAD:
+        path = os.path.join(config.FRAGMENT_DIR, name)
+        mtime = os.stat(path).st_mtime
+        if entry is None or entry[0] != mtime:
+            with open(path, encoding='utf-8') as f:
+                entry = _local[name] = (mtime,
+                                        ''.join(line.lstrip() for line in f))
+
+    return entry[1]
+
+
+def page_parts():
+    '''Return (head, navbar, footer) HTML for the page. In 'inline' render
+       mode these are assembled once from local files, otherwise fragments
+       are fetched from S3 (via the fragment cache)
+    '''
+
+    global _template
+
+    if config.RENDER_MODE != 'inline':
+        return (fetch_html(config.CURRENCY_HEAD_HTML) + style_links(),
+                fetch_html(config.CURRENCY_NAV_BAR),
+                fetch_html(config.CURRENCY_FOOTER))
+
+    if _template is None or config.FRAGMENT_RELOAD:
+        name = lambda url: url[len(config.S3_BASE):]
+        _template = (local_fragment(name(config.CURRENCY_HEAD_HTML))
+                     + style_links(),
+                     local_fragment(name(config.CURRENCY_NAV_BAR)),
+                     local_fragment(name(config.CURRENCY_FOOTER)))
+
+    return _template
+
+
+def style_links():
+    '''Stylesheet and favicon links for the HTML head. The stylesheet is
+       embedded instead when INLINE_CSS is set in 'inline' render mode
+    '''
+
+    ICO_LINK = "rel='icon' type='image/x-icon' href='{}'".\
+                format(config.CURRENCY_ICO)
+
+    if config.RENDER_MODE == 'inline' and config.INLINE_CSS:
+        css = "<style>" + local_fragment('currency_main.css') + "</style>"
+    else:
+        css = "<link rel='stylesheet' type='text/css' href='{}'>".\
+               format(config.CURRENCY_CSS)
+
+    return css + "<link " + ICO_LINK + ">"
+
+
 def build_resp(event):
     '''Format the Head, Body and Script sections of the DOM including any CSS'''
 
-    # Import variable definitions associated with CurrencyLayer service
+    # Start with default basket and spread from the configuration file
 
-    from currency_config import CL_KEY, BASE, MODE, basket, api_spread
-    from currency_config import CURR_ABBRS, CURRENCY_HEAD_HTML, CURRENCY_NAV_BAR
-    from currency_config import CURRENCY_FOOTER, CURRENCY_JS
-    from currency_config import CURRENCY_CSS, CURRENCY_ICO
+    basket = config.basket
+    api_spread = config.api_spread
+    currency = config.base_currency
+    query = None
+    positions = None
+    chart = None
+    chart_range = '1m'
+    points = config.CHART_POINTS
+    method = 'lttb'
 
     # If options passed as URL parameters, use to replace default values
 
@@ -378,29 +973,81 @@ def build_resp(event):
             if key.lower() == "spread":
                 if val:
                     api_spread = Decimal(val)
+            if key.lower() == "suggest":
+                query = val
+            if key.lower() == "portfolio":
+                positions = val
+            if key.lower() == "chart":
+                chart = val
+            if key.lower() == "range":
+                if val:
+                    chart_range = val.lower()
+            if key.lower() == "points":
+                if val:
+                    points = val
+            if key.lower() == "method":
+                if val:
+                    method = val.lower()
+            if key.lower() == "base":
+                if val and val.upper() in config.CURR_ABBRS:
+                    currency = val.upper()
+                elif val:
+                    logger.error('Unknown base currency: %s', val)
+
+    # Type-ahead lookups return JSON rather than a page
+
+    if query is not None:
+        return suggest_resp(query, basket)
+
+    if positions is not None:
+        return portfolio_resp(positions, currency, api_spread)
 
-    logger.info('Basket: %s Spread: %s', basket, api_spread)
+    if chart is not None:
+        return chart_resp(chart or basket, chart_range, points, method,
+                          currency)
+
+    logger.info('Basket: %s Spread: %s Base: %s', basket, api_spread, currency)
 
     try:
         logger.info('Client IP address is: %s', event['context']['source-ip'])
     except:
         logger.error('Unable to parse client IP address')
 
-    # Load HTML Header as defined in config file
+    # Serve from the page cache if already rendered for the current quotes,
+    # e.g. by a scheduled precompute() run
+
+    key = page_key(basket, api_spread, currency)
+    record_request(key)
+
+    html = cached_page(key)
 
-    html_head = fetch_html(CURRENCY_HEAD_HTML)
+    if html is not None:
+        metrics.current().count('pages_cache_hits')
+        return html
 
-    # Load CSS Stylesheet & Favicon as defined in config file
+    # Otherwise another container's precompute() may have published it to
+    # PAGE_BUCKET. Only worth a request when rendering here would first
+    # have to fetch quotes
 
-    CSS_LINK = "rel='stylesheet' type='text/css' href='{}'".format(CURRENCY_CSS)
-    ICO_LINK = "rel='icon' type='image/x-icon' href='{}'".format(CURRENCY_ICO)
+    if config.PAGE_BUCKET and fresh_quotes(key) is None:
+        html = published_page(key)
+        if html is not None:
+            metrics.current().count('pages_bucket_hits')
+            return html
 
-    html_head += "<link " + CSS_LINK + ">"
-    html_head += "<link " + ICO_LINK + ">"
+    return render_page(basket, api_spread, currency)
 
-    # Place a Navigation bar at top of page
 
-    html_body = fetch_html(CURRENCY_NAV_BAR)
+def render_page(basket, api_spread, currency='USD'):
+    '''Render the page for a basket and spread in a base currency. Pages
+       rendered from current (not stale) quotes are added to the page cache
+    '''
+
+    # Load HTML Header, CSS Stylesheet, Favicon and Navigation bar as defined
+    # in config file, either from S3 or the precompiled template
+
+    with span('fragments'):
+        html_head, html_body, html_footer = page_parts()
 
     # Build main HTML body of program
 
@@ -414,9 +1061,15 @@ def build_resp(event):
     # Note: Javascript is used to replace the UTC time with local time so
     # we use 'title=' option in <H2> tag to show UTC time when user hovers
 
+    # cl_feed is created outside the try block as the currency picker and
+    # definitions below are still shown when no quotes are available
+
+    cl_feed = CurrencyLayer(config.BASE, config.MODE, config.CL_KEY, basket,
+                            currency=currency)
+
     try:
-        cl_feed = CurrencyLayer(BASE, MODE, CL_KEY, basket)
-        cl_feed.cl_validate()
+        with span('cl_validate'):
+            cl_feed.cl_validate()
     except:
         html_body += "<h2>Error when attempting to access Rate Service</h2>"
         html_body += "<h3>Please see CloudWatch Logs for detail</h3>"
@@ -424,11 +1077,15 @@ def build_resp(event):
         html_body += "<h2 id='t_stamp' title='" + t_stamp(cl_feed.cl_ts) + "'>"
         html_body += "As of " + t_stamp(cl_feed.cl_ts) + "</h2>"
 
+        if cl_feed.stale:
+            html_body += "<h3 class='stale'>Rate Service unavailable, "
+            html_body += "rates may be out of date</h3>"
+
         html_body += cl_feed.get_rates(api_spread) + "\n"
 
     # Provide button to add new currencies to basket
 
-    html_body += cl_feed.build_select(CURR_ABBRS) + "\n"
+    html_body += cl_feed.build_select(config.CURR_ABBRS) + "\n"
 
     # Display list of abbreviation definitions for currency basket
 
@@ -439,7 +1096,7 @@ def build_resp(event):
     html_body +=  "</button>"
     html_body += "</div>"
 
-    html_body += cl_feed.get_list(CURR_ABBRS)
+    html_body += cl_feed.get_list(config.CURR_ABBRS)
 
     # Provide button to reset currency basket and spread % to defaults
 
@@ -452,7 +1109,7 @@ def build_resp(event):
 
     # Add a footer section to end of page
 
-    html_body += "\n" + fetch_html(CURRENCY_FOOTER)
+    html_body += "\n" + html_footer
 
     # Javascript used to rebuild Lambda URI, handle user events and convert
     # UTC Epoch timestamp to user's local timezone. Initialize key variables
@@ -460,10 +1117,12 @@ def build_resp(event):
 
     html_js  = "<script>"
     html_js +=   "const BASKET = '" + basket + "';"
+    html_js +=   "const BASE_CURRENCY = '" + currency + "';"
     html_js +=   "const CL_TS = '" + str(cl_feed.cl_ts) + "';"
+    html_js +=   "const CURRENCY_INDEX = '" + config.CURRENCY_INDEX + "';"
     html_js += "</script>\n"
 
-    html_js += "<script src='" + CURRENCY_JS + "'></script>\n"
+    html_js += "<script src='" + config.CURRENCY_JS + "'></script>\n"
 
     # Load jQuery scripts from CDN (necessary for Bootstrap's JavaScript plugins)
 
@@ -473,9 +1132,9 @@ def build_resp(event):
 
     html_js += "<script src='https://maxcdn.bootstrapcdn.com/bootstrap/3.3.7/js/bootstrap.min.js' crossorigin='anonymous'></script>\n"
 
-    # Assemble DOM and return to caller, either main() or lambda_handler()
-    # main() will then output code to stdout and lambda_handler() will return
-    # output HTML/CSS/JS to trigger function, typically API Gateway -> browser
+    # Assemble DOM and return to caller, either lambda_handler() or server.py
+    # Both return output HTML/CSS/JS to the browser, lambda_handler() via its
+    # trigger function (typically API Gateway) and server.py directly
 
     resp = "<!DOCTYPE html>\n" \
             + "<html lang='en'>\n" \
@@ -484,13 +1143,638 @@ def build_resp(event):
             + html_js + "</body>\n" \
             + "</html>"
 
+    if cl_feed.quotes.timestamp and not cl_feed.stale:
+        cache_put('pages', page_key(basket, api_spread, currency),
+                  (cl_feed.cl_ts, resp), limit=config.PAGE_CACHE_SIZE)
+
     return resp
 
 
+def page_key(basket, spread, currency='USD'):
+    '''Page cache key. Spread is normalized so 1, 1.0 and '1.00' match'''
+
+    return (basket, repr(float(spread)), currency)
+
+
+def record_request(key):
+    '''Count requests per page so precompute() can find popular baskets.
+       The basket is also logged with the invocation's metrics line
+    '''
+
+    with _popular_lock:
+        _popular[key] += 1
+
+        if len(_popular) > config.POPULAR_LIMIT:
+            for rare, _ in _popular.most_common()[config.POPULAR_LIMIT // 2:]:
+                del _popular[rare]
+
+    metrics.current().properties['Basket'] = key[0]
+    metrics.current().properties['Spread'] = key[1]
+    metrics.current().properties['Base'] = key[2]
+
+
+def cached_page(key):
+    '''Return cached page if rendered from the quotes currently cached for
+       its basket and those quotes are still fresh, else None
+    '''
+
+    page = _cache['pages'].get(key)
+
+    if page is None:
+        return None
+
+    quotes = fresh_quotes(key)
+
+    if quotes and page[1][0] == quotes[1].timestamp:
+        return page[1][1]
+
+    return None
+
+
+def fresh_quotes(key):
+    '''Cached (fetched, QuoteSet) for a page key's basket if current and
+       its provider is not failing, else None
+    '''
+
+    basket = '*' if config.MODE == 'list' else quote_codes(key[0], key[2])
+    quotes = _cache['quotes'].get(basket)
+
+    if quotes and quote_fresh(*quotes) and basket not in _failures:
+        return quotes
+
+    return None
+
+
+def precompute(event, local=False):
+    '''Scheduled event mode. Render the default page, any baskets listed in
+       the event detail and the PRECOMPUTE_TOP most requested pages to
+       PAGE_BUCKET, so user requests are cache hits. Pages are only
+       re-rendered once a new quote is published.
+
+       The most requested pages are counted across all containers from the
+       request logs (see logged_popular()). Without PAGE_BUCKET no pages are
+       rendered, since only the container running this event would see
+       them. With local, as run by server.py in each worker, pages are
+       rendered into this process's page cache from its own request counts.
+
+       The EventBridge rule may pass a constant detail, e.g.
+       {"baskets": ["EUR,GBP,JPY", ["EUR,CHF", 1.5], ["GBP,JPY", 1, "EUR"]],
+        "top": 20, "charts": ["1m", "1y"]}
+
+       "charts" lists chart range tiers to read into the chart cache for
+       the default basket, so ?chart= requests for it are cache hits.
+       With BASELINE_UNIVERSE, every currency's baseline is refreshed too
+    '''
+
+    detail = event.get('detail') or {}
+    top = int(detail.get('top', config.PRECOMPUTE_TOP))
+
+    keys = [page_key(config.basket, config.api_spread, config.base_currency)]
+
+    for basket in detail.get('baskets', []):
+        if isinstance(basket, str):
+            keys.append(page_key(basket, config.api_spread,
+                                 config.base_currency))
+        else:
+            keys.append(page_key(*basket))
+
+    if local:
+        with _popular_lock:
+            keys += [key for key, _ in _popular.most_common(top)]
+    elif config.PAGE_BUCKET:
+        keys += logged_popular(top)
+    else:
+        logger.info('PAGE_BUCKET not set, no pages precomputed')
+        keys = []
+
+    result = {'rendered': [], 'unchanged': [], 'failed': [], 'charts': [],
+              'baselines': []}
+
+    if config.BASELINE_UNIVERSE:
+        try:
+            with span('baseline_refresh'):
+                result['baselines'] = refresh_universe()
+        except Exception as e:
+            logger.error('Baseline refresh failed: %s', e)
+
+    for key in dict.fromkeys(keys):
+        basket, spread, currency = key
+        name = basket if currency == 'USD' else basket + ' in ' + currency
+        cl_feed = CurrencyLayer(config.BASE, config.MODE, config.CL_KEY,
+                                basket, currency=currency)
+        try:
+            cl_feed.cl_validate(max_stale=0)
+        except Exception:
+            result['failed'].append(name)
+            continue
+
+        page = _cache['pages'].get(key)
+
+        if page and page[1][0] == cl_feed.cl_ts and not cl_feed.stale:
+            result['unchanged'].append(name)
+            continue
+
+        with span('precompute'):
+            html = render_page(basket, float(spread), currency)
+
+        if config.PAGE_BUCKET and not cl_feed.stale:
+            with span('publish'):
+                publish_page(key, html, cl_feed.quotes)
+
+        result['rendered'].append(name)
+
+    from chart import RANGES
+
+    for name in detail.get('charts', []):
+        if name not in RANGES:
+            logger.error('Unknown chart range: %s', name)
+            continue
+        with span('precompute'):
+            chart_tiers(config.basket.upper().split(','), name,
+                        config.base_currency)
+        result['charts'].append(name)
+
+    metrics.current().count('pages_rendered', len(result['rendered']))
+    logger.info('Precompute: %s', result)
+
+    return result
+
+
+def logged_popular(top):
+    '''Return page keys of the top most requested pages in the last
+       POPULAR_WINDOW seconds, counted from the Basket, Spread and Base of
+       every container's request metrics lines with a CloudWatch Logs
+       Insights query. Cached for POPULAR_TTL. [] if the query fails
+    '''
+
+    keys = cache_get('popular', top, config.POPULAR_TTL)
+
+    if keys is not None:
+        return list(keys)
+
+    log_group = config.POPULAR_LOG_GROUP or \
+                os.environ.get('AWS_LAMBDA_LOG_GROUP_NAME')
+
+    if not log_group or top < 1:
+        return []
+
+    import boto3
+
+    query = ('filter ispresent(Basket) '
+             '| stats count(*) as requests by Basket, Spread, Base '
+             '| sort requests desc | limit {}'.format(top))
+    now = int(time())
+
+    try:
+        with span('popular_query'):
+            logs = boto3.client('logs')
+            query_id = logs.start_query(
+                logGroupName=log_group, queryString=query,
+                startTime=now - config.POPULAR_WINDOW, endTime=now)['queryId']
+            while True:
+                response = logs.get_query_results(queryId=query_id)
+                if response['status'] not in ('Scheduled', 'Running'):
+                    break
+                if time() > now + config.POPULAR_QUERY_TIMEOUT:
+                    logs.stop_query(queryId=query_id)
+                    raise TimeoutError('query did not complete')
+                sleep(0.5)
+    except Exception as e:
+        logger.error('Unable to query popular pages in %s: %s', log_group, e)
+        return []
+
+    if response['status'] != 'Complete':
+        logger.error('Popular pages query %s', response['status'])
+        return []
+
+    keys = []
+
+    for row in response['results']:
+        fields = {field['field']: field['value'] for field in row}
+        try:
+            keys.append(page_key(fields['Basket'], fields['Spread'],
+                                 fields.get('Base', 'USD')))
+        except (KeyError, ValueError):
+            continue
+
+    cache_put('popular', top, keys)
+
+    return keys
+
+
+def page_object(key):
+    '''PAGE_BUCKET object name for a page key, e.g. pages/EUR%2CGBP_1.0.html
+       or pages/EUR%2CGBP_1.0_CHF.html in another base currency
+    '''
+
+    from urllib.parse import quote
+
+    return '{}{}_{}{}.html'.format(config.PAGE_PREFIX,
+                                   quote(key[0].upper(), safe=''), key[1],
+                                   '' if key[2] == 'USD' else '_' + key[2])
+
+
+def publish_page(key, html, quotes):
+    '''Write a rendered page to PAGE_BUCKET as a static object, cacheable
+       until the next quote is due. The quote timestamp is kept in the
+       object metadata for published_page()
+    '''
+
+    import boto3
+
+    max_age = max(0, int(quotes.timestamp + config.QUOTE_TTL - time()))
+
+    boto3.client('s3').put_object(
+        Bucket=config.PAGE_BUCKET, Key=page_object(key),
+        Body=html.encode('utf-8'), ContentType='text/html; charset=utf-8',
+        CacheControl='public, max-age={}'.format(max_age),
+        Metadata={'quote-ts': str(int(quotes.timestamp))})
+
+
+def published_page(key):
+    '''Return the page published to PAGE_BUCKET for key if it was rendered
+       from quotes which are still current, else None
+    '''
+
+    import boto3
+
+    try:
+        with span('published_page'):
+            page = boto3.client('s3').get_object(Bucket=config.PAGE_BUCKET,
+                                                 Key=page_object(key))
+            quote_ts = int(page['Metadata'].get('quote-ts', 0))
+            if time() >= quote_ts + config.QUOTE_TTL:
+                return None
+            return page['Body'].read().decode('utf-8')
+    except Exception as e:
+        error = getattr(e, 'response', {}).get('Error', {})
+        if error.get('Code') not in ('NoSuchKey', '404'):
+            logger.error('Unable to read published page %s: %s',
+                         page_object(key), e)
+        return None
+
+
+def suggest_resp(query, basket):
+    '''JSON list of currencies matching query for the picker type-ahead,
+       excluding those already in basket. Used when the browser could not
+       load the static CURRENCY_INDEX file.
+    '''
+
+    from suggest import suggest_json
+
+    metrics.current().count('suggestions')
+
+    return suggest_json(query or '', exclude=basket.upper().split(','))
+
+
+def portfolio_resp(positions, currency, spread):
+    '''JSON valuation of ?portfolio=EUR:1000,GBP:-250 in currency. All
+       positions are valued against the cached full-universe ('*') quotes,
+       with change since the DynamoDB baselines and PORTFOLIO_HORIZONS
+    '''
+
+    from json import dumps
+    from portfolio import Portfolio, parse_positions, baseline_quotes
+
+    holdings = Portfolio(parse_positions(positions))
+    cl_feed = CurrencyLayer(config.BASE, 'list', config.CL_KEY, '')
+
+    try:
+        with span('cl_validate'):
+            cl_feed.cl_validate()
+    except Exception:
+        return dumps({'error': 'Rate service unavailable'})
+
+    codes = [code for code in dict.fromkeys(holdings.codes() + [currency])
+             if code in cl_feed.quotes and code != cl_feed.quotes.source]
+
+    try:
+        horizons = [('baseline', baseline_quotes(baseline_items(codes)))]
+    except Exception:
+        logger.error('Unable to read baselines for portfolio')
+        horizons = []
+
+    horizons += history_horizons(codes, cl_feed.cl_ts)
+
+    try:
+        report = holdings.value(cl_feed.quotes, currency, float(spread),
+                                horizons)
+    except KeyError:
+        return dumps({'error': 'No quote for ' + currency})
+
+    report['stale'] = cl_feed.stale
+    metrics.current().count('portfolios')
+    metrics.current().count('portfolio_positions', holdings.positions)
+
+    return dumps(report, separators=(',', ':'))
+
+
+def history_horizons(codes, now):
+    '''Return [(horizon name, QuoteSet)] for PORTFOLIO_HORIZONS before now
+       from the rate history store. Rates are cached per horizon and
+       currency for BASELINE_TTL, including misses, so each is looked up at
+       most once per TTL
+    '''
+
+    from portfolio import history_quotes
+
+    store = None
+    horizons = []
+
+    try:
+        for name, seconds in config.PORTFOLIO_HORIZONS:
+            found = {}
+            for abbr in codes:
+                entry = cache_get('horizons', (name, abbr), config.BASELINE_TTL)
+                if entry is None:
+                    entry = (0, 0.0)
+                    if store is None:
+                        store = open_history()
+                    if store:
+                        try:
+                            with span('history_read'):
+                                old = history_quotes(store, [abbr],
+                                                     now - seconds)
+                            entry = (old.timestamp, old.get(abbr, 0.0))
+                        except Exception as e:
+                            logger.error('Rate history read failed for %s: '
+                                         '%s', abbr, e)
+                    cache_put('horizons', (name, abbr), entry)
+                if entry[1]:
+                    found['USD' + abbr] = entry
+            if found:
+                horizons.append((name, QuoteSet.from_json({
+                    'quotes': {key: rate for key, (_, rate) in found.items()},
+                    'timestamp': min(t for t, _ in found.values())})))
+    finally:
+        if store:
+            store.close()
+
+    return horizons
+
+
+def open_history():
+    '''Open the rate history store, or log and return False if unavailable'''
+
+    try:
+        import history
+        return history.open_store()
+    except Exception as e:
+        logger.error('Rate history unavailable: %s', e)
+        return False
+
+
+def chart_tiers(codes, name, currency):
+    '''Return {abbr: [(tstamp, rate)]} of range tier name in currency for
+       each of codes. Tiers are cached for CHART_TTL, so history is read at
+       most once per TTL; failed reads give an empty series and are retried
+       on the next request
+    '''
+
+    from chart import tier_series
+
+    store = None
+    series = {}
+
+    try:
+        for abbr in codes:
+            key = (abbr, currency, name)
+            points = cache_get('charts', key, config.CHART_TTL)
+            if points is None:
+                points = []
+                if store is None:
+                    store = open_history()
+                if store:
+                    try:
+                        with span('history_read'):
+                            points = tier_series(store, abbr, name,
+                                                 int(time()), currency)
+                    except Exception as e:
+                        logger.error('Rate history read failed for %s: %s',
+                                     abbr, e)
+                    else:
+                        cache_put('charts', key, points,
+                                  limit=config.CHART_CACHE_SIZE)
+            series[abbr] = points
+    finally:
+        if store:
+            store.close()
+
+    return series
+
+
+def chart_resp(codes, name, points, method, currency):
+    '''JSON of ?chart=EUR,GBP&range=1y&points=500: each currency's rate in
+       currency over range tier name, downsampled from the cached tier to
+       at most points points with method ('lttb' or 'minmax')
+    '''
+
+    from json import dumps
+    from chart import RANGES, DOWNSAMPLERS, TIER_POINTS, compact
+
+    if name not in RANGES:
+        return dumps({'error': 'Unknown range ' + name,
+                      'ranges': list(RANGES)})
+
+    if method not in DOWNSAMPLERS:
+        return dumps({'error': 'Unknown method ' + method,
+                      'methods': list(DOWNSAMPLERS)})
+
+    try:
+        points = min(max(int(points), 2), TIER_POINTS)
+    except ValueError:
+        points = config.CHART_POINTS
+
+    codes = [abbr for abbr in dict.fromkeys(codes.upper().split(','))
+             if abbr in config.CURR_ABBRS][:config.CHART_MAX_SERIES]
+
+    downsample = DOWNSAMPLERS[method]
+    series = {}
+
+    with span('chart'):
+        for abbr, tier in chart_tiers(codes, name, currency).items():
+            series[abbr] = compact(downsample(tier, points))
+
+    metrics.current().count('charts')
+    metrics.current().count('chart_series', len(series))
+
+    return dumps({'range': name, 'base': currency, 'method': method,
+                  'points': points, 'series': series}, separators=(',', ':'))
+
+
 def lambda_handler(event, context):
-    '''AWS Lambda Event handler'''
+    '''AWS Lambda Event handler. Page rendering is timed by phase and the
+       results written as a single CloudWatch EMF metrics line. Scheduled
+       (EventBridge) events run precompute() instead of rendering a page
+    '''
+
+    metrics.start(metrics.function_name('currency_lambda'),
+                  config.DEBUG_SAMPLE_RATE)
+
+    if metrics.sampled():
+        logger.info('Event: %s', event)
+        logger.info('Context: %s', context)
+
+    try:
+        if event.get('detail-type') == 'Scheduled Event':
+            return precompute(event)
+        profile = profile_mode(event)
+        if profile:
+            return profiled_resp(event, profile)
+        with span('render'):
+            return build_resp(event)
+    finally:
+        with span('snapshot'):
+            save_snapshot()
+        metrics.emit()
+
+
+def profile_mode(event):
+    '''Return 'return' if the request carries ?profile=<PROFILE_TOKEN>,
+       'log' if selected by PROFILE_SAMPLE_RATE, else None
+    '''
+
+    try:
+        token = event['params']['querystring'].get('profile')
+    except (KeyError, TypeError, AttributeError):
+        token = None
+
+    # hmac is imported only for profile requests, as it is slow to import
+    # and most cold starts never need it
+
+    if token:
+        if config.PROFILE_TOKEN:
+            import hmac
+            if hmac.compare_digest(token.encode('utf-8'),
+                                   config.PROFILE_TOKEN.encode('utf-8')):
+                return 'return'
+        logger.error('Profile request rejected: invalid token')
+
+    if config.PROFILE_SAMPLE_RATE and random() < config.PROFILE_SAMPLE_RATE:
+        return 'log'
+
+    return None
+
+
+def profiled_resp(event, mode):
+    '''Run build_resp() under cProfile and tracemalloc and log the report.
+       In 'return' mode the report is returned in place of the page
+    '''
+
+    from html import escape
+    from profiling import profile_call
+
+    with span('profile'):
+        resp, report = profile_call(build_resp, event, top=config.PROFILE_TOP)
+
+    logger.info('Profile report:\n%s', report)
+    metrics.current().count('profiled')
+
+    if mode != 'return':
+        return resp
+
+    return "<!DOCTYPE html>\n<html lang='en'><body><pre>" \
+           + escape(report) + "</pre></body></html>"
+
+
+def snapshot_key():
+    '''Identify the configuration a snapshot was built with so snapshots
+       from a different deployment are not reused
+    '''
+
+    return (config.BASE, config.S3_BASE, config.DYNAMO_DB_TABLE)
+
+
+def save_snapshot():
+    '''Write caches to SNAPSHOT_PATH if anything changed'''
+
+    global _cache_dirty
+
+    if config.SNAPSHOT_PATH and _cache_dirty:
+
+        # Copy each cache under the lock cache_put() takes, so threads
+        # still refreshing entries do not change them while they are packed.
+        # Changes made after the copy set the dirty flag again
+
+        with _refresh_lock:
+            caches = {kind: dict(entries) for kind, entries in _cache.items()}
+            _cache_dirty = False
 
-    logger.info('Event: %s', event)
-    logger.info('Context: %s', context)
+        try:
+            caches['quotes'] = {url: (fetched, quotes.to_json())
+                                for url, (fetched, quotes)
+                                in caches['quotes'].items()}
+            saved = snapshot.save(config.SNAPSHOT_PATH,
+                                  {'key': snapshot_key(), 'caches': caches})
+        except Exception as e:
+            logger.error('Unable to save snapshot: %s', e)
+            saved = False
+
+        # Keep the changes for the next save if this one failed
+
+        if not saved:
+            _cache_dirty = True
+
+
+def load_snapshot():
+    '''Populate caches from SNAPSHOT_PATH. Return True if loaded'''
+
+    if not config.SNAPSHOT_PATH:
+        return False
+
+    data = snapshot.load(config.SNAPSHOT_PATH)
+
+    if not data or data.get('key') != snapshot_key():
+        return False
+
+    for kind, entries in data['caches'].items():
+        if kind == 'quotes':
+            entries = {url: (fetched, QuoteSet.from_json(rate_dict))
+                       for url, (fetched, rate_dict) in entries.items()}
+        if kind in _cache:
+            with _refresh_lock:
+                _cache[kind].update(entries)
+
+    logger.info('Loaded snapshot: %s', {k: len(v) for k, v in _cache.items()})
+
+    return True
+
+
+def revalidate():
+    '''Refresh fragments and expired quotes loaded from a snapshot. Runs in
+       a background thread so the first request is served from the snapshot
+    '''
+
+    with _refresh_lock:
+        urls = list(_cache['fragments'])
+        cached = list(_cache['quotes'].items())
+
+    for url in urls:
+        try:
+            cache_put('fragments', url, read_html(url))
+        except Exception:
+            logger.error('Unable to revalidate %s', url)
+
+    provider = default_provider(config.BASE, config.CL_KEY)
+
+    for basket, (fetched, quotes) in cached:
+        if not quote_fresh(fetched, quotes):
+            try:
+                cache_put('quotes', basket,
+                          provider.fetch(None if basket == '*' else basket),
+                          limit=config.QUOTE_CACHE_SIZE)
+            except Exception:
+                logger.error('Unable to revalidate quotes')
+
+
+# Container initialization: precompile the page template in 'inline' render
+# mode, and start from the last snapshot if one survived
+
+if config.RENDER_MODE == 'inline':
+    try:
+        page_parts()
+    except OSError:
+        logger.error('Unable to read fragments from %s', config.FRAGMENT_DIR)
 
-    return build_resp(event)
+if load_snapshot():
+    threading.Thread(target=revalidate, daemon=True).start()
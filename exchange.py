@@ -1,18 +1,36 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from json import loads
-from os import environ
-from hashlib import sha1
+import argparse
+import threading
+from queue import Queue, Empty
+from collections import deque
+from json import loads, dumps
+from os import environ, replace, getpid
 from signal import signal, SIGINT
 from urllib.request import urlopen
+from http.client import HTTPException
 from time import sleep, time, strftime, localtime
+from quotes import QuoteSet, labels
 
 """Monitor basket of currencies relative to the USD and highlight changes
 
     > python3 exchange.py
+    > python3 exchange.py --dashboard --fps 4
 
-    **Note: Requires CL_KEY to be set in OS shell environment
+    **Note: Requires CL_KEY to be set in OS shell environment. Set CL_BASE
+    (e.g. CL_BASE=EUR) to monitor relative to another currency; rates are
+    rebased locally from the USD quotes
+
+    The last quotes and next query time are saved to CL_STATE (default
+    .exchange_state.json, empty to disable) after every query. A restarted
+    monitor resumes from them and reports changes made while it was down
+
+    --dashboard shows the basket full screen instead, updated in place: rate,
+    inverse, change at the last update, a mini history of recent quotes and
+    a countdown to the next query. Only cells whose text changed are
+    rewritten, at most --fps times per second. Keys: q quits, arrow keys
+    and PgUp/PgDn scroll baskets taller than the terminal
 
     See: https://currencylayer.com/documentation
 
@@ -32,21 +50,64 @@ cur_col = {
     'endc': '\033[0m'
     }
 
+# Seconds to wait for the service to connect or send more of a response
+TIMEOUT = 30
+
+
+class RateError(Exception):
+    """Quote request failed; the message explains why"""
+
+
+def fetch_rates(url):
+    """Open URL, read and decode JSON formatted response and return it if
+    the query was successful, else raise RateError.
+    """
+    try:
+        webUrl = urlopen(url, timeout=TIMEOUT)
+    except Exception:
+        raise RateError('Not able to open: {}'.format(url))
+
+    # A connection reset, timeout or truncated body is a failed query too,
+    # so poll() reports it and retries rather than its thread dying
+    try:
+        rate_json = webUrl.read()
+    except (OSError, HTTPException) as e:
+        raise RateError('Not able to read: {} ({})'.format(url, e))
+    rate_dict = loads(rate_json.decode('utf-8'))
+
+    # Check to see if response if valid and report error info if not
+    if rate_dict['success'] is False:
+        raise RateError('code = {}, type = {}, \ninfo = {}'.format(
+            rate_dict['error']['code'],
+            rate_dict['error']['type'],
+            rate_dict['error']['info']))
+
+    return rate_dict
+
 
 class CurrencyLayer:
-    def __init__(self, key, basket):
+    def __init__(self, key, basket, base='USD', state_path=None):
         """Build URL we will use to get latest exchange rates
 
         Args:
             key - Access Key provided when siging up for CUrrencyLayer Account
             basket - Tuple of comma separated currency abbreviations
+            base - Currency rates are shown against. Quotes are USD based,
+                   so any other base is added to the same request
+            state_path - File monitor() checkpoints its state to, or None
         """
         base_url = 'http://www.apilayer.net/api/live?'
         self.cl_url = base_url + 'access_key=' + key + '&currencies='
+        self.base = base
+        self.basket = list(basket)
+        self.state_path = state_path
 
         for c in basket:
             self.cl_url += c + ','       # OK to leave trailing ','
 
+        if base != 'USD' and base not in basket:
+            self.cl_url += base
+
     def get_rates(self, url):
         """Open URL, read and decode JSON formatted response and confirm query
         was successful. If not, exit the program with some helpful diagnostics.
@@ -55,23 +116,10 @@ class CurrencyLayer:
             - url: fully formed URL we want to open and process results from
         """
         try:
-            webUrl = urlopen(url)
-        except:
-            print("Error: Not able to open: {}".format(url))
-            raise SystemExit()
-
-        rate_json = webUrl.read()
-        rate_dict = loads(rate_json.decode('utf-8'))
-
-        # Check to see if response if valid and display error info if not
-        if rate_dict['success'] is False:
-            print('Error: code = {}, type = {}, \ninfo = {}'.format(
-                rate_dict['error']['code'],
-                rate_dict['error']['type'],
-                rate_dict['error']['info']))
+            return fetch_rates(url)
+        except RateError as e:
+            print('Error: {}'.format(e))
             raise SystemExit()
-        else:
-            return (rate_dict)
 
     def monitor(self, interval):
         """Query currency exchange data and output results to system console.
@@ -82,74 +130,426 @@ class CurrencyLayer:
             - interval: Desired query interval in minutes (typically 60)
         """
         first_pass = True
+        to_base, from_base = labels(self.base)
+
+        # Resume from the last checkpoint if it was made for the same basket
+        # and base: the first query is compared with the saved quotes and is
+        # not made before the saved next query time
+        state = self.load_state()
+        if state:
+            prev_quote = QuoteSet.from_json(state['quote'])
+            first_pass = False
+            print('{} Resume monitoring, last quote: {}'.format(
+                  t_stamp(time()), t_stamp(prev_quote.timestamp)))
+
+            wait_time = int((state['next_query'] - time()) / 60)
+            if wait_time > 0:
+                print('\nNext query in {} minutes '.format(wait_time), end='')
+                tbar_sleep(wait_time)
 
         while True:
-            # Open URL provided, read data and onfirm quote data is valid
-            rates = self.get_rates(self.cl_url)
-
-            # Calculate hash on quote data structure and use to detect changes
-            quote_hash = sha1(str(rates['quotes']).encode("ascii")).hexdigest()
+            # Open URL provided, read data and onfirm quote data is valid,
+            # then rebase from USD if another base currency was chosen
+            quotes = QuoteSet.from_json(self.get_rates(self.cl_url))
+            try:
+                quotes = quotes.rebase(self.base)
+            except KeyError:
+                print('Error: No quote for base currency {}'.format(self.base))
+                raise SystemExit()
 
             # Determine number of minutes between last quote and current time
-            quote_time = rates['timestamp']
+            quote_time = quotes.timestamp
             quote_delay = (time()-quote_time) / 60
 
             # 1st time through initialize variables and display current rates
             # then loop back to top of while() loop
             if first_pass:
                 print('{} Begin monitoring'.format(t_stamp(time())))
-                prev_hash = quote_hash
-                prev_quote = rates['quotes']
+                prev_quote = quotes
 
                 print('Last quote updated: {}\n'.format(t_stamp(quote_time)))
 
-                for exch, cur_rate in prev_quote.items():
-                    in_usd = exch[-3:] + '/USD'
-                    in_for = 'USD/' + exch[3:]
+                for i in quotes.order:
+                    cur_rate = quotes.rates[i]
                     print('{}: {:>8.5f}   {}: {:>9.5f}'.format(
-                           in_usd, 1/cur_rate, in_for, cur_rate))
+                           to_base[i], 1/cur_rate, from_base[i], cur_rate))
                 first_pass = False
 
                 continue
 
-            # Compare hashs to determine if change has occured and, if so,
+            # Compare rates to determine if change has occured and, if so,
             # display exchange rates, including % of change, using color coding
-            # such that a relative increase in USD strength is green,
+            # such that a relative increase in base (USD) strength is green,
             # a decrease is red and no change is output in yellow text.
-            if quote_hash != prev_hash:
+            if not quotes.same_rates(prev_quote):
                 print('\n {}: Change(s) detected\n'.format(t_stamp(time())))
                 print(t_stamp(time()))
 
-                for exch, cur_rate in rates['quotes'].items():
-                    prev_rate = prev_quote[exch]
-                    delta = abs((1 - (cur_rate / prev_rate)) * 100)
+                for i, prev_rate, cur_rate, change in quotes.diff(prev_quote):
+                    delta = abs(change)
 
                     if cur_rate == prev_rate:
                         color = 'yellow'            # No change
                     elif cur_rate > prev_rate:
-                        color = 'green'             # Strong USD
+                        color = 'green'             # Strong base
                     else:
-                        color = 'red'               # Weaker USD
+                        color = 'red'               # Weaker base
 
-                    # Display both 'Foreign/USD' and 'USD/Foreign' results
-                    in_usd = exch[-3:] + '/USD'
-                    in_for = 'USD/' + exch[3:]
+                    # Display both 'Foreign/Base' and 'Base/Foreign' results
                     print('{}{}: {:>8.5f}   {}: {:>9.5f}   {:>5.2f}%'.format(
-                           cur_col[color], in_usd, 1/cur_rate,
-                           in_for, cur_rate, delta))
+                           cur_col[color], to_base[i], 1/cur_rate,
+                           from_base[i], cur_rate, delta))
 
                 print(cur_col['endc'], end='')  # Return cursor color to orig
-                prev_hash = quote_hash
-                prev_quote = rates['quotes']
+                prev_quote = quotes
 
             # Use time delta between current time and last quote time to
             # calculate number of minutes to wait until next query. Display
             # progress bar to mark passage of time. If for some reason, delay
             # is greater than interval, use absolute value of time delta
             wait_time = int(abs(interval - quote_delay))
+            self.save_state(quotes, time() + wait_time * 60)
             print('\nNext query in {} minutes '.format(wait_time), end='')
             tbar_sleep(wait_time)
 
+    def poll(self, interval, events, stop, start=0):
+        """Query quotes in a background thread for the dashboard until stop
+        is set, waiting until start before the first query. Each result is
+        put on the events queue as ('quotes', QuoteSet, next query time) or
+        ('error', message, retry time) and checkpointed like monitor().
+
+        Args:
+            - interval: Desired query interval in minutes (typically 60)
+        """
+        stop.wait(max(0, start - time()))
+
+        while not stop.is_set():
+            try:
+                quotes = QuoteSet.from_json(fetch_rates(self.cl_url))
+                quotes = quotes.rebase(self.base)
+            except KeyError:
+                next_query = time() + 60
+                events.put(('error', 'No quote for base currency {}'.format(
+                            self.base), next_query))
+            except (RateError, ValueError) as e:
+                next_query = time() + 60
+                events.put(('error', ' '.join(str(e).split()), next_query))
+            else:
+                quote_delay = (time() - quotes.timestamp) / 60
+                next_query = time() + abs(interval - quote_delay) * 60
+                events.put(('quotes', quotes, next_query))
+
+                # curses owns the terminal, so report a failed checkpoint
+                # on the dashboard's status line rather than printing
+
+                self.save_state(quotes, next_query, warn=lambda message:
+                                events.put(('error', message, next_query)))
+
+            stop.wait(next_query - time())
+
+    def dashboard(self, interval, fps):
+        """Show the basket full screen until 'q' is pressed, querying every
+        interval minutes as monitor() does. See Dashboard.
+        """
+        import curses
+        import locale
+
+        locale.setlocale(locale.LC_ALL, '')     # For the history blocks
+        state = self.load_state()
+
+        curses.wrapper(lambda screen: Dashboard(screen, self, fps).run(
+                       interval, state))
+
+    def save_state(self, quotes, next_query, warn=None):
+        """Checkpoint last quotes and next query time to state_path. The
+        file is written under a temporary name and renamed over the old one,
+        so it is never left half written. A failure is passed to warn, or
+        printed if warn is None.
+        """
+        if not self.state_path:
+            return
+
+        state = {'version': __version__,
+                 'basket': self.basket,
+                 'base': self.base,
+                 'quote': quotes.to_json(),
+                 'next_query': next_query}
+        tmp = '{}.{}.tmp'.format(self.state_path, getpid())
+
+        try:
+            with open(tmp, 'w') as f:
+                f.write(dumps(state))
+            replace(tmp, self.state_path)
+        except OSError as e:
+            message = 'Unable to save state to {}: {}'.format(
+                       self.state_path, e)
+            if warn is None:
+                print('Warning: ' + message)
+            else:
+                warn(message)
+
+    def load_state(self):
+        """Return state saved by save_state() for this basket and base, or
+        None if there is none or it is unreadable.
+        """
+        if not self.state_path:
+            return None
+
+        try:
+            with open(self.state_path) as f:
+                state = loads(f.read())
+            if state['basket'] == self.basket and state['base'] == self.base:
+                return state
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print('Warning: Ignoring state in {}: {}'.format(
+                   self.state_path, e))
+
+        return None
+
+
+class Dashboard:
+    """Full screen view of a basket which updates in place. The text and
+    attribute of every cell on screen are remembered, so a frame writes only
+    the cells which changed, and the terminal is only updated when one did:
+    usually just the countdown, once per second. Currency rows are only
+    reformatted when new quotes arrive or the view scrolls or resizes.
+    """
+
+    HISTORY = 16                        # Quotes shown in the mini history
+    BARS = u'\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588'
+    TOP = 2                             # Screen rows above the currencies
+
+    # (x, width) of the label, rate, inverse label, inverse, change and
+    # history columns
+
+    COLUMNS = ((0, 8), (9, 11), (22, 8), (31, 11), (44, 8), (54, HISTORY))
+
+    def __init__(self, screen, feed, fps):
+
+        import curses
+
+        self.curses = curses
+        self.screen = screen
+        self.feed = feed
+        self.fps = fps
+        self.to_base, self.from_base = labels(feed.base)
+
+        self.cells = {}                 # (y, x) -> (text, attr) on screen
+        self.changed = False            # Cells written since last update
+        self.rows_stale = True          # Currency rows need reformatting
+        self.offset = 0                 # First currency shown
+
+        self.quotes = None
+        self.changes = {}               # Currency index -> percent change
+        self.history = {}               # Currency index -> recent rates
+        self.next_query = 0
+        self.status = ''
+        self.colors = {'green': 0, 'red': 0, 'yellow': 0}
+
+    def put(self, y, x, width, text, attr=0):
+        """Write text padded to width at (y, x) unless already there"""
+
+        text = text[:width].ljust(width)
+
+        if self.cells.get((y, x)) == (text, attr):
+            return
+
+        height, cols = self.screen.getmaxyx()
+
+        if y >= height or x >= cols:
+            return
+
+        try:
+            self.screen.addstr(y, x, text[:cols - x], attr)
+        except self.curses.error:
+            pass                        # Writing the bottom right cell
+
+        self.cells[(y, x)] = (text, attr)
+        self.changed = True
+
+    def update(self, quotes, next_query):
+        """Take new quotes, noting the change from the previous ones"""
+
+        if self.quotes is not None and not quotes.same_rates(self.quotes):
+            self.changes = {i: change for i, _, _, change
+                            in quotes.diff(self.quotes)}
+
+        if self.quotes is None or quotes.timestamp != self.quotes.timestamp:
+            for i in quotes.order:
+                if i not in self.history:
+                    self.history[i] = deque(maxlen=self.HISTORY)
+                self.history[i].append(quotes.rates[i])
+
+        self.quotes = quotes
+        self.next_query = next_query
+        self.rows_stale = True
+
+    def spark(self, rates):
+        """Mini history of rates as block characters"""
+
+        low, high = min(rates), max(rates)
+
+        if high == low:
+            return self.BARS[3] * len(rates)
+
+        scale = (len(self.BARS) - 1) / (high - low)
+
+        return ''.join(self.BARS[int((r - low) * scale)] for r in rates)
+
+    def draw_row(self, y, i):
+
+        cols = self.COLUMNS
+        rate = self.quotes.rates[i]
+        change = self.changes.get(i)
+
+        if change is None or change == 0:
+            color = self.colors['yellow']       # No change
+        elif change < 0:
+            color = self.colors['green']        # Strong base
+        else:
+            color = self.colors['red']          # Weaker base
+
+        self.put(y, cols[0][0], cols[0][1], self.to_base[i] + ':')
+        self.put(y, cols[1][0], cols[1][1], '{:>11.5f}'.format(1 / rate))
+        self.put(y, cols[2][0], cols[2][1], self.from_base[i] + ':')
+        self.put(y, cols[3][0], cols[3][1], '{:>11.5f}'.format(rate))
+        self.put(y, cols[4][0], cols[4][1],
+                 '' if change is None else '{:>7.2f}%'.format(abs(change)),
+                 color)
+        self.put(y, cols[5][0], cols[5][1], self.spark(self.history[i]))
+
+    def draw(self):
+
+        height, width = self.screen.getmaxyx()
+        bold = self.curses.A_BOLD
+
+        self.put(0, 0, 24, 'Currency Monitor ({})'.format(self.feed.base),
+                 bold)
+
+        if self.quotes is not None:
+            self.put(0, 25, 30, 'Last quote: {}'.format(
+                     t_stamp(self.quotes.timestamp)))
+
+        left = max(0, int(self.next_query - time()))
+        self.put(0, 56, 20, 'Next query {:d}:{:02d}'.format(
+                 left // 60, left % 60) if left else 'Querying...')
+
+        if self.rows_stale:
+            self.rows_stale = False
+            cols = self.COLUMNS
+            order = self.quotes.order if self.quotes is not None else []
+            rows = max(0, height - self.TOP - 1)
+            self.offset = max(0, min(self.offset, len(order) - rows))
+
+            self.put(1, cols[1][0], cols[1][1], '{:>11}'.format('Rate'), bold)
+            self.put(1, cols[3][0], cols[3][1], '{:>11}'.format('Inverse'),
+                     bold)
+            self.put(1, cols[4][0], cols[4][1], '  Change', bold)
+            self.put(1, cols[5][0], cols[5][1], 'History', bold)
+
+            for j in range(rows):
+                y = self.TOP + j
+                if self.offset + j < len(order):
+                    self.draw_row(y, order[self.offset + j])
+                else:
+                    for x, w in cols:
+                        self.put(y, x, w, '')
+
+            status = self.status or 'q quit' + (
+                '  arrows/PgUp/PgDn scroll ({} more)'.format(
+                    len(order) - rows) if len(order) > rows else '')
+            self.put(height - 1, 0, width, status,
+                     self.curses.A_REVERSE if self.status else 0)
+
+    def scroll(self, key):
+        """Move the view for arrow and page keys. Return True if handled"""
+
+        curses = self.curses
+        page = max(1, self.screen.getmaxyx()[0] - self.TOP - 1)
+        steps = {curses.KEY_UP: -1, curses.KEY_DOWN: 1,
+                 curses.KEY_PPAGE: -page, curses.KEY_NPAGE: page}
+
+        if key not in steps:
+            return False
+
+        self.offset = max(0, self.offset + steps[key])
+        self.rows_stale = True
+
+        return True
+
+    def run(self, interval, state=None):
+        """Draw frames at fps until 'q' is pressed while poll() queries
+        quotes in a background thread. A checkpoint in state is shown until
+        the first query and the next query waits for its scheduled time.
+        """
+        curses = self.curses
+
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass
+
+        if curses.has_colors():
+            curses.use_default_colors()
+            for n, name in enumerate(('green', 'red', 'yellow'), 1):
+                curses.init_pair(n, getattr(curses, 'COLOR_' + name.upper()),
+                                 -1)
+                self.colors[name] = curses.color_pair(n)
+
+        # getch() waits up to one frame for a key, which paces the loop
+
+        self.screen.timeout(max(1, int(1000 / self.fps)))
+
+        start = 0
+
+        if state:
+            start = state['next_query']
+            self.update(QuoteSet.from_json(state['quote']), start)
+            self.status = 'Resumed from {}'.format(self.feed.state_path)
+
+        events = Queue()
+        stop = threading.Event()
+        threading.Thread(target=self.feed.poll, daemon=True,
+                         args=(interval, events, stop, start)).start()
+
+        try:
+            while True:
+                key = self.screen.getch()
+
+                if key in (ord('q'), ord('Q')):
+                    return
+
+                if key == curses.KEY_RESIZE:
+                    self.cells.clear()
+                    self.screen.erase()
+                    self.rows_stale = True
+                elif key != -1:
+                    self.scroll(key)
+
+                while True:
+                    try:
+                        kind, value, next_query = events.get_nowait()
+                    except Empty:
+                        break
+                    if kind == 'quotes':
+                        self.status = ''
+                        self.update(value, next_query)
+                    else:
+                        self.status = 'Error: ' + value
+                        self.next_query = next_query
+                        self.rows_stale = True
+
+                self.draw()
+
+                if self.changed:
+                    self.changed = False
+                    self.screen.noutrefresh()
+                    curses.doupdate()
+        finally:
+            stop.set()
+
 
 def t_stamp(t):
     """Timestamp utility formats date and time using UNIX styletime value."""
@@ -159,10 +559,7 @@ def t_stamp(t):
 
 def tbar_sleep(width):
     """Create a progress bar to mark passage of time in minutes"""
-    print('[' + '-'*width, end=']', flush=True)
-    for i in range(width+1):
-        print('\b', end='', flush=True)
-        sleep(0.02)
+    print('[' + '-'*width + ']' + '\b'*(width+1), end='', flush=True)
     for i in range(width):
         sleep(60)
         print(u'\u2588', end='', flush=True)    # Display BLOCK character
@@ -175,14 +572,22 @@ def signal_handler(signal, frame):
     raise SystemExit()
 
 
-def main():
+def main(argv=None):
     """
     Read API key from from os.environ(), exit if not set. Define basket of
     currencies we wish to monitor. Set monitoring interval, instantiate
-    CurrencyLayer() object and invoke monitoring() method with desired
-    interval.
+    CurrencyLayer() object and invoke monitoring() method, or the dashboard,
+    with desired interval.
     """
 
+    parser = argparse.ArgumentParser(
+        description='Monitor a basket of currencies and highlight changes')
+    parser.add_argument('--dashboard', action='store_true',
+                        help='Full screen view updated in place')
+    parser.add_argument('--fps', type=float, default=2,
+                        help='Dashboard frames per second (default: 2)')
+    args = parser.parse_args(argv)
+
     try:
         key = environ['CL_KEY']
     except KeyError:
@@ -191,11 +596,17 @@ def main():
         raise SystemExit()
 
     basket = ('EUR', 'GBP', 'CNY', 'CAD', 'AUD', 'JPY')
+    base = environ.get('CL_BASE', 'USD').upper()
+    state_path = environ.get('CL_STATE', '.exchange_state.json')
 
     interval = 60        # In minutes
 
-    c = CurrencyLayer(key, basket)
-    c.monitor(interval)
+    c = CurrencyLayer(key, basket, base, state_path or None)
+
+    if args.dashboard:
+        c.dashboard(interval, args.fps)
+    else:
+        c.monitor(interval)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Export the rate history store (see history.py) to columnar files for
+    analysis, one partition per calendar month (UTC):
+
+        python3 export.py exports/                   # new months only
+        python3 export.py exports/ --format csv --codes EUR,GBP,JPY
+        python3 export.py exports/ --full --start 2015-01
+
+    Each partition is a directory named month=YYYY-MM holding rates.parquet
+    (or rates.arrow / rates.csv) with the columns timestamp, currency and
+    rate, so pandas.read_parquet('exports/') or pyarrow.dataset reads the
+    whole export with month as a partition column. Parquet and Arrow files
+    store timestamp as a UTC timestamp and need the pyarrow module; CSV
+    stores epoch seconds. --format auto picks Parquet if pyarrow is
+    installed, else CSV.
+
+    Rows are streamed from the store and written CHUNK_ROWS at a time (one
+    Parquet row group per chunk), so memory use does not depend on the size
+    of the history. Each partition is written to a temporary file and
+    renamed into place, so readers never see a partial file.
+
+    Exported partitions are recorded in STATE_FILE in the output directory.
+    Later runs re-export the newest recorded month, which may have been
+    incomplete, and every month after it. --full exports everything again.
+
+    Author: Michael O'Connor
+"""
+
+import os
+import sys
+import csv
+import json
+import argparse
+from time import time, gmtime, strftime, strptime
+from calendar import timegm
+
+import history
+
+CHUNK_ROWS = 100000             # Rows held in memory per write
+STATE_FILE = '_export_state.json'
+COLUMNS = ('timestamp', 'currency', 'rate')
+
+
+class CsvPartition:
+    """Partition file of comma separated values"""
+
+    suffix = '.csv'
+
+    def __init__(self, path):
+
+        self.fp = open(path, 'w', newline='')
+        self.out = csv.writer(self.fp)
+        self.out.writerow(COLUMNS)
+
+    def write(self, chunk):
+        self.out.writerows(chunk)
+
+    def close(self):
+        self.fp.close()
+
+
+class ParquetPartition:
+    """Partition file in Parquet format, one row group per chunk"""
+
+    suffix = '.parquet'
+
+    def __init__(self, path):
+
+        import pyarrow.parquet as pq
+
+        self.writer = pq.ParquetWriter(path, arrow_schema(),
+                                       compression='zstd')
+
+    def write(self, chunk):
+        self.writer.write_table(arrow_table(chunk))
+
+    def close(self):
+        self.writer.close()
+
+
+class ArrowPartition:
+    """Partition file in Arrow IPC (Feather v2) format"""
+
+    suffix = '.arrow'
+
+    def __init__(self, path):
+
+        import pyarrow as pa
+
+        self.sink = pa.OSFile(path, 'wb')
+        self.writer = pa.ipc.new_file(self.sink, arrow_schema())
+
+    def write(self, chunk):
+        self.writer.write_table(arrow_table(chunk))
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+FORMATS = {'parquet': ParquetPartition,
+           'arrow': ArrowPartition,
+           'csv': CsvPartition}
+
+
+def arrow_schema():
+
+    import pyarrow as pa
+
+    return pa.schema([('timestamp', pa.timestamp('s', tz='UTC')),
+                      ('currency', pa.dictionary(pa.int16(), pa.string())),
+                      ('rate', pa.float64())])
+
+
+def arrow_table(chunk):
+    """pyarrow Table from a list of (tstamp, abbr, rate) rows"""
+
+    import pyarrow as pa
+
+    tstamps, abbrs, rates = zip(*chunk)
+    schema = arrow_schema()
+
+    return pa.table([pa.array(tstamps, schema.field('timestamp').type),
+                     pa.array(abbrs).dictionary_encode().cast(
+                         schema.field('currency').type),
+                     pa.array(rates, pa.float64())], schema=schema)
+
+
+def pick_format(name):
+    """Resolve 'auto' to parquet if pyarrow is installed, else csv"""
+
+    if name != 'auto':
+        return name
+
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return 'csv'
+
+    return 'parquet'
+
+
+def month_start(month):
+    """Epoch seconds at the start of month 'YYYY-MM' (UTC)"""
+
+    return timegm(strptime(month, '%Y-%m'))
+
+
+def month_of(tstamp):
+    """'YYYY-MM' of an epoch timestamp (UTC)"""
+
+    return strftime('%Y-%m', gmtime(tstamp))
+
+
+def months(first, last):
+    """Yield (month, start, end) from month first to last inclusive, where
+       end is the last second of the month
+    """
+
+    year, month = map(int, first.split('-'))
+
+    while '{:04d}-{:02d}'.format(year, month) <= last:
+        name = '{:04d}-{:02d}'.format(year, month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        yield name, month_start(name), \
+            month_start('{:04d}-{:02d}'.format(year, month)) - 1
+
+
+def load_state(path):
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(path, state):
+    """Atomically replace the state file"""
+
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+
+    os.replace(tmp, path)
+
+
+def export_month(store, out_dir, month, start, end, fmt, codes=None,
+                 chunk_rows=CHUNK_ROWS):
+    """Write one month of history to out_dir/month=YYYY-MM. Return
+       (rows, first tstamp, last tstamp); no file is written for 0 rows
+    """
+
+    writer_class = FORMATS[fmt]
+    directory = os.path.join(out_dir, 'month=' + month)
+    path = os.path.join(directory, 'rates' + writer_class.suffix)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+
+    writer = None
+    rows = 0
+    first = last = None
+
+    try:
+        for chunk in history.chunked(store.scan(start, end, codes),
+                                     chunk_rows):
+            if writer is None:
+                os.makedirs(directory, exist_ok=True)
+                writer = writer_class(tmp)
+            writer.write(chunk)
+            rows += len(chunk)
+            low = min(row[0] for row in chunk)
+            high = max(row[0] for row in chunk)
+            first = low if first is None else min(first, low)
+            last = high if last is None else max(last, high)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp)
+        raise
+
+    if writer is not None:
+        writer.close()
+        os.replace(tmp, path)
+
+    return rows, first, last
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description='Export rate history to monthly columnar files')
+    parser.add_argument('out', help='Output directory')
+    parser.add_argument('--format', default='auto',
+                        choices=['auto'] + sorted(FORMATS),
+                        help='File format (default: parquet if pyarrow '
+                             'is installed, else csv)')
+    parser.add_argument('--store', default=None,
+                        help="'dynamodb' or SQLite path (default: config)")
+    parser.add_argument('--codes', default=None, metavar='EUR,GBP',
+                        help='Only export these currencies')
+    parser.add_argument('--start', metavar='YYYY-MM',
+                        help='First month (default: the newest exported '
+                             'month, or the oldest stored)')
+    parser.add_argument('--end', metavar='YYYY-MM',
+                        help='Last month (default: this month)')
+    parser.add_argument('--full', action='store_true',
+                        help='Ignore the state file and export every month')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help='Rows written per chunk (default: {:,})'.
+                             format(CHUNK_ROWS))
+    args = parser.parse_args(argv)
+
+    codes = args.codes.upper().split(',') if args.codes else None
+    state_path = os.path.join(args.out, STATE_FILE)
+    state = {} if args.full else load_state(state_path)
+
+    # 'auto' keeps the format of an existing export
+
+    if args.format == 'auto' and state:
+        fmt = state['settings']['format']
+    else:
+        fmt = pick_format(args.format)
+
+    if fmt != 'csv':
+        try:
+            import pyarrow
+        except ImportError:
+            print('Error: --format {} needs the pyarrow module'.format(fmt))
+            return 1
+
+    # A different format or currency selection cannot be resumed
+
+    settings = {'format': fmt, 'codes': codes}
+
+    if state and state.get('settings') != settings:
+        print('Error: {} was written with {}; use --full to re-export'.
+              format(state_path, state.get('settings')))
+        return 1
+
+    partitions = state.get('partitions', {})
+
+    store = history.open_store(args.store)
+
+    try:
+        if args.start:
+            first = args.start
+        elif partitions:
+            first = max(partitions)     # May have been exported part way
+        else:
+            oldest = store.earliest(codes)
+            if oldest is None:
+                print('No history to export')
+                return 0
+            first = month_of(oldest)
+
+        last = args.end or month_of(time())
+        os.makedirs(args.out, exist_ok=True)
+        total = 0
+
+        for month, start, end in months(first, last):
+            rows, low, high = export_month(store, args.out, month, start,
+                                           end, fmt, codes, args.chunk_rows)
+            if not rows:
+                continue
+            total += rows
+            partitions[month] = {'rows': rows, 'first': low, 'last': high,
+                                 'exported': int(time())}
+            save_state(state_path, {'settings': settings,
+                                    'partitions': partitions})
+            print('{}: {:,} rows'.format(month, rows))
+    finally:
+        store.close()
+
+    print('{:,} rows exported to {} as {} ({} months)'.format(
+          total, args.out, fmt, len(partitions)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Rate history store for the Currency Exchange Rate project.
+
+   The DynamoDB table used by currency_lambda.py only holds one baseline row
+   per currency. History is kept separately as (Tstamp, Abbr, Rate) rows in
+   one of two stores selected by HISTORY_STORE in currency_config.py:
+
+   'dynamodb' - DYNAMO_HISTORY_TABLE with Abbr as HASH key and Tstamp as
+                RANGE key, e.g.
+
+                +---------+------------+-----------+
+                | Abbr    | Tstamp     | Rate      |
+                |{String} | {Number}   | {Decimal} |
+                +---------+------------+-----------+
+                |   EUR   | 1545782399 |  0.877704 |
+                |   EUR   | 1545868799 |  0.876204 |
+
+   <path>     - Local SQLite file with the same columns, useful on a
+                workstation for analysis, charts and exports
+
+   Both stores provide put_many() for batched writes, series()/scan()
+   which stream rows back in timestamp order without loading them all, and
+   earliest() for the oldest timestamp held.
+'''
+
+import sqlite3
+from decimal import Decimal
+from itertools import islice
+
+import currency_config as config
+
+
+def open_store(spec=None):
+    '''Return history store named by spec (default HISTORY_STORE)'''
+
+    spec = spec or config.HISTORY_STORE
+
+    if spec == 'dynamodb':
+        return DynamoHistory(config.DYNAMO_HISTORY_TABLE)
+
+    return SqliteHistory(spec)
+
+
+def chunked(rows, size):
+    '''Yield lists of up to size rows from an iterable'''
+
+    rows = iter(rows)
+
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class DynamoHistory:
+    '''History rows held in a DynamoDB table keyed on (Abbr, Tstamp)'''
+
+    def __init__(self, table_name, region=None):
+
+        import boto3
+
+        self.table_name = table_name
+        self.table = boto3.resource('dynamodb',
+                                    region_name=region).Table(table_name)
+
+    def put_many(self, rows, limiter=None):
+        '''Write iterable of (tstamp, abbr, rate) rows using batch_writer,
+           which groups puts into BatchWriteItem requests and resends any
+           unprocessed items. limiter.wait() is called before each item.
+           Return number of rows written.
+        '''
+
+        count = 0
+
+        with self.table.batch_writer(
+                overwrite_by_pkeys=['Abbr', 'Tstamp']) as batch:
+            for tstamp, abbr, rate in rows:
+                if limiter:
+                    limiter.wait()
+                batch.put_item(Item={'Abbr': abbr,
+                                     'Tstamp': int(tstamp),
+                                     'Rate': Decimal(str(rate))})
+                count += 1
+
+        return count
+
+    def series(self, abbr, start=0, end=2**31):
+        '''Yield (tstamp, rate) for abbr between start and end inclusive'''
+
+        from boto3.dynamodb.conditions import Key
+
+        kwargs = {'KeyConditionExpression': Key('Abbr').eq(abbr)
+                  & Key('Tstamp').between(int(start), int(end)),
+                  'ProjectionExpression': 'Tstamp, Rate'}
+
+        while True:
+            response = self.table.query(**kwargs)
+            for item in response.get('Items', []):
+                yield int(item['Tstamp']), float(item['Rate'])
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def scan(self, start=0, end=2**31, codes=None):
+        '''Yield (tstamp, abbr, rate) between start and end, one currency
+           at a time
+        '''
+
+        for abbr in (codes or config.CURR_ABBRS):
+            for tstamp, rate in self.series(abbr, start, end):
+                yield tstamp, abbr, rate
+
+    def earliest(self, codes=None):
+        '''Oldest tstamp stored for any of codes (default all), or None.
+           One single-item query per currency
+        '''
+
+        from boto3.dynamodb.conditions import Key
+
+        first = None
+
+        for abbr in (codes or config.CURR_ABBRS):
+            items = self.table.query(
+                KeyConditionExpression=Key('Abbr').eq(abbr),
+                ProjectionExpression='Tstamp', Limit=1)['Items']
+            if items and (first is None or int(items[0]['Tstamp']) < first):
+                first = int(items[0]['Tstamp'])
+
+        return first
+
+    def close(self):
+        pass
+
+
+class SqliteHistory:
+    '''History rows held in a local SQLite file'''
+
+    BATCH = 10000
+
+    def __init__(self, path):
+
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS history ('
+                        'abbr TEXT NOT NULL, tstamp INTEGER NOT NULL, '
+                        'rate REAL NOT NULL, PRIMARY KEY (abbr, tstamp)) '
+                        'WITHOUT ROWID')
+        self.db.execute('CREATE INDEX IF NOT EXISTS history_tstamp '
+                        'ON history (tstamp)')
+
+    def put_many(self, rows, limiter=None):
+        '''Insert or replace (tstamp, abbr, rate) rows, committing every
+           BATCH rows. Return number of rows written.
+        '''
+
+        count = 0
+
+        for chunk in chunked(rows, self.BATCH):
+            if limiter:
+                limiter.wait(len(chunk))
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO history '
+                                    '(tstamp, abbr, rate) VALUES (?, ?, ?)',
+                                    ((int(t), a, float(r))
+                                     for t, a, r in chunk))
+            count += len(chunk)
+
+        return count
+
+    def series(self, abbr, start=0, end=2**31):
+        '''Yield (tstamp, rate) for abbr between start and end inclusive'''
+
+        return self.db.execute('SELECT tstamp, rate FROM history '
+                               'WHERE abbr = ? AND tstamp BETWEEN ? AND ? '
+                               'ORDER BY tstamp', (abbr, start, end))
+
+    def scan(self, start=0, end=2**31, codes=None):
+        '''Yield (tstamp, abbr, rate) between start and end in time order'''
+
+        rows = self.db.execute('SELECT tstamp, abbr, rate FROM history '
+                               'WHERE tstamp BETWEEN ? AND ? '
+                               'ORDER BY tstamp, abbr', (start, end))
+
+        if codes:
+            codes = set(codes)
+            return (row for row in rows if row[1] in codes)
+
+        return rows
+
+    def earliest(self, codes=None):
+        '''Oldest tstamp stored for any of codes (default all), or None'''
+
+        if not codes:
+            return self.db.execute('SELECT MIN(tstamp) FROM history'
+                                   ).fetchone()[0]
+
+        stamps = [self.db.execute('SELECT MIN(tstamp) FROM history '
+                                  'WHERE abbr = ?', (abbr,)).fetchone()[0]
+                  for abbr in codes]
+        stamps = [t for t in stamps if t is not None]
+
+        return min(stamps) if stamps else None
+
+    def close(self):
+        self.db.close()
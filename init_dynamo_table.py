@@ -2,9 +2,16 @@
 # -*- coding: utf-8 -*-
 
 from urllib.request import urlopen
-from decimal import Decimal, getcontext
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from random import uniform
 from json import loads
+from time import sleep
+import threading
+import argparse
 import boto3
+from botocore.exceptions import ClientError
+from quotes import QuoteSet
 
 """ Python utility to initialize AWS DynamoDB table with Currency Abbreviations,
     Currency Exchange Rates and timestamp of latest update from Currency Layer.
@@ -13,6 +20,16 @@ import boto3
     currency exchange monitoring program which relies on DynamoDB for
     persistent storage.
 
+    By default the table is scanned first and only currencies which are
+    missing or whose rate has changed are written, using parallel scan
+    segments and writer threads with backoff when DynamoDB throttles:
+
+        python3 init_dynamo_table.py                     # diff load
+        python3 init_dynamo_table.py --only EUR,GBP      # reseed a few
+        python3 init_dynamo_table.py --dry-run           # report only
+        python3 init_dynamo_table.py --regions us-east-1,eu-west-1
+        python3 init_dynamo_table.py --full              # overwrite all
+
     Requires that Table be previously created with basic schema defined e.g:
 
     dynamo_db_table {
@@ -31,7 +48,7 @@ class CurrencyLayer:
 
     """
 
-    def __init__(self, base, mode, key):
+    def __init__(self, base, mode, key, basket=None):
         """Build URL we will use to query latest exchange rates from
            Currency Layer Web Service
 
@@ -39,16 +56,15 @@ class CurrencyLayer:
           base - base portion of URL
           mode - 'live' or 'list'
           key - Access Key provided when siging up for CurrencyLayer Account
+          basket - Optional comma separated currency abbreviations, default
+                   is all supported currencies
         """
 
         self.cl_url = base + mode + '?access_key=' + key
+        if basket:
+            self.cl_url += '&currencies=' + basket
         self.rate_dict = {}
 
-        # Working with Decimal numbers so set precision to prevent strange
-        # floating point approximations
-
-        getcontext().prec = 6
-
 
     def cl_validate(self):
         """Open URL constructed in init(). If initial open is successful, read
@@ -102,8 +118,7 @@ def db_batch_update(table, data):
     t_stamp = data['timestamp']
 
     with table.batch_writer() as batch:
-        for exch, cur_rate in data['quotes'].items():
-            abbr = exch[-3:]
+        for abbr, cur_rate in QuoteSet.from_json(data):
             print('Updating: {}...'.format(abbr))
             batch.put_item(
                 Item={
@@ -114,18 +129,187 @@ def db_batch_update(table, data):
             )
 
 
-def main():
+# DynamoDB error codes which mean 'slow down and try again'
+
+THROTTLE_ERRORS = ('ProvisionedThroughputExceededException',
+                   'ThrottlingException', 'RequestLimitExceeded',
+                   'InternalServerError')
+
+BATCH_SIZE = 25                 # Max items per BatchWriteItem request
+
+_local = threading.local()
+
+
+def db_resource(region):
+    """Return a DynamoDB resource for region. boto3 resources are not
+       thread safe so each worker thread gets its own
+    """
+
+    resources = getattr(_local, 'resources', None)
+
+    if resources is None:
+        resources = _local.resources = {}
+
+    if region not in resources:
+        session = boto3.session.Session()
+        resources[region] = session.resource('dynamodb', region_name=region)
+
+    return resources[region]
+
+
+def with_backoff(func, *args, retries=8, base_delay=0.05, **kwargs):
+    """Call func, retrying with exponential backoff and full jitter when
+       DynamoDB reports throttling. Other errors are raised immediately.
+    """
+
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code not in THROTTLE_ERRORS or attempt == retries:
+                raise
+            sleep(uniform(0, base_delay * 2 ** attempt))
+
+
+def scan_segment(region, table_name, segment, segments):
+    """Read one parallel scan segment, returning {abbr: item}"""
+
+    table = db_resource(region).Table(table_name)
+    items = {}
+    kwargs = {'Segment': segment, 'TotalSegments': segments,
+              'ProjectionExpression': 'Abbr, Rate, Tstamp'}
+
+    while True:
+        response = with_backoff(table.scan, **kwargs)
+        for item in response.get('Items', []):
+            items[item['Abbr']] = item
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def db_scan(region, table_name, segments):
+    """Scan the whole table with parallel segments, returning {abbr: item}"""
+
+    items = {}
+
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        parts = pool.map(lambda s: scan_segment(region, table_name,
+                                                s, segments),
+                         range(segments))
+        for part in parts:
+            items.update(part)
+
+    return items
+
+
+def plan_updates(existing, data, only=None):
+    """Compare Currency Layer data with existing table items and return
+       list of items which are missing or whose rate has changed. If only
+       is given, restrict to those currency abbreviations.
+    """
+
+    t_stamp = Decimal(data['timestamp'])
+    items = []
+
+    for abbr, cur_rate in QuoteSet.from_json(data):
+        if only and abbr not in only:
+            continue
+
+        rate = Decimal(str(cur_rate))
+        old = existing.get(abbr)
+
+        if old is None or old.get('Rate') != rate:
+            items.append({'Abbr': abbr, 'Rate': rate, 'Tstamp': t_stamp})
+
+    return items
+
+
+def write_batch(region, table_name, items):
+    """Write up to BATCH_SIZE items, resubmitting any unprocessed items
+       with backoff until all are written
+    """
+
+    resource = db_resource(region)
+    request = {table_name: [{'PutRequest': {'Item': item}} for item in items]}
+    attempt = 0
+
+    while request:
+        response = with_backoff(resource.batch_write_item,
+                                RequestItems=request)
+        request = response.get('UnprocessedItems') or {}
+        if request:
+            sleep(uniform(0, 0.05 * 2 ** min(attempt, 8)))
+            attempt += 1
+
+    return len(items)
+
+
+def db_parallel_write(region, table_name, items, workers):
+    """Split items into batches and write them using a pool of workers"""
+
+    batches = [items[i:i + BATCH_SIZE]
+               for i in range(0, len(items), BATCH_SIZE)]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(lambda b: write_batch(region, table_name, b),
+                            batches))
+
+
+def sync_table(region, table_name, data, only, segments, dry_run):
+    """Diff load one table: scan, compare and write only what changed"""
+
+    label = '{}:{}'.format(region or 'default', table_name)
+
+    existing = db_scan(region, table_name, segments)
+    items = plan_updates(existing, data, only)
+
+    print('{}: {} items in table, {} to write'.format(
+          label, len(existing), len(items)))
+
+    if dry_run:
+        for item in items:
+            old = existing.get(item['Abbr'], {}).get('Rate', 'missing')
+            print('  {}: {} -> {}'.format(item['Abbr'], old, item['Rate']))
+        return 0
+
+    written = db_parallel_write(region, table_name, items, segments)
+    print('{}: wrote {} items'.format(label, written))
+
+    return written
+
+
+def main(argv=None):
     """Query Currency Layer service for complete list of available Currencies
        along with current exchange rate relative to USD and update timestamp.
-       Use resulting data dictionary to populate the DynamoDB table with initial
-       values for Abbr, Rate and Timestamp.
+       Use resulting data dictionary to populate the DynamoDB table(s) with
+       values for Abbr, Rate and Timestamp, writing only what has changed
+       unless --full is given.
     """
 
     from currency_config import BASE, MODE, CL_KEY
     from currency_config import DYNAMO_DB_TABLE
 
+    parser = argparse.ArgumentParser(
+        description='Initialize or refresh DynamoDB currency baselines')
+    parser.add_argument('--only', default=None, metavar='EUR,GBP',
+                        help='Only reseed these currency abbreviations')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Show what would be written without writing')
+    parser.add_argument('--full', action='store_true',
+                        help='Overwrite every currency (original behavior)')
+    parser.add_argument('--table', default=DYNAMO_DB_TABLE)
+    parser.add_argument('--regions', default=None, metavar='R1,R2',
+                        help='Update the table in each of these regions')
+    parser.add_argument('--segments', type=int, default=4,
+                        help='Parallel scan segments and writer threads')
+    args = parser.parse_args(argv)
+
+    only = set(args.only.upper().split(',')) if args.only else None
+
     try:
-        cl_feed = CurrencyLayer(BASE, MODE, CL_KEY)
+        cl_feed = CurrencyLayer(BASE, MODE, CL_KEY, args.only)
         cl_feed.cl_validate()
     except:
         print('Unable to instantiate or validate currency_layer object')
@@ -134,13 +318,28 @@ def main():
         cl_rates = cl_feed.get_rates()
         print('Call to Currency Layer Service was Successful')
 
-    print('Accessing DynamoDB Table...')
-    _db = boto3.resource('dynamodb')
-    cl_table = _db.Table(DYNAMO_DB_TABLE)
-    print("Table {} created: {}".format(DYNAMO_DB_TABLE, cl_table.creation_date_time))
-
-    print('Starting Batch update of DynamoDB Table...')
-    db_batch_update(cl_table, cl_rates)
+    regions = args.regions.split(',') if args.regions else [None]
+
+    if args.full:
+        for region in regions:
+            if args.dry_run:
+                print('{}:{}: would write {} items'.format(
+                      region or 'default', args.table,
+                      len(cl_rates['quotes'])))
+                for abbr, cur_rate in QuoteSet.from_json(cl_rates):
+                    print('  {}: {}'.format(abbr, cur_rate))
+                continue
+            print('Accessing DynamoDB Table...')
+            cl_table = db_resource(region).Table(args.table)
+            print("Table {} created: {}".format(args.table,
+                                                cl_table.creation_date_time))
+            print('Starting Batch update of DynamoDB Table...')
+            db_batch_update(cl_table, cl_rates)
+    else:
+        with ThreadPoolExecutor(max_workers=len(regions)) as pool:
+            list(pool.map(lambda r: sync_table(r, args.table, cl_rates, only,
+                                               args.segments, args.dry_run),
+                          regions))
 
     print('All done!')
 
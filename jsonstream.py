@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Incremental reader for large JSON objects such as Currency Layer
+   'timeframe' responses or full-universe 'list' responses.
+
+   iter_members() walks the top-level object of a JSON document read from a
+   file or HTTP response and yields its members one at a time. Members whose
+   name is listed in expand (e.g. 'quotes') are not decoded whole; their own
+   members are yielded individually instead. Memory use is therefore bounded
+   by the largest single value rather than the size of the document:
+
+       with open('timeframe.json') as f:
+           for path, value in iter_members(f, expand=('quotes',)):
+               # ('success', True), ..., (('quotes', '2018-01-01'), {...})
+'''
+
+import io
+from json import JSONDecoder, JSONDecodeError
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+NUMBER_CHARS = '0123456789.eE+-'     # Characters which may continue a number
+
+_decoder = JSONDecoder()
+
+
+class _Reader:
+    '''Sliding text buffer over a file-like object'''
+
+    def __init__(self, fp, chunk_size):
+
+        if isinstance(fp.read(0), bytes):
+            fp = io.TextIOWrapper(fp, encoding='utf-8')
+
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        '''Read another chunk, discarding consumed text. False at EOF'''
+
+        if self.eof:
+            return False
+
+        chunk = self.fp.read(self.chunk_size)
+
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        '''Return next non-whitespace character without consuming it'''
+
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of JSON document')
+
+    def expect(self, char):
+        '''Consume char or raise ValueError'''
+
+        if self.peek() != char:
+            raise ValueError('Expected {!r} at offset {}'.format(char, self.pos))
+        self.pos += 1
+
+    def value(self):
+        '''Decode the next complete JSON value. A value ending exactly at the
+           end of the buffer may be truncated (e.g. a number split across
+           chunks), as may a number followed by a character that could
+           continue it (e.g. '1.' before the rest arrives), so more input is
+           read before accepting either
+        '''
+
+        self.peek()
+
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+
+            complete = end < len(self.buf) and not (
+                isinstance(value, (int, float))
+                and self.buf[end] in NUMBER_CHARS)
+
+            if complete or not self.fill():
+                self.pos = end
+                return value
+
+
+def _members(reader, expand):
+    '''Yield (name, value) for members of the object at the reader position'''
+
+    reader.expect('{')
+
+    if reader.peek() == '}':
+        reader.pos += 1
+        return
+
+    while True:
+        key = reader.value()
+        reader.expect(':')
+
+        if key in expand and reader.peek() == '{':
+            for name, value in _members(reader, ()):
+                yield (key, name), value
+        else:
+            yield key, reader.value()
+
+        char = reader.peek()
+        reader.pos += 1
+
+        if char == '}':
+            return
+        if char != ',':
+            raise ValueError('Expected , or }} at offset {}'.format(reader.pos))
+
+
+def iter_members(fp, expand=('quotes',), chunk_size=CHUNK_SIZE):
+    '''Yield (name, value) for each member of the top-level JSON object read
+       from fp. Members of objects named in expand are yielded as
+       ((name, key), value). fp may be opened in text or binary mode.
+    '''
+
+    return _members(_Reader(fp, chunk_size), tuple(expand))
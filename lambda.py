@@ -6,6 +6,7 @@ from urllib.request import urlopen
 from time import time, strftime, localtime
 import logging
 from currency_config import CURR_ABBRS
+from quotes import QuoteSet, CODES, TO_USD, FROM_USD
 
 '''Currency Exchange Rate program written as a AWS lambda routine.
    Makes one request when invoked and returns HTML to calling browser.
@@ -80,9 +81,11 @@ class CurrencyLayer:
 
             spread = spread / 100                    # convert to percentage
             rate_html += "<br>"
-            for exch, cur_rate in rates['quotes'].items():
-                in_usd = exch[-3:] + '/USD'
-                in_for = 'USD/' + exch[3:]
+            quotes = QuoteSet.from_json(rates)
+            for i in quotes.order:
+                cur_rate = quotes.rates[i]
+                in_usd = TO_USD[i]
+                in_for = FROM_USD[i]
                 usd_spread = (1/cur_rate)*(1+spread)
                 for_spread = cur_rate*(1/(1+spread))
                 _usd = "{}: {:>9.4f} ({:>9.4f})   {}: {:>7.4f} ({:>6.4f})".format(
@@ -92,7 +95,7 @@ class CurrencyLayer:
                         in_for, cur_rate, for_spread,
                         in_usd, 1/cur_rate, usd_spread)
 
-                if exch[3:] in ['EUR', 'GBP', 'AUD', 'BTC']:
+                if CODES[i] in ['EUR', 'GBP', 'AUD', 'BTC']:
                     rate_html += "<pre>" + _usd + "</pre>"
                 else:
                     rate_html += "<pre>" + _for + "</pre>"
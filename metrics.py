@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Per-invocation timing spans and CloudWatch Embedded Metric Format (EMF)
+   output for the Lambda versions of the Currency Exchange Rate program.
+
+   Usage:
+
+       m = metrics.start('currency_lambda', sample_rate=0.01)
+       with metrics.span('fragments'):
+           html = fetch_html(url)
+       ...
+       metrics.emit()
+
+   Spans are exclusive: time spent in a nested span is charged to the inner
+   span only, so the span totals add up to the invocation's elapsed time.
+   Functions run on pool or background threads for an invocation should be
+   wrapped with metrics.propagate() so their counters are kept.
+   Each invocation writes one JSON line to stdout which CloudWatch turns
+   into metrics without any extra API calls.
+'''
+
+import os
+import sys
+import threading
+from json import dumps
+from random import random
+from time import time, perf_counter
+from contextlib import contextmanager
+
+NAMESPACE = 'CurrencyMonitor'
+
+_cold_start = True          # True until first invocation in this container
+_output = None              # Stream for metrics lines, None for stdout
+_local = threading.local()
+
+
+class Metrics:
+    '''Timing and counter data collected during a single invocation'''
+
+    def __init__(self, function, sample_rate=0.0, cold_start=False):
+
+        self.function = function
+        self.cold_start = cold_start
+        self.sampled = random() < sample_rate
+        self.spans = {}
+        self.counts = {}
+        self.properties = {}
+        self._lock = threading.Lock()
+        self._start = perf_counter()
+
+    def add(self, name, secs):
+        '''Charge secs to the named span'''
+
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + secs
+
+    def count(self, name, value=1):
+        '''Increment the named counter'''
+
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def elapsed(self):
+        '''Seconds since the invocation started'''
+
+        return perf_counter() - self._start
+
+    def record(self):
+        '''Return EMF formatted dictionary for this invocation'''
+
+        fields = {name + '_ms': round(secs * 1000, 3)
+                  for name, secs in self.spans.items()}
+        fields['total_ms'] = round(self.elapsed() * 1000, 3)
+
+        metric_defs = [{'Name': name, 'Unit': 'Milliseconds'}
+                       for name in sorted(fields)]
+
+        for name, value in self.counts.items():
+            fields[name] = value
+            metric_defs.append({'Name': name, 'Unit': 'Count'})
+
+        fields['ColdStart'] = int(self.cold_start)
+        metric_defs.append({'Name': 'ColdStart', 'Unit': 'Count'})
+
+        emf = {
+            '_aws': {
+                'Timestamp': int(time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [['Function']],
+                    'Metrics': metric_defs,
+                    }]
+                },
+            'Function': self.function,
+            'Sampled': self.sampled,
+            }
+        emf.update(self.properties)
+        emf.update(fields)
+
+        return emf
+
+
+def start(function, sample_rate=0.0):
+    '''Begin collecting metrics for a new invocation on this thread. Only
+       the first invocation in the container is flagged as a cold start
+    '''
+
+    global _cold_start
+
+    _local.metrics = Metrics(function, sample_rate, _cold_start)
+    _cold_start = False
+
+    return _local.metrics
+
+
+def current():
+    '''Return Metrics for the invocation running on this thread. Outside an
+       invocation a throw away object is returned so callers need not check
+    '''
+
+    metrics = getattr(_local, 'metrics', None)
+
+    if metrics is None:
+        metrics = _local.metrics = Metrics('unknown')
+
+    return metrics
+
+
+def propagate(func):
+    '''Wrap func to run with the calling thread's invocation metrics, for
+       work handed to pool or background threads
+    '''
+
+    parent = getattr(_local, 'metrics', None)
+
+    def run(*args, **kwargs):
+        previous = getattr(_local, 'metrics', None)
+        _local.metrics = parent
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.metrics = previous
+
+    return run
+
+
+def sampled():
+    '''True if the current invocation was selected for debug logging'''
+
+    return current().sampled
+
+
+@contextmanager
+def span(name):
+    '''Context manager timing a block of code as the named span'''
+
+    metrics = current()
+    stack = _local.__dict__.setdefault('stack', [])   # Per thread nesting
+    stack.append(0.0)
+    start = perf_counter()
+
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        nested = stack.pop()
+        metrics.add(name, elapsed - nested)
+        if stack:
+            stack[-1] += elapsed
+
+
+def emit(stream=None):
+    '''Write the current invocation's metrics as a single EMF JSON line'''
+
+    line = dumps(current().record(), separators=(',', ':'))
+    (stream or _output or sys.stdout).write(line + '\n')
+
+    return line
+
+
+def set_output(stream):
+    '''Redirect metrics lines, e.g. to a file when benchmarking locally'''
+
+    global _output
+    _output = stream
+
+
+def function_name(default):
+    '''Name used for the Function dimension'''
+
+    return os.environ.get('AWS_LAMBDA_FUNCTION_NAME', default)
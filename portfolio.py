@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Portfolio valuation for the Currency Exchange Rate project.
+
+    Values a portfolio of (currency, amount) positions in any base currency
+    from a single QuoteSet, applying the same bid/ask spread as the web page,
+    and reports the change in value since each baseline horizon:
+
+        python3 portfolio.py positions.csv --base EUR --spread 0.5
+        python3 portfolio.py positions.jsonl --quotes live.json --json
+        python3 portfolio.py - --baselines < positions.csv
+
+    currency_lambda.py answers ?portfolio=EUR:1000,GBP:-250&base=CHF with the
+    same report as JSON, valued against its cached full-universe quotes.
+
+    Position files are CSV with currency and amount columns (header row
+    optional) or JSON lines with currency and amount fields. Positions are
+    read one line at a time and summed into one slot per currency, so a file
+    of any length is valued in one pass over at most len(CODES) amounts.
+
+    Horizons are QuoteSets of earlier USD rates: the DynamoDB baselines
+    shown on the page ('baseline') and the rate history store (see
+    history.py) at each of PORTFOLIO_HORIZONS before the quote time.
+    Positive change means the portfolio gained value in the base currency.
+
+    Author: Michael O'Connor
+"""
+
+import sys
+import csv
+import json
+import argparse
+from array import array
+from math import isnan
+from time import strftime, gmtime
+
+import currency_config as config
+from quotes import QuoteSet, CODES, INDEX, NAN
+
+HISTORY_WINDOW = 7 * 86400      # Look this far back for a horizon's rate
+
+
+def parse_positions(text):
+    """Yield (code, amount) from 'EUR:1000,GBP:-250'"""
+
+    for item in text.split(','):
+        if item.strip():
+            code, _, amount = item.partition(':')
+            yield code, amount
+
+
+def rows_from_csv(fp):
+    """Yield (code, amount) from CSV. If the first row is a header, the
+       currency and amount columns are found by name
+    """
+
+    cur, amt = 0, 1
+    first = True
+
+    for row in csv.reader(fp):
+        if not row or row[0].lstrip().startswith('#'):
+            continue
+        if first:
+            first = False
+            header = [h.strip().lower() for h in row]
+            if 'currency' in header and 'amount' in header:
+                cur, amt = header.index('currency'), header.index('amount')
+                continue
+        if len(row) > max(cur, amt):
+            yield row[cur], row[amt]
+        else:
+            yield '', None
+
+
+def rows_from_jsonl(fp):
+    """Yield (code, amount) from JSON lines"""
+
+    for line in fp:
+        if line.strip():
+            record = json.loads(line)
+            yield str(record.get('currency', '')), record.get('amount')
+
+
+class Portfolio:
+    """Positions summed per currency. amounts is indexed like CODES; held
+       has the indices with positions as keys, in the order first seen
+    """
+
+    __slots__ = ('amounts', 'held', 'unknown', 'positions', 'skipped')
+
+    def __init__(self, positions=()):
+
+        self.amounts = array('d', [0.0]) * len(CODES)
+        self.held = {}
+        self.unknown = {}           # Codes not in CURR_ABBRS -> amount
+        self.positions = 0
+        self.skipped = 0
+
+        for code, amount in positions:
+            self.add(code, amount)
+
+    def add(self, code, amount):
+        """Add one position. Unparseable amounts are counted as skipped"""
+
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            self.skipped += 1
+            return
+
+        if isnan(amount):
+            self.skipped += 1
+            return
+
+        code = code.strip().upper()
+        i = INDEX.get(code)
+        self.positions += 1
+
+        if i is None:
+            self.unknown[code] = self.unknown.get(code, 0.0) + amount
+            return
+
+        if i >= len(self.amounts):
+            self.amounts.extend([0.0] * (i + 1 - len(self.amounts)))
+
+        if i not in self.held:
+            self.held[i] = None
+
+        self.amounts[i] += amount
+
+    def codes(self):
+        """Held currency codes"""
+
+        return [CODES[i] for i in self.held]
+
+    def value(self, quotes, base='USD', spread=0.0, horizons=()):
+        """Return valuation report dictionary.
+
+        Args:
+          quotes - USD QuoteSet including the held currencies and base
+          base - Currency to value in; KeyError if not quoted
+          spread - Percentage spread. Long positions are valued at the bid
+                   (value / (1 + spread%)) and short ones at the ask
+          horizons - Iterable of (name, QuoteSet of earlier USD rates)
+
+        Each holding reports its rate (units per one base), value and bid
+        in base, weight and change (percent) since each horizon
+        """
+
+        now = quotes.rebase(base).rates
+        b = INDEX[base]
+        markup = 1 + spread / 100
+        markdown = 1 / markup
+        size = len(now)
+
+        holdings = []
+        unpriced = dict(self.unknown)
+        total = bid_total = 0.0
+
+        for i in self.held:
+            amount = self.amounts[i]
+            rate = 1.0 if i == b else now[i] if i < size else NAN
+            if isnan(rate) or not rate:
+                unpriced[CODES[i]] = amount
+                continue
+            value = amount / rate
+            if i == b:
+                bid = value
+            else:
+                bid = value * (markdown if value > 0 else markup)
+            total += value
+            bid_total += bid
+            holdings.append({'currency': CODES[i], 'amount': amount,
+                             'rate': rate, 'value': value, 'bid': bid,
+                             'change': {}})
+
+        report = {'base': base,
+                  'spread': spread,
+                  'timestamp': quotes.timestamp,
+                  'positions': self.positions,
+                  'skipped': self.skipped,
+                  'value': total,
+                  'bid': bid_total,
+                  'holdings': holdings,
+                  'change': {},
+                  'unpriced': unpriced}
+
+        # Revalue the same amounts at each horizon's rates. Currencies with
+        # no rate at a horizon are valued at today's rate (no change)
+
+        for name, old in horizons:
+            try:
+                then = old.rebase(base).rates
+            except KeyError:
+                continue
+            then_total = 0.0
+            missing = []
+            for holding in holdings:
+                i = INDEX[holding['currency']]
+                rate = 1.0 if i == b else then[i] if i < len(then) else NAN
+                if isnan(rate) or not rate:
+                    missing.append(holding['currency'])
+                    rate = holding['rate']
+                old_value = holding['amount'] / rate
+                then_total += old_value
+                holding['change'][name] = pct(holding['value'], old_value)
+            report['change'][name] = {'since': old.timestamp,
+                                      'value': then_total,
+                                      'pct': pct(total, then_total),
+                                      'missing': missing}
+
+        for holding in holdings:
+            holding['weight'] = holding['value'] / total * 100 if total else 0.0
+
+        return report
+
+
+def pct(new, old):
+    """Percentage change from old to new"""
+
+    return (new / old - 1) * 100 if old else 0.0
+
+
+def baseline_quotes(items):
+    """QuoteSet from DynamoDB baseline items {abbr: {'Rate', 'Tstamp'}}.
+       The timestamp is that of the oldest baseline
+    """
+
+    rates = {'USD' + abbr: float(item['Rate'])
+             for abbr, item in items.items() if float(item['Rate'])}
+    stamps = [int(item['Tstamp']) for item in items.values()]
+
+    return QuoteSet.from_json({'quotes': rates,
+                               'timestamp': min(stamps) if stamps else 0})
+
+
+def history_quotes(store, codes, when, window=HISTORY_WINDOW):
+    """QuoteSet of the last rate at or before when (and within window
+       seconds of it) for each code in a history store
+    """
+
+    rates = {}
+    stamps = []
+
+    for code in codes:
+        last = None
+        for last in store.series(code, when - window, when):
+            pass
+        if last:
+            stamps.append(last[0])
+            rates['USD' + code] = last[1]
+
+    return QuoteSet.from_json({'quotes': rates,
+                               'timestamp': min(stamps) if stamps else 0})
+
+
+def horizon_quotes(store, codes, now):
+    """Yield (name, QuoteSet) for each of PORTFOLIO_HORIZONS"""
+
+    for name, seconds in config.PORTFOLIO_HORIZONS:
+        quotes = history_quotes(store, codes, now - seconds)
+        if len(quotes):
+            yield name, quotes
+
+
+def read_baseline_table(codes):
+    """DynamoDB baseline items for codes, 100 keys per BatchGetItem"""
+
+    import boto3
+
+    dynamo_db = boto3.resource('dynamodb')
+    items = {}
+    codes = list(codes)
+
+    for start in range(0, len(codes), 100):
+        request = {config.DYNAMO_DB_TABLE: {
+                   'Keys': [{'Abbr': c} for c in codes[start:start + 100]]}}
+        while request:
+            response = dynamo_db.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(config.DYNAMO_DB_TABLE, []):
+                items[item['Abbr']] = item
+            request = response.get('UnprocessedKeys')
+
+    return items
+
+
+def print_report(report):
+    """Human readable report"""
+
+    base = report['base']
+    names = list(report['change'])
+
+    print('{:<6} {:>18} {:>12} {:>18} {:>18} {:>7}'.format(
+          'Code', 'Amount', 'Rate', 'Value ' + base, 'Bid ' + base,
+          'Weight') + ''.join(' {:>8}'.format(n) for n in names))
+
+    for h in sorted(report['holdings'], key=lambda h: -abs(h['value'])):
+        print('{:<6} {:>18,.2f} {:>12.4f} {:>18,.2f} {:>18,.2f} {:>6.1f}%'.
+              format(h['currency'], h['amount'], h['rate'], h['value'],
+                     h['bid'], h['weight'])
+              + ''.join(' {:>+7.2f}%'.format(h['change'][n]) for n in names))
+
+    print('{:<38} {:>18,.2f} {:>18,.2f}'.format(
+          'Total', report['value'], report['bid']))
+
+    for name, change in report['change'].items():
+        print('Change since {} ({}): {:+,.2f} {} ({:+.2f}%)'.format(
+              name, strftime('%Y-%m-%d', gmtime(change['since'])),
+              report['value'] - change['value'], base, change['pct']))
+
+    if report['unpriced']:
+        print('Not valued (no quote): {}'.format(
+              ', '.join(sorted(report['unpriced']))))
+
+    print('{:,} positions, {:,} skipped'.format(report['positions'],
+                                                report['skipped']))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description='Value a currency portfolio in any base currency')
+    parser.add_argument('positions',
+                        help="CSV or .jsonl positions file, '-' for stdin")
+    parser.add_argument('--base', default=config.base_currency)
+    parser.add_argument('--spread', type=float, default=config.api_spread,
+                        help='Spread percentage (default: api_spread)')
+    parser.add_argument('--quotes', metavar='PATH',
+                        help="Currency Layer 'live' JSON instead of PROVIDERS")
+    parser.add_argument('--baselines', action='store_true',
+                        help='Report change since the DynamoDB baselines')
+    parser.add_argument('--store', default=config.HISTORY_STORE,
+                        help="History store for PORTFOLIO_HORIZONS, "
+                             "'dynamodb' or SQLite path ('' to skip)")
+    parser.add_argument('--json', action='store_true',
+                        help='Print the report as JSON')
+    args = parser.parse_args(argv)
+
+    import providers
+
+    base = args.base.upper()
+    rows = rows_from_jsonl if args.positions.endswith('.jsonl') \
+        else rows_from_csv
+
+    if args.positions == '-':
+        portfolio = Portfolio(rows(sys.stdin))
+    else:
+        with open(args.positions, newline='') as fp:
+            portfolio = Portfolio(rows(fp))
+
+    codes = portfolio.codes()
+
+    if args.quotes:
+        provider = providers.FileProvider(args.quotes)
+    else:
+        provider = providers.build(config.PROVIDERS, config.BASE,
+                                   config.CL_KEY, config.HEDGE_AFTER,
+                                   config.PROVIDER_TIMEOUT)
+
+    try:
+        quotes = provider.fetch(None if args.quotes else
+                                ','.join(dict.fromkeys(codes + [base])))
+    except providers.ProviderError as e:
+        print('Error: Unable to read quotes: {}'.format(e))
+        return 1
+
+    horizons = []
+    held = list(dict.fromkeys(codes + [base]))
+
+    if args.baselines:
+        horizons.append(('baseline', baseline_quotes(
+                         read_baseline_table(held))))
+
+    if args.store:
+        import history
+        try:
+            store = history.open_store(args.store)
+            try:
+                horizons += horizon_quotes(store, held, quotes.timestamp)
+            finally:
+                store.close()
+        except Exception as e:
+            print('Warning: Rate history unavailable: {}'.format(e))
+
+    try:
+        report = portfolio.value(quotes, base, args.spread, horizons)
+    except KeyError:
+        print('Error: No quote for base currency {}'.format(base))
+        return 1
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
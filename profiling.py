@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''On-demand profiling of a single invocation.
+
+   profile_call() runs a function under cProfile and tracemalloc and returns
+   its result together with a text report of the functions with the most
+   cumulative time and the source lines which allocated the most memory:
+
+       page, report = profile_call(build_resp, event)
+
+   Both profilers slow the call down considerably, so the report is useful
+   for finding where time goes rather than for absolute timings.
+'''
+
+import io
+import cProfile
+import pstats
+import tracemalloc
+from time import perf_counter
+
+# Allocations made by the profilers themselves are not of interest
+
+_IGNORE = (tracemalloc.Filter(False, tracemalloc.__file__),
+           tracemalloc.Filter(False, cProfile.__file__),
+           tracemalloc.Filter(False, '<frozen importlib._bootstrap>'))
+
+
+def profile_call(func, *args, top=25, frames=1, **kwargs):
+    '''Call func(*args, **kwargs) under cProfile and tracemalloc. Return
+       (result, report) where report lists the top functions by cumulative
+       time and the top allocation sites (frames deep) made during the call
+    '''
+
+    tracing = tracemalloc.is_tracing()
+
+    if not tracing:
+        tracemalloc.start(frames)
+
+    before = tracemalloc.take_snapshot().filter_traces(_IGNORE)
+    profiler = cProfile.Profile()
+    started = perf_counter()
+
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+        elapsed = perf_counter() - started
+        after = tracemalloc.take_snapshot().filter_traces(_IGNORE)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+    out = io.StringIO()
+    out.write('Profiled {} in {:.1f} ms, peak traced memory {:,} bytes\n\n'.
+              format(getattr(func, '__name__', func), elapsed * 1000, peak))
+
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(top)
+
+    out.write('Top {} allocation sites (net change during call)\n\n'.
+              format(top))
+
+    for stat in after.compare_to(before, 'traceback' if frames > 1
+                                 else 'lineno')[:top]:
+        out.write('{}\n'.format(stat))
+        if frames > 1:
+            for line in stat.traceback.format():
+                out.write('    {}\n'.format(line))
+
+    return result, out.getvalue()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Exchange rate providers for the Currency Exchange Rate project.
+
+   A provider has a name and a fetch(codes) method returning a QuoteSet of
+   USD quotes for a comma separated string or list of currency codes (None
+   for every currency the provider knows). fetch() raises ProviderError if
+   no quotes could be obtained.
+
+     CurrencyLayerProvider - the Currency Layer 'live' endpoint
+     FileProvider          - a saved Currency Layer style JSON response, for
+                             tests and offline development
+     HedgedProvider        - tries providers in order, starting the next one
+                             if the current one fails or has not answered
+                             within a latency budget; first answer wins
+
+   build() creates providers from the PROVIDERS list in currency_config.py:
+
+       PROVIDERS = ['currencylayer', 'currencylayer:https://backup/api/',
+                    'file:/opt/fixtures/live.json']
+'''
+
+import logging
+from os import stat
+from time import monotonic
+
+import metrics
+from quotes import decode_quotes
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_pool = None                    # Shared by HedgedProvider instances
+
+
+class ProviderError(Exception):
+    '''No quotes could be obtained from a provider'''
+
+
+def read_quotes(url, timeout=None):
+    '''Open Currency Layer URL and return QuoteSet decoded directly from the
+       response bytes. If the service cannot be reached or reports an error,
+       log detail and raise ProviderError. The raw response is only logged for
+       sampled invocations, as the body text rather than a re-serialized dict
+    '''
+
+    from urllib.request import urlopen
+    from urllib.error import URLError, HTTPError
+
+    try:
+        webUrl = urlopen(url, timeout=timeout)
+        rate_data = webUrl.read()
+    except HTTPError as e:
+        logger.error('In read_quotes()')
+        logger.error('Unable to open: %s', url)
+        logger.error('Error code: %s', e.code)
+        raise ProviderError('HTTP error {}'.format(e.code))
+    except URLError as e:
+        logger.error('Reason: %s', e.reason)
+        raise ProviderError(str(e.reason))
+    except OSError as e:                            # includes timeouts
+        logger.error('In read_quotes(): %s', e)
+        raise ProviderError(str(e))
+
+    if metrics.sampled():
+        logger.info('API response= %s', rate_data.decode('utf-8'))
+
+    try:
+        return decode_quotes(rate_data)
+    except ValueError as e:
+        logger.error('In read_quotes()')
+        logger.error('Error= %s', e)
+        raise ProviderError(str(e))
+
+
+def join_codes(codes):
+    '''List or comma separated string of codes -> comma separated string'''
+
+    return codes if isinstance(codes, str) else ','.join(codes)
+
+
+class CurrencyLayerProvider:
+    '''Quotes from a Currency Layer compatible 'live' endpoint'''
+
+    def __init__(self, base, key, name='currencylayer', timeout=None):
+
+        self.base = base
+        self.key = key
+        self.name = name
+        self.timeout = timeout
+
+    def url(self, codes=None):
+
+        url = self.base + 'live?access_key=' + self.key
+
+        if codes:
+            url += '&currencies=' + join_codes(codes)
+
+        return url
+
+    def fetch(self, codes=None):
+
+        return read_quotes(self.url(codes), self.timeout)
+
+
+class FileProvider:
+    '''Quotes from a file holding a Currency Layer 'live' response. The file
+       is re-read when it changes
+    '''
+
+    def __init__(self, path, name=None):
+
+        self.path = path
+        self.name = name or 'file:' + path
+        self.mtime = None
+        self.quotes = None
+
+    def fetch(self, codes=None):
+
+        try:
+            mtime = stat(self.path).st_mtime
+            if mtime != self.mtime:
+                with open(self.path, 'rb') as f:
+                    self.quotes = decode_quotes(f.read())
+                self.mtime = mtime
+        except (OSError, ValueError) as e:
+            raise ProviderError('{}: {}'.format(self.path, e))
+
+        return self.quotes.subset(codes) if codes else self.quotes
+
+
+class HedgedProvider:
+    '''Race a list of providers. The first is started at once; each of the
+       rest is started when the previous one fails or after hedge_after
+       seconds without an answer. The first successful QuoteSet is returned
+       and slower requests are left to finish in the background.
+    '''
+
+    def __init__(self, providers, hedge_after=0.5):
+
+        self.providers = list(providers)
+        self.hedge_after = hedge_after
+        self.name = '+'.join(p.name for p in self.providers)
+
+    def fetch(self, codes=None):
+
+        from concurrent.futures import ThreadPoolExecutor, wait, \
+                                       FIRST_COMPLETED
+
+        global _pool
+
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=8,
+                                       thread_name_prefix='provider')
+
+        waiting = list(self.providers)
+        pending = {}
+        errors = []
+        started = monotonic()
+
+        def launch():
+            provider = waiting.pop(0)
+            pending[_pool.submit(metrics.propagate(provider.fetch),
+                                 codes)] = provider
+
+        launch()
+
+        while pending:
+            done, _ = wait(pending, timeout=self.hedge_after if waiting
+                           else None, return_when=FIRST_COMPLETED)
+
+            if not done:
+                metrics.current().count('hedged_requests')
+                launch()
+                continue
+
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    quotes = future.result()
+                except Exception as e:
+                    errors.append('{}: {}'.format(provider.name, e))
+                    if waiting:
+                        launch()
+                    continue
+
+                if provider is not self.providers[0]:
+                    logger.info('Quotes from %s after %.3fs', provider.name,
+                                monotonic() - started)
+                    metrics.current().count('failover_quotes')
+
+                return quotes
+
+        raise ProviderError('; '.join(errors))
+
+
+def build(specs, base, key, hedge_after=0.5, timeout=None):
+    '''Return a provider for a list of specs:
+
+         'currencylayer'        - Currency Layer at base with key
+         'currencylayer:<base>' - Currency Layer compatible service at <base>
+         'file:<path>'          - FileProvider for <path>
+
+       Provider objects may also be given. Several providers are combined
+       into a HedgedProvider in the order listed.
+    '''
+
+    providers = []
+
+    for spec in specs:
+        if not isinstance(spec, str):
+            providers.append(spec)
+            continue
+
+        kind, _, arg = spec.partition(':')
+
+        if kind == 'currencylayer':
+            providers.append(CurrencyLayerProvider(arg or base, key,
+                                                   name=spec, timeout=timeout))
+        elif kind == 'file':
+            providers.append(FileProvider(arg))
+        else:
+            raise ValueError('Unknown rate provider: {}'.format(spec))
+
+    if not providers:
+        raise ValueError('No rate providers configured')
+
+    if len(providers) == 1:
+        return providers[0]
+
+    return HedgedProvider(providers, hedge_after)
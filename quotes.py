@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Compact quote representation shared by all versions of the program.
+
+   Currency Layer returns quotes as {'USDEUR': 0.877, 'USDGBP': 0.787, ...}.
+   Rather than keeping that dictionary and slicing 'USDEUR'[3:] for every
+   row, a QuoteSet holds:
+
+     rates     - array of float64, one slot per currency in CODES, with NaN
+                 for currencies not quoted
+     order     - tuple of CODES indices which are quoted, in the order the
+                 service returned them (i.e. basket order)
+     timestamp - quote time as UNIX time
+     source    - quote currency, always 'USD' for Currency Layer
+
+   CODES and INDEX are built once from CURR_ABBRS. Codes returned by the
+   service but missing from CURR_ABBRS are appended at run time.
+
+       qs = QuoteSet.from_json(response)
+       for i in qs.order:
+           print(CODES[i], qs.rates[i])
+'''
+
+from array import array
+from json import loads
+from math import isnan
+
+from currency_config import CURR_ABBRS
+
+NAN = float('nan')
+
+CODES = list(CURR_ABBRS)
+INDEX = {code: i for i, code in enumerate(CODES)}
+
+# Display labels by index, e.g. TO_USD[i] = 'EUR/USD', FROM_USD[i] = 'USD/EUR'
+
+TO_USD = [code + '/USD' for code in CODES]
+FROM_USD = ['USD/' + code for code in CODES]
+
+# Currency Layer quote key to index, e.g. 'USDEUR' -> INDEX['EUR'], so
+# responses are parsed with one dictionary lookup per quote and no slicing
+
+_KEYS = {'USD' + code: i for i, code in enumerate(CODES)}
+_BLANK = array('d', [NAN]) * len(CODES)
+
+_labels = {'USD': (TO_USD, FROM_USD)}
+
+
+def index_of(code):
+    '''Return index for a currency code, registering unknown codes'''
+
+    i = INDEX.get(code)
+
+    if i is None:
+        i = INDEX[code] = _KEYS['USD' + code] = len(CODES)
+        CODES.append(code)
+        TO_USD.append(code + '/USD')
+        FROM_USD.append('USD/' + code)
+        _BLANK.append(NAN)
+
+    return i
+
+
+def labels(base):
+    '''Return display label lists (TO_BASE, FROM_BASE) for a base currency,
+       e.g. labels('EUR') -> (['GBP/EUR', ...], ['EUR/GBP', ...])
+    '''
+
+    pair = _labels.get(base)
+
+    if pair is None or len(pair[0]) < len(CODES):
+        pair = _labels[base] = ([code + '/' + base for code in CODES],
+                                [base + '/' + code for code in CODES])
+
+    return pair
+
+
+def indices(basket):
+    '''Comma separated string or iterable of codes -> tuple of indices.
+       Unknown codes are skipped; only service responses register codes
+    '''
+
+    if isinstance(basket, str):
+        basket = basket.split(',')
+
+    found = (INDEX.get(code.strip().upper()) for code in basket)
+
+    return tuple(i for i in found if i is not None)
+
+
+def decode_quotes(body):
+    '''Decode a Currency Layer response body (bytes) into a QuoteSet. Only
+       success, timestamp, source and quotes are used. Raise ValueError
+       with the service's error info if the request was unsuccessful.
+    '''
+
+    data = loads(body)
+
+    if data.get('success') is False:
+        raise ValueError(data.get('error', {}).get('info', 'Unknown error'))
+
+    return QuoteSet.from_json(data)
+
+
+class QuoteSet:
+    '''Rates for a set of currencies relative to source at one timestamp'''
+
+    __slots__ = ('rates', 'order', 'timestamp', 'source')
+
+    def __init__(self, rates=None, order=(), timestamp=0, source='USD'):
+
+        self.rates = rates if rates is not None \
+                     else array('d', [NAN]) * len(CODES)
+        self.order = tuple(order)
+        self.timestamp = timestamp
+        self.source = source
+
+    @classmethod
+    def from_json(cls, data):
+        '''Build from a Currency Layer response dictionary, or just its
+           'quotes' member
+        '''
+
+        quotes = data['quotes'] if 'quotes' in data else data
+
+        try:
+            order = list(map(_KEYS.__getitem__, quotes))
+        except KeyError:
+            order = [index_of(exch[3:]) for exch in quotes]
+
+        rates = array('d', _BLANK)
+
+        for i, rate in zip(order, quotes.values()):
+            rates[i] = rate
+
+        return cls(rates, order, data.get('timestamp', 0),
+                   data.get('source', 'USD'))
+
+    def to_json(self):
+        '''Return Currency Layer style dictionary'''
+
+        return {'success': True,
+                'timestamp': self.timestamp,
+                'source': self.source,
+                'quotes': {self.source + CODES[i]: self.rates[i]
+                           for i in self.order}}
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        '''Yield (code, rate) in quote order'''
+
+        rates = self.rates
+        for i in self.order:
+            yield CODES[i], rates[i]
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def get(self, code, default=None):
+        '''Rate for code, or default if not quoted'''
+
+        i = INDEX.get(code)
+
+        if i is None or i >= len(self.rates) or isnan(self.rates[i]):
+            return default
+
+        return self.rates[i]
+
+    def codes(self):
+        '''List of quoted currency codes in quote order'''
+
+        return [CODES[i] for i in self.order]
+
+    def subset(self, basket):
+        '''QuoteSet view limited to basket (codes or indices), in basket
+           order. Rates are shared, not copied
+        '''
+
+        if isinstance(basket, str) or (basket and isinstance(
+                next(iter(basket)), str)):
+            basket = indices(basket)
+
+        rates = self.rates
+        seen = set()
+        order = []
+
+        for i in basket:
+            if i < len(rates) and not isnan(rates[i]) and i not in seen:
+                seen.add(i)
+                order.append(i)
+
+        return QuoteSet(rates, order, self.timestamp, self.source)
+
+    def rebase(self, code):
+        '''Return QuoteSet relative to code instead of source, computed from
+           these quotes in one pass over the rate vector. In the new order
+           the base currency's slot is taken by the old source (unless that
+           is already quoted), e.g. USD quotes for EUR,GBP rebased to EUR
+           give USD,GBP. Raise KeyError if code is not quoted.
+        '''
+
+        if code == self.source:
+            return self
+
+        base = self.get(code)
+
+        if not base:
+            raise KeyError(code)
+
+        b = INDEX[code]
+        src = index_of(self.source)
+
+        rates = array('d', [rate / base for rate in self.rates])
+
+        if src >= len(rates):
+            rates.extend([NAN] * (src + 1 - len(rates)))
+        rates[src] = 1 / base
+
+        if src in self.order:
+            order = [i for i in self.order if i != b]
+        else:
+            order = [src if i == b else i for i in self.order]
+
+        return QuoteSet(rates, order, self.timestamp, code)
+
+    def same_rates(self, other):
+        '''True if other quotes exactly the same currencies and rates'''
+
+        return other is not None and self.order == other.order \
+            and all(self.rates[i] == other.rates[i] for i in self.order)
+
+    def diff(self, other):
+        '''Compare with an earlier QuoteSet. Return list of
+           (index, old rate, new rate, percent change) for currencies in
+           both sets, in this set's order. Percent change follows the
+           convention used on the web page: positive means USD weakened.
+        '''
+
+        old_rates = other.rates
+        size = len(old_rates)
+        out = []
+
+        for i in self.order:
+            old = old_rates[i] if i < size else NAN
+            if isnan(old):
+                continue
+            new = self.rates[i]
+            out.append((i, old, new, (1 - new / old) * 100 if old else 0.0))
+
+        return out
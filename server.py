@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Standalone HTTP server for the Currency Exchange Rate page.
+
+   Serves currency_lambda.build_resp() as a WSGI application so the page can
+   be hosted without Lambda and API Gateway, and load tested locally:
+
+       python3 server.py --port 8080 --threads 16 --workers 4
+       curl 'http://localhost:8080/?currencies=EUR,GBP&spread=0.5'
+
+   Query strings are translated into the API Gateway event shape used by
+   lambda_handler(), e.g. {'params': {'querystring': {...}}, 'context':
+   {'source-ip': ...}}. Each worker is a separate process with its own
+   in-process caches (quotes, baselines, fragments and rendered pages), which
+   are shared by all of the worker's threads for the life of the process.
+   Workers share the listening socket, so --workers > 1 needs a platform
+   with fork().
+
+   Lambda housekeeping is replaced by background threads in each worker:
+   caches are saved to SNAPSHOT_PATH every --snapshot-interval seconds, and
+   with --precompute SECONDS the popular pages are re-rendered as by the
+   scheduled EventBridge event.
+
+   'application' is a standard WSGI callable, so any WSGI server may be used
+   instead of the built-in one, e.g. gunicorn -w 4 --threads 16 server
+
+   /health answers 'OK' without rendering, for load balancer checks.
+'''
+
+import os
+import sys
+import signal
+import logging
+import argparse
+import threading
+from time import sleep
+from urllib.parse import parse_qsl
+from socketserver import ThreadingMixIn
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+import metrics
+from metrics import span
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+HEALTH_PATH = '/health'
+
+_lambda = None                  # currency_lambda, imported in each worker
+
+
+def currency_lambda():
+    '''Import currency_lambda on first use. Workers import it after fork()
+       so no process inherits a lock held by another process's thread
+    '''
+
+    global _lambda
+
+    if _lambda is None:
+        import currency_lambda as module
+        _lambda = module
+
+    return _lambda
+
+
+def make_event(environ):
+    '''Translate a WSGI request into the API Gateway event passed to
+       lambda_handler(). Repeated query parameters keep the last value, as
+       API Gateway does
+    '''
+
+    querystring = dict(parse_qsl(environ.get('QUERY_STRING', ''),
+                                 keep_blank_values=True))
+
+    header = {key[5:].replace('_', '-').title(): val
+              for key, val in environ.items() if key.startswith('HTTP_')}
+
+    # Behind a proxy the client is the first X-Forwarded-For address
+
+    forwarded = environ.get('HTTP_X_FORWARDED_FOR')
+
+    if forwarded:
+        source_ip = forwarded.split(',')[0].strip()
+    else:
+        source_ip = environ.get('REMOTE_ADDR', '')
+
+    return {'params': {'path': {}, 'querystring': querystring,
+                       'header': header},
+            'context': {'http-method': environ.get('REQUEST_METHOD', 'GET'),
+                        'resource-path': environ.get('PATH_INFO', '/'),
+                        'source-ip': source_ip,
+                        'user-agent': environ.get('HTTP_USER_AGENT', '')}}
+
+
+def invoke(event):
+    '''Render one request as lambda_handler() does, minus the snapshot,
+       which is saved by a background thread instead
+    '''
+
+    module = currency_lambda()
+    config = module.config
+
+    metrics.start(metrics.function_name('currency_server'),
+                  config.DEBUG_SAMPLE_RATE)
+
+    try:
+        profile = module.profile_mode(event)
+        if profile:
+            return module.profiled_resp(event, profile)
+        with span('render'):
+            return module.build_resp(event)
+    finally:
+        metrics.emit()
+
+
+def application(environ, start_response):
+    '''WSGI entry point'''
+
+    method = environ.get('REQUEST_METHOD', 'GET')
+
+    if method not in ('GET', 'HEAD'):
+        start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD'),
+                                                  ('Content-Length', '0')])
+        return [b'']
+
+    if environ.get('PATH_INFO') == HEALTH_PATH:
+        start_response('200 OK', [('Content-Type', 'text/plain'),
+                                  ('Content-Length', '2')])
+        return [b'OK']
+
+    event = make_event(environ)
+
+    try:
+        body = invoke(event).encode('utf-8')
+    except Exception:
+        logger.exception('Unable to render %s', environ.get('QUERY_STRING'))
+        start_response('500 Internal Server Error',
+                       [('Content-Type', 'text/plain'),
+                        ('Content-Length', '5')])
+        return [b'Error']
+
+    # build_resp() matches parameter names in any case, so match them the
+    # same way here, e.g. ?Suggest=eu is JSON too
+
+    params = {name.lower() for name in event['params']['querystring']}
+
+    if {'suggest', 'portfolio', 'chart'} & params:
+        content_type = 'application/json'
+    else:
+        content_type = 'text/html; charset=utf-8'
+
+    start_response('200 OK', [('Content-Type', content_type),
+                              ('Content-Length', str(len(body))),
+                              ('Cache-Control', 'no-cache')])
+
+    return [b''] if method == 'HEAD' else [body]
+
+
+class PoolServer(WSGIServer):
+    '''WSGIServer which handles connections on a fixed size thread pool
+       rather than one at a time
+    '''
+
+    request_queue_size = 128
+    threads = 8
+
+    def server_activate(self):
+
+        WSGIServer.server_activate(self)
+        self.pool = ThreadPoolExecutor(max_workers=self.threads,
+                                       thread_name_prefix='http')
+
+    def process_request(self, request, client_address):
+
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    # Same as socketserver.ThreadingMixIn, but run on the pool
+
+    process_request_thread = ThreadingMixIn.process_request_thread
+
+    def server_close(self):
+
+        WSGIServer.server_close(self)
+        self.pool.shutdown(wait=False)
+
+
+class QuietHandler(WSGIRequestHandler):
+    '''Request handler which does not log every request to stderr'''
+
+    def log_message(self, format, *args):
+        pass
+
+
+def every(seconds, func, name):
+    '''Call func every seconds in a daemon thread, logging failures'''
+
+    def loop():
+        while True:
+            sleep(seconds)
+            try:
+                func()
+            except Exception:
+                logger.exception('%s failed', name)
+
+    threading.Thread(target=loop, name=name, daemon=True).start()
+
+
+def precompute():
+    '''Run the scheduled precompute() of currency_lambda in this worker'''
+
+    module = currency_lambda()
+
+    metrics.start(metrics.function_name('currency_server'))
+
+    try:
+        result = module.precompute({'detail-type': 'Scheduled Event',
+                                    'detail': {}}, local=True)
+        logger.info('Precompute: %s', {k: len(v) for k, v in result.items()})
+    finally:
+        metrics.emit()
+
+
+def worker(server, args):
+    '''Serve requests in this process until interrupted'''
+
+    module = currency_lambda()
+
+    if args.snapshot_interval and module.config.SNAPSHOT_PATH:
+        every(args.snapshot_interval, module.save_snapshot, 'snapshot')
+
+    if args.precompute:
+        every(args.precompute, precompute, 'precompute')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # A second signal (e.g. forwarded by the parent) must not interrupt
+        # saving the snapshot
+
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+        if module.config.SNAPSHOT_PATH:
+            module.save_snapshot()
+        server.server_close()
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description='Serve the Currency Exchange Rate page over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Request threads per worker (default: 8)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes sharing the port (default: 1)')
+    parser.add_argument('--precompute', type=float, metavar='SECONDS',
+                        help='Re-render popular pages at this interval')
+    parser.add_argument('--snapshot-interval', type=float, default=60,
+                        metavar='SECONDS',
+                        help='Save caches to SNAPSHOT_PATH (0 to disable)')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help="Write EMF metrics lines to PATH ('-' for "
+                             "stdout, the default) or 'none'")
+    parser.add_argument('--access-log', action='store_true',
+                        help='Log every request to stderr')
+    parser.add_argument('--log-level', default='WARNING',
+                        help='Lowest level logged (default: WARNING, as '
+                             'currency_lambda logs every request at INFO)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig()
+
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(args.log_level.upper())
+
+    if args.metrics == 'none':
+        metrics.set_output(open(os.devnull, 'w'))
+    elif args.metrics and args.metrics != '-':
+        metrics.set_output(open(args.metrics, 'a', buffering=1))
+
+    PoolServer.threads = args.threads
+
+    server = make_server(args.host, args.port, application,
+                         server_class=PoolServer,
+                         handler_class=WSGIRequestHandler if args.access_log
+                         else QuietHandler)
+
+    print('Serving on http://{}:{}/ with {} worker(s) x {} thread(s)'.format(
+          args.host, server.server_port, args.workers, args.threads))
+
+    # Stop on SIGTERM (e.g. from a service manager) as on Ctrl-C, saving
+    # the snapshot on the way out
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    if args.workers <= 1:
+        worker(server, args)
+        return 0
+
+    # Pre-fork: every child accepts on the socket bound above
+
+    children = []
+
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            worker(server, args)
+            os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        stop(None, None)
+        for pid in children:
+            os.waitpid(pid, 0)
+
+    server.server_close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
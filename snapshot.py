@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Save and load a compact binary snapshot of the in-process caches used by
+   currency_lambda.py (quotes, DynamoDB baselines and S3 fragments).
+
+   Lambda keeps /tmp between invocations of a container and a recycled
+   container on the same host often finds the previous snapshot still in
+   place, so loading it at init lets a fresh container serve from warm
+   caches instead of refetching everything.
+
+   File layout:
+
+       +-------+---------+--------+---------+------------------+
+       | magic | version | crc32  | length  | marshal payload  |
+       | 4s    | H       | I      | I       | length bytes     |
+       +-------+---------+--------+---------+------------------+
+
+   The payload is written with marshal, which is fast and restricted to
+   core types. Decimal values (DynamoDB numbers) are tagged and restored.
+   Files with the wrong magic, version, length or checksum are ignored.
+'''
+
+import os
+import marshal
+import logging
+from zlib import crc32
+from struct import Struct
+from decimal import Decimal
+
+MAGIC = b'CXSN'
+VERSION = 1
+HEADER = Struct('<4sHII')
+
+_DECIMAL = '__decimal__'
+
+logger = logging.getLogger(__name__)
+
+
+def _pack(value):
+    '''Convert value into types marshal can store'''
+
+    if isinstance(value, Decimal):
+        return (_DECIMAL, str(value))
+    if isinstance(value, dict):
+        return {k: _pack(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return tuple(_pack(v) for v in value)
+    return value
+
+
+def _unpack(value):
+    '''Reverse of _pack()'''
+
+    if isinstance(value, tuple):
+        if len(value) == 2 and value[0] == _DECIMAL:
+            return Decimal(value[1])
+        return tuple(_unpack(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _unpack(v) for k, v in value.items()}
+    return value
+
+
+def save(path, data):
+    '''Atomically write data (dict of caches) to path'''
+
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+
+    try:
+        payload = marshal.dumps(_pack(data))
+        header = HEADER.pack(MAGIC, VERSION, crc32(payload), len(payload))
+        with open(tmp, 'wb') as f:
+            f.write(header + payload)
+        os.replace(tmp, path)
+    except Exception as e:
+        logger.error('Unable to save snapshot %s: %s', path, e)
+        return False
+
+    return True
+
+
+def load(path):
+    '''Read snapshot with a single read and return data, or None if the
+       file is missing, from a different version or damaged
+    '''
+
+    try:
+        with open(path, 'rb') as f:
+            blob = f.read()
+    except OSError:
+        return None
+
+    if len(blob) < HEADER.size:
+        return None
+
+    magic, version, checksum, length = HEADER.unpack_from(blob)
+    payload = memoryview(blob)[HEADER.size:]
+
+    if magic != MAGIC or version != VERSION or len(payload) != length \
+            or crc32(payload) != checksum:
+        logger.error('Ignoring incompatible or damaged snapshot %s', path)
+        return None
+
+    try:
+        return _unpack(marshal.loads(payload))
+    except (ValueError, EOFError, TypeError):
+        logger.error('Unable to decode snapshot %s', path)
+        return None
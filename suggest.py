@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Prefix and token search over the currency codes and names defined in
+   currency_config.CURR_ABBRS, used for the currency picker type-ahead.
+
+   Server side, currency_lambda.py answers '?suggest=<text>' with a short
+   JSON list from search(). Client side, currency.js loads a static copy of
+   the index (CURRENCY_INDEX) once and filters it locally, so most lookups
+   never reach Lambda. Regenerate the static file when CURR_ABBRS changes:
+
+       python3 suggest.py > S3/currency_index.json
+'''
+
+import sys
+import unicodedata
+from json import dumps
+
+from currency_config import CURR_ABBRS
+
+INDEX_VERSION = 1
+MAX_PREFIX = 4                  # Longer queries are filtered after lookup
+
+_index = None
+
+
+def fold(text):
+    '''Lower case and strip accents, e.g. 'Colón' -> 'colon' '''
+
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def tokens(name):
+    '''Searchable words of a currency name'''
+
+    for char in '()-.,ʻ':
+        name = name.replace(char, ' ')
+    return fold(name).split()
+
+
+def build_index(abbrs=CURR_ABBRS):
+    '''Return (entries, prefixes) where entries is a list of
+       (code, name, words) sorted by code and prefixes maps each prefix up to
+       MAX_PREFIX characters of a code or name word to entry positions
+    '''
+
+    entries = [(code, abbrs[code], tokens(abbrs[code]))
+               for code in sorted(abbrs)]
+    prefixes = {}
+
+    for pos, (code, name, words) in enumerate(entries):
+        for word in [code.lower()] + words:
+            for n in range(1, min(len(word), MAX_PREFIX) + 1):
+                hits = prefixes.setdefault(word[:n], [])
+                if not hits or hits[-1] != pos:
+                    hits.append(pos)
+
+    return entries, prefixes
+
+
+def search(query, limit=10, exclude=()):
+    '''Return up to limit (code, name) pairs matching query. Every word of
+       the query must prefix the code or a word of the name. Exact code
+       matches rank first, then code prefixes, then name matches.
+    '''
+
+    global _index
+
+    if _index is None:
+        _index = build_index()
+
+    entries, prefixes = _index
+    words = tokens(query)
+
+    if not words:
+        return []
+
+    candidates = prefixes.get(words[0][:MAX_PREFIX], [])
+    exclude = set(exclude)
+    ranked = []
+
+    for pos in candidates:
+        code, name, name_words = entries[pos]
+        if code in exclude:
+            continue
+        haystack = [code.lower()] + name_words
+        if all(any(w.startswith(q) for w in haystack) for q in words):
+            lower = code.lower()
+            rank = 0 if lower == words[0] else \
+                   1 if lower.startswith(words[0]) else 2
+            ranked.append((rank, code, name))
+
+    ranked.sort()
+
+    return [(code, name) for _, code, name in ranked[:limit]]
+
+
+def suggest_json(query, limit=10, exclude=()):
+    '''search() results as compact JSON for the ?suggest= endpoint'''
+
+    return dumps([{'code': code, 'name': name}
+                  for code, name in search(query, limit, exclude)],
+                 separators=(',', ':'))
+
+
+def index_json(abbrs=CURR_ABBRS):
+    '''Static index file consumed by currency.js'''
+
+    return dumps({'v': INDEX_VERSION,
+                  'currencies': [[code, abbrs[code], ' '.join(tokens(abbrs[code]))]
+                                 for code in sorted(abbrs)]},
+                 separators=(',', ':'), ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    sys.stdout.write(index_json() + '\n')
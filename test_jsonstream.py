@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Tests for jsonstream.py. Values split across chunk boundaries must decode
+   the same as json.loads() of the whole document:
+
+       python3 -m unittest test_jsonstream
+'''
+
+import io
+import json
+import random
+import unittest
+
+from jsonstream import iter_members
+
+DOCUMENT = json.dumps({
+    'success': True,
+    'timeframe': False,
+    'terms': 'https://currencylayer.com/terms',
+    'source': 'USD',
+    'missing': None,
+    'quotes': {
+        'USDEUR': 0.874404,
+        'USDJPY': 109.7515,
+        'USDIRR': 42105.000151,
+        'USDBTC': 1.2345e-05,
+        'USDXAU': 7.7e-4,
+        'USDNEG': -1.5E+10,
+        'USDZER': -0.0,
+        'USDINT': 1000,
+        'USDNAME': 'Euro € "quoted" \\\\ path',
+        },
+    'historical': {'2019-01-01': {'USDEUR': 0.8741, 'USDGBP': 0.78562}},
+    }, ensure_ascii=False)
+
+
+class Trickle(io.RawIOBase):
+    '''File-like object returning 1 to 3 characters (or bytes) per read'''
+
+    def __init__(self, data, seed=0):
+
+        super().__init__()
+
+        self.data = data
+        self.pos = 0
+        self.random = random.Random(seed)
+
+    def read(self, size=-1):
+
+        if size == 0:
+            return self.data[:0]
+
+        end = self.pos + self.random.randint(1, 3)
+        chunk = self.data[self.pos:end]
+        self.pos = end
+        return chunk
+
+    read1 = read
+
+    def readable(self):
+        return True
+
+
+def flatten(doc, expand=('quotes',)):
+    '''Expected iter_members() output for a decoded document'''
+
+    for name, value in doc.items():
+        if name in expand and isinstance(value, dict):
+            for key, member in value.items():
+                yield (name, key), member
+        else:
+            yield name, value
+
+
+class TestIterMembers(unittest.TestCase):
+
+    def test_fixed_small_chunks(self):
+
+        expected = list(flatten(json.loads(DOCUMENT)))
+
+        for size in (1, 2, 3):
+            with self.subTest(chunk_size=size):
+                members = list(iter_members(io.StringIO(DOCUMENT),
+                                            chunk_size=size))
+                self.assertEqual(members, expected)
+
+    def test_varying_chunks(self):
+
+        expected = list(flatten(json.loads(DOCUMENT)))
+
+        for seed in range(50):
+            with self.subTest(seed=seed):
+                members = list(iter_members(Trickle(DOCUMENT, seed)))
+                self.assertEqual(members, expected)
+
+    def test_bytes_split_within_characters(self):
+
+        expected = list(flatten(json.loads(DOCUMENT)))
+        data = DOCUMENT.encode('utf-8')
+
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                members = list(iter_members(Trickle(data, seed)))
+                self.assertEqual(members, expected)
+
+    def test_numbers_at_every_split(self):
+
+        for text in ('-1.5e-3', '0.000123', '1E+10', '123456.789', '-0',
+                     '42'):
+            doc = '{"quotes": {"USDX": ' + text + '}, "n": ' + text + '}'
+            expected = [(('quotes', 'USDX'), json.loads(text)),
+                        ('n', json.loads(text))]
+            for size in (1, 2, 3):
+                with self.subTest(number=text, chunk_size=size):
+                    members = list(iter_members(io.StringIO(doc),
+                                                chunk_size=size))
+                    self.assertEqual(members, expected)
+
+    def test_truncated_document(self):
+
+        with self.assertRaises(ValueError):
+            list(iter_members(io.StringIO(DOCUMENT[:-10]), chunk_size=3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Tests for pages published to PAGE_BUCKET. Each Lambda container has its
+   own page cache, so a page published by one container's precompute()
+   must be served by another container without rendering it again:
+
+       python3 -m unittest test_pages
+'''
+
+import io
+import sys
+import types
+import unittest
+import importlib.util
+from time import time
+from unittest import mock
+
+import currency_config as config
+from quotes import QuoteSet
+
+KEY = ('EUR,GBP,JPY', '1.0', 'USD')
+EVENT = {'params': {'querystring': {'currencies': 'EUR,GBP,JPY'}},
+         'context': {'source-ip': '192.0.2.1'}}
+
+
+class FakeS3:
+    '''In-memory stand-in for the boto3 S3 client calls used for pages'''
+
+    def __init__(self):
+
+        self.objects = {}
+        self.gets = 0
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+
+        self.objects[Bucket, Key] = (Body, dict(Metadata or {}))
+
+    def get_object(self, Bucket, Key):
+
+        self.gets += 1
+
+        if (Bucket, Key) not in self.objects:
+            error = Exception('NoSuchKey')
+            error.response = {'Error': {'Code': 'NoSuchKey'}}
+            raise error
+
+        body, metadata = self.objects[Bucket, Key]
+        return {'Body': io.BytesIO(body), 'Metadata': metadata}
+
+
+def container(name):
+    '''Load currency_lambda afresh, as a new Lambda container would, with
+       its own caches
+    '''
+
+    spec = importlib.util.spec_from_file_location(name, 'currency_lambda.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+class TestPublishedPages(unittest.TestCase):
+
+    def setUp(self):
+
+        self.s3 = FakeS3()
+        boto3 = types.SimpleNamespace(client=lambda service: self.s3)
+
+        for patch in (mock.patch.dict(sys.modules, {'boto3': boto3}),
+                      mock.patch.object(config, 'PAGE_BUCKET', 'pages-bucket'),
+                      mock.patch.object(config, 'SNAPSHOT_PATH', None)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.first = container('first_container')
+        self.second = container('second_container')
+
+    def publish(self, timestamp):
+
+        quotes = QuoteSet.from_json({'timestamp': timestamp,
+                                     'quotes': {'USDEUR': 0.87,
+                                                'USDGBP': 0.78,
+                                                'USDJPY': 109.7}})
+        self.first.publish_page(KEY, '<html>published</html>', quotes)
+
+    def build_resp(self):
+        '''Request the page from the second container, recording whether it
+           had to render it
+        '''
+
+        with mock.patch.object(self.second, 'render_page',
+                               return_value='<html>rendered</html>') as render:
+            html = self.second.build_resp(EVENT)
+
+        return html, render.called
+
+    def test_second_container_hit(self):
+
+        self.publish(int(time()))
+
+        html, rendered = self.build_resp()
+
+        self.assertEqual(html, '<html>published</html>')
+        self.assertFalse(rendered)
+        self.assertEqual(self.s3.gets, 1)
+
+    def test_expired_page_rendered(self):
+
+        self.publish(int(time()) - config.QUOTE_TTL - 1)
+
+        html, rendered = self.build_resp()
+
+        self.assertEqual(html, '<html>rendered</html>')
+        self.assertTrue(rendered)
+
+    def test_missing_page_rendered(self):
+
+        html, rendered = self.build_resp()
+
+        self.assertEqual(html, '<html>rendered</html>')
+        self.assertTrue(rendered)
+
+    def test_no_request_with_current_quotes(self):
+
+        self.publish(int(time()))
+        quotes = QuoteSet.from_json({'timestamp': int(time()),
+                                     'quotes': {'USDEUR': 0.87}})
+        self.second.cache_put('quotes', KEY[0], quotes)
+
+        html, rendered = self.build_resp()
+
+        self.assertEqual(html, '<html>rendered</html>')
+        self.assertEqual(self.s3.gets, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()